@@ -0,0 +1,439 @@
+"""
+Check mutual exclusion of lock factories under load and injected faults
+
+Workers, threads or forked processes, hammer a few shared resources
+through any factory wrapped in a :class:`ChaosLockFactory`, which adds
+latency to every lock call and cuts workers off during partitions. Each
+worker records when it enters and leaves its critical sections and the
+recorded sections are checked for overlaps on the same resource:
+
+* violations: a worker entered while the lock of another could not have
+  expired yet, less than a ttl after that worker started its acquire
+* expired overlaps: the lock of the other worker had expired under it, the
+  ttl is too short for the hold time
+
+A lock whose acquire or release reply was lost in a partition may still
+be held, the worker releases it once its partition is over.
+
+Backends are the ones of :mod:`benchmarks.lockers`, plus ``shared-memory``.
+In process mode the in process stand-ins (memory, fakeredis) are
+not shared between workers and are skipped, use ``shared-memory``, ``sqlite``
+or a real server.
+
+Example:
+
+    Hold locks for 5ms with 16 processes, 1ms of latency and a partition
+    of 200ms every second::
+
+        python -m benchmarks.chaos --backends shared-memory,sqlite --mode process \\
+            --workers 16 --hold 0.005 --latency 0.001 --partition-every 1 --partition-for 0.2 \\
+            --ttls 0.5
+
+    Find the shortest safe ttl for 50ms holds::
+
+        python -m benchmarks.chaos --backends redis --hold 0.05 --ttls 0.02,0.05,0.1
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+
+from libs.lockers import (
+    LOCK_STATE,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+)
+
+from .lockers import BACKENDS as LOCKER_BACKENDS
+from .lockers import FactoryBuilder, close
+
+#: worker index, resource name, time the acquire started, enter and exit
+#: time of a critical section
+Section = Tuple[int, str, float, float, float]
+
+
+class Partitioned(ConnectionError):
+    """Raised by the locks of a worker cut off by a partition"""
+
+
+class ChaosLock(Lock):
+    """
+    Lock wrapping another one with latency and partitions.
+    This lock should be generating using a :class:`ChaosLockFactory` factory.
+
+    Args:
+        chaos: factory holding the fault settings
+        lock: wrapped lock
+    """
+
+    __slots__ = LOCK_STATE + ("chaos", "lock", "resource", "timeout")
+
+    def __init__(self, chaos: "ChaosLockFactory", lock: Lock) -> None:
+        self.token = None
+        self.chaos = chaos
+        self.lock = lock
+        self.resource = lock.resource
+        self.timeout = lock.timeout
+        super().__init__()
+
+    def _call(self, method: Callable[[], bool]) -> bool:
+        self.chaos.delay()
+        if not self.chaos.partitioned():
+            return method()
+        # half the calls reach the server and only the reply is lost
+        if self.chaos.random.random() < 0.5:
+            try:
+                method()
+            except Exception:
+                pass
+        raise Partitioned(f"{self.resource.name} is cut off")
+
+    def acquire(self) -> bool:
+        acquired = self._call(self.lock.acquire)
+        self.token = self.lock.token
+        return acquired
+
+    def release(self) -> bool:
+        return self._call(self.lock.release)
+
+    def extend(self, timeout: timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        return self._call(lambda: self.lock.extend(self.timeout))
+
+    @property
+    def status(self) -> bool:
+        return self._call(lambda: self.lock.status)
+
+
+class ChaosLockFactory(CreateLock):
+    """
+    Factory wrapping the locks of another one with injected faults
+
+    Partitions follow a fixed schedule from ``started``, on the monotonic
+    clock shared by the processes of a host, so forked workers agree on
+    them without talking to each other. Each partition cuts off every
+    other worker, the odd ones then the even ones.
+
+    Args:
+        locker: factory of the wrapped locks
+        worker: index of the worker using the factory
+        latency: seconds added to every call
+        jitter: up to this many seconds added at random to every call
+        partition_every: seconds between the start of two partitions, 0 for none
+        partition_for: length of a partition in seconds
+        started: monotonic time the partition schedule starts at
+
+    Examples:
+
+        Add 1ms of latency to redis locks::
+
+            In [1]: chaos = ChaosLockFactory(redisLocker, latency=0.001)
+
+            In [2]: lock = chaos(LockResource("report"), timedelta(seconds=30))
+    """
+
+    def __init__(
+        self,
+        locker: CreateLock,
+        worker: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        partition_every: float = 0.0,
+        partition_for: float = 0.0,
+        started: float | None = None,
+    ) -> None:
+        self.locker = locker
+        self.worker = worker
+        self.latency = latency
+        self.jitter = jitter
+        self.partition_every = partition_every
+        self.partition_for = partition_for
+        self.started = time.monotonic() if started is None else started
+        self.random = random.Random(worker)
+        super().__init__()
+
+    def __call__(self, resource: LockResource, timeout: timedelta) -> ChaosLock:
+        return ChaosLock(self, self.locker(resource, timeout))
+
+    def delay(self) -> None:
+        """Sleep for the latency of one call"""
+        seconds = self.latency + self.jitter * self.random.random()
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def partitioned(self) -> bool:
+        """Whether this worker is cut off right now"""
+        if self.partition_every <= 0:
+            return False
+        window, offset = divmod(time.monotonic() - self.started, self.partition_every)
+        return offset < self.partition_for and int(window) % 2 == self.worker % 2
+
+
+@dataclass
+class Report:
+    """Data class holding the outcome of a single chaos run"""
+
+    backend: str
+    mode: str
+    workers: int
+    ttl: float
+    hold: float
+    sections: int
+    sections_per_sec: float
+    contention: float
+    errors: int
+    lost_releases: int
+    violations: int
+    expired_overlaps: int
+    max_hold: float
+
+
+def overlaps(sections: List[Section], ttl: float) -> Tuple[int, int]:
+    """
+    Count the critical sections entered while another one held the same resource
+
+    Returns:
+        the overlaps within the ttl of the other section, and the ones
+        after it, where the lock expired under its holder
+    """
+    by_resource: Dict[str, List[Section]] = {}
+    for section in sections:
+        by_resource.setdefault(section[1], []).append(section)
+    violations = expired = 0
+    for resource_sections in by_resource.values():
+        resource_sections.sort(key=lambda section: section[3])
+        # section with the latest exit so far
+        holder: Section | None = None
+        for section in resource_sections:
+            if holder is not None and section[3] < holder[4]:
+                if section[3] < holder[2] + ttl:
+                    violations += 1
+                else:
+                    expired += 1
+            if holder is None or section[4] > holder[4]:
+                holder = section
+    return violations, expired
+
+
+@dataclass
+class _Counts:
+    sections: List[Section]
+    contended: int = 0
+    errors: int = 0
+    lost_releases: int = 0
+
+
+def _release_orphans(orphans: List[ChaosLock]) -> None:
+    """Release the locks whose acquire or release reply was lost in a partition"""
+    for lock in list(orphans):
+        try:
+            lock.release()
+        except Partitioned:
+            continue
+        except Exception:
+            pass
+        orphans.remove(lock)
+
+
+def _worker(
+    index: int,
+    build: FactoryBuilder,
+    options: argparse.Namespace,
+    started: float,
+    deadline: float,
+) -> _Counts:
+    chaos = ChaosLockFactory(
+        build(),
+        worker=index,
+        latency=options.latency,
+        jitter=options.jitter,
+        partition_every=options.partition_every,
+        partition_for=options.partition_for,
+        started=started,
+    )
+    ttl = timedelta(seconds=options.ttl)
+    locks = [chaos(LockResource(f"chaos-{i}"), ttl) for i in range(options.resources)]
+    rng = random.Random(index)
+    counts = _Counts([])
+    #: locks that may still be held on the server
+    orphans: List[ChaosLock] = []
+    while time.monotonic() < deadline:
+        if orphans and not chaos.partitioned():
+            _release_orphans(orphans)
+        lock = locks[rng.randrange(options.resources)]
+        began = time.monotonic()
+        try:
+            lock.acquire()
+        except FailedToAcquireLock:
+            counts.contended += 1
+            continue
+        except Exception as e:
+            counts.errors += 1
+            if isinstance(e, Partitioned):
+                orphans.append(lock)
+            continue
+        enter = time.monotonic()
+        time.sleep(options.hold * (0.5 + rng.random()))
+        counts.sections.append(
+            (index, lock.resource.name, began, enter, time.monotonic())
+        )
+        try:
+            lock.release()
+        except FailedToReleaseLock:
+            counts.lost_releases += 1
+        except Exception as e:
+            counts.errors += 1
+            if isinstance(e, Partitioned):
+                orphans.append(lock)
+    return counts
+
+
+def run(
+    backend: str,
+    build: FactoryBuilder,
+    options: argparse.Namespace,
+) -> Report:
+    """Run ``options.workers`` workers on ``backend`` for ``options.seconds``"""
+    started = time.monotonic() + 0.5
+    deadline = started + options.seconds
+
+    def target(index: int, results) -> None:
+        while time.monotonic() < started:
+            time.sleep(0.001)
+        results.put(_worker(index, build, options, started, deadline))
+
+    if options.mode == "process":
+        context = multiprocessing.get_context("fork")
+        results = context.SimpleQueue()
+        workers = [
+            context.Process(target=target, args=(i, results))
+            for i in range(options.workers)
+        ]
+    else:
+        import queue
+
+        results = queue.SimpleQueue()
+        workers = [
+            threading.Thread(target=target, args=(i, results))
+            for i in range(options.workers)
+        ]
+    for worker in workers:
+        worker.start()
+    counts = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    sections = [section for count in counts for section in count.sections]
+    contended = sum(count.contended for count in counts)
+    violations, expired = overlaps(sections, options.ttl)
+    attempts = len(sections) + contended
+    return Report(
+        backend,
+        options.mode,
+        options.workers,
+        options.ttl,
+        options.hold,
+        len(sections),
+        len(sections) / options.seconds,
+        contended / attempts if attempts else 0.0,
+        sum(count.errors for count in counts),
+        sum(count.lost_releases for count in counts),
+        violations,
+        expired,
+        max((exit - enter for _, _, _, enter, exit in sections), default=0.0),
+    )
+
+
+def _shared_memory() -> FactoryBuilder:
+    from libs.lockers.memory import SharedMemoryLockFactory
+
+    locker = SharedMemoryLockFactory()
+    return lambda: locker
+
+
+BACKENDS: Dict[str, Callable[[], FactoryBuilder | None]] = {
+    **LOCKER_BACKENDS,
+    "shared-memory": _shared_memory,
+}
+
+
+def _process_local(backend: str) -> bool:
+    """Whether the stand-in of ``backend`` lives in the memory of one process"""
+    if backend == "memory":
+        return True
+    if backend == "redis":
+        return not os.environ.get("BENCH_REDIS_URL")
+    return False
+
+
+def _print(reports: List[Report]) -> None:
+    print(
+        "backend       mode     workers    ttl   sections/s  contended  errors"
+        "  lost  violations  expired  max hold"
+    )
+    for r in reports:
+        print(
+            f"{r.backend:<13} {r.mode:<8} {r.workers:>7} {r.ttl:>6.3f}"
+            f" {r.sections_per_sec:>12.0f} {r.contention:>9.1%} {r.errors:>7}"
+            f" {r.lost_releases:>5} {r.violations:>11} {r.expired_overlaps:>8}"
+            f" {r.max_hold * 1e3:>7.1f}ms"
+        )
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument(
+        "--resources",
+        type=int,
+        default=4,
+        help="shared resources, fewer means more contention",
+    )
+    parser.add_argument("--ttls", default="30", help="lock ttls in seconds to try")
+    parser.add_argument(
+        "--hold", type=float, default=0.001, help="mean seconds a lock is held"
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--partition-every", type=float, default=0.0)
+    parser.add_argument("--partition-for", type=float, default=0.0)
+    parser.add_argument("--json", help="write the reports to this file")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for backend in args.backends.split(","):
+        if args.mode == "process" and _process_local(backend):
+            print(f"skipping {backend}, not shared between processes", file=sys.stderr)
+            continue
+        build = BACKENDS[backend]()
+        if build is None:
+            print(f"skipping {backend}, no server configured", file=sys.stderr)
+            continue
+        try:
+            for ttl in map(float, args.ttls.split(",")):
+                args.ttl = ttl
+                reports.append(run(backend, build, args))
+        finally:
+            close(build)
+    _print(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(report) for report in reports], f, indent=2)
+    return 1 if any(report.violations for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
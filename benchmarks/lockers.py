@@ -0,0 +1,319 @@
+"""
+Benchmark lock factories against local stand-in backends
+
+Every backend runs against a local stand-in unless a url for a real
+server is given in the environment:
+
+* memory: :class:`libs.lockers.memory.InMemoryLockFactory`, the baseline
+* redis: fakeredis, or ``BENCH_REDIS_URL``
+* mongodb: needs ``BENCH_MONGO_URL``, skipped otherwise since mongomock
+  can not evaluate the ``$$NOW`` the mongo locks expire on
+* sqlalchemy: a temporary sqlite file, or ``BENCH_SQL_URL``
+* sqlite: :class:`libs.lockers.sqlite.SQLiteLockFactory` on a temporary file
+* zookeeper: needs ``BENCH_ZK_HOSTS``, skipped otherwise
+
+Example:
+
+    Run every backend at 1 to 256 clients and save the results::
+
+        python -m benchmarks.lockers --clients 1,16,256 --json bench.json
+
+    Fail when throughput drops more than 20% from a saved run::
+
+        python -m benchmarks.lockers --compare bench.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+from libs.lockers import CreateLock, FailedToAcquireLock, LockResource
+
+FactoryBuilder = Callable[[], CreateLock]
+
+
+def close(build: FactoryBuilder) -> None:
+    """Close the clients a builder opened, builders keeping one set a ``close`` attribute"""
+    closing = getattr(build, "close", None)
+    if closing is not None:
+        closing()
+
+
+def _memory() -> FactoryBuilder:
+    from libs.lockers.memory import InMemoryLockFactory
+
+    locker = InMemoryLockFactory()
+    return lambda: locker
+
+
+def _redis() -> FactoryBuilder:
+    import redis
+
+    from libs.lockers.redis import RedisLockFactory
+
+    if os.environ.get("BENCH_REDIS_URL"):
+        client = redis.from_url(os.environ["BENCH_REDIS_URL"])
+        client.flushdb()
+    else:
+        import fakeredis
+
+        client = fakeredis.FakeRedis()
+    return lambda: RedisLockFactory(client)
+
+
+def _mongodb() -> FactoryBuilder | None:
+    if not os.environ.get("BENCH_MONGO_URL"):
+        return None
+    from pymongo import MongoClient
+
+    from libs.lockers.mongodb import MongoLockFactory
+
+    client = MongoClient(os.environ["BENCH_MONGO_URL"])
+    client.drop_database("lock_benchmark")
+
+    def build() -> CreateLock:
+        return MongoLockFactory(client.lock_benchmark)
+
+    build.close = client.close
+    return build
+
+
+def _sqlalchemy() -> FactoryBuilder:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from libs.lockers.sqlalchemy import SQLLockFacotory, _create_all
+
+    url = os.environ.get("BENCH_SQL_URL")
+    if not url:
+        url = f"sqlite:///{tempfile.mkdtemp()}/locks.db"
+    engine = create_engine(url)
+    _create_all(engine)
+    return lambda: SQLLockFacotory(Session(engine))
+
+
+def _sqlite() -> FactoryBuilder:
+    from libs.lockers.sqlite import SQLiteLockFactory
+
+    locker = SQLiteLockFactory(f"{tempfile.mkdtemp()}/locks.db")
+    return lambda: locker
+
+
+def _zookeeper() -> FactoryBuilder | None:
+    if not os.environ.get("BENCH_ZK_HOSTS"):
+        return None
+    from kazoo.client import KazooClient
+
+    from libs.lockers.zookeeper import KazooLockFactory
+
+    client = KazooClient(hosts=os.environ["BENCH_ZK_HOSTS"])
+    client.start()
+
+    def build() -> CreateLock:
+        return KazooLockFactory(client)
+
+    def stop() -> None:
+        client.stop()
+        client.close()
+
+    build.close = stop
+    return build
+
+
+BACKENDS: Dict[str, Callable[[], FactoryBuilder | None]] = {
+    "memory": _memory,
+    "redis": _redis,
+    "mongodb": _mongodb,
+    "sqlalchemy": _sqlalchemy,
+    "sqlite": _sqlite,
+    "zookeeper": _zookeeper,
+}
+
+
+@dataclass
+class Result:
+    """
+    Data class holding the outcome of a single benchmark run
+
+    ``ops`` counts the acquires that got the lock, contended and failed
+    attempts are counted apart and left out of the latencies.
+    """
+
+    backend: str
+    clients: int
+    ops: int
+    ops_per_sec: float
+    contended: int
+    contention: float
+    errors: int
+    acquire_p50: float
+    acquire_p99: float
+    release_p50: float
+    release_p99: float
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[percent - 1]
+
+
+def run(
+    backend: str,
+    build: FactoryBuilder,
+    clients: int,
+    seconds: float,
+    resources: int,
+    ttl: timedelta = timedelta(seconds=30),
+) -> Result:
+    """
+    Hammer ``resources`` shared resources from ``clients`` threads for ``seconds``
+
+    Every client builds its own factory with ``build`` so backends with
+    thread bound sessions get one session per client.
+    """
+    acquires: List[List[float]] = [[] for _ in range(clients)]
+    releases: List[List[float]] = [[] for _ in range(clients)]
+    contended = [0] * clients
+    errors = [0] * clients
+    start = threading.Barrier(clients + 1)
+    stop = threading.Event()
+
+    def client(index: int) -> None:
+        locker = build()
+        locks = [locker(LockResource(f"bench-{i}"), ttl) for i in range(resources)]
+        pick = random.Random(index).randrange
+        start.wait()
+        while not stop.is_set():
+            lock = locks[pick(resources)]
+            begin = time.perf_counter()
+            try:
+                lock.acquire()
+            except FailedToAcquireLock:
+                contended[index] += 1
+                continue
+            except Exception:
+                errors[index] += 1
+                continue
+            acquires[index].append(time.perf_counter() - begin)
+            begin = time.perf_counter()
+            try:
+                lock.release()
+            except Exception:
+                errors[index] += 1
+                continue
+            releases[index].append(time.perf_counter() - begin)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    acquire = sorted(sample for samples in acquires for sample in samples)
+    release = sorted(sample for samples in releases for sample in samples)
+    attempts = len(acquire) + sum(contended)
+    return Result(
+        backend,
+        clients,
+        len(acquire),
+        len(acquire) / elapsed,
+        sum(contended),
+        sum(contended) / attempts if attempts else 0.0,
+        sum(errors),
+        _percentile(acquire, 50),
+        _percentile(acquire, 99),
+        _percentile(release, 50),
+        _percentile(release, 99),
+    )
+
+
+def _print(results: List[Result]) -> None:
+    header = (
+        "backend      clients      ops/s  contended  errors"
+        "  acq p50  acq p99  rel p50  rel p99"
+    )
+    print(header)
+    for r in results:
+        print(
+            f"{r.backend:<12} {r.clients:>7} {r.ops_per_sec:>10.0f} {r.contention:>9.1%}"
+            f" {r.errors:>7}"
+            f" {r.acquire_p50 * 1e3:>6.2f}ms {r.acquire_p99 * 1e3:>6.2f}ms"
+            f" {r.release_p50 * 1e3:>6.2f}ms {r.release_p99 * 1e3:>6.2f}ms"
+        )
+
+
+def _regressions(results: List[Result], baseline: str, threshold: float) -> List[str]:
+    with open(baseline) as f:
+        previous = {(r["backend"], r["clients"]): r for r in json.load(f)}
+    failures = []
+    for result in results:
+        old = previous.get((result.backend, result.clients))
+        if old and result.ops_per_sec < old["ops_per_sec"] * (1 - threshold):
+            failures.append(
+                f"{result.backend} at {result.clients} clients: "
+                f"{result.ops_per_sec:.0f} ops/s, was {old['ops_per_sec']:.0f}"
+            )
+    return failures
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--clients", default="1,4,16,64,256")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument(
+        "--resources",
+        type=int,
+        default=64,
+        help="shared resources, fewer means more contention",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--compare", help="fail on regressions against this results file"
+    )
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = []
+    for backend in args.backends.split(","):
+        build = BACKENDS[backend]()
+        if build is None:
+            print(f"skipping {backend}, no server configured", file=sys.stderr)
+            continue
+        try:
+            for clients in map(int, args.clients.split(",")):
+                results.append(
+                    run(backend, build, clients, args.seconds, args.resources)
+                )
+        finally:
+            close(build)
+    _print(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    if args.compare:
+        failures = _regressions(results, args.compare, args.threshold)
+        for failure in failures:
+            print(f"regression: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Celery beat scheduler skipping the tasks whose lock is held
+
+:func:`libs.scheduler.scheduled_task` only checks its lock once the task
+runs on a worker, so beat keeps sending messages for a task that is still
+running and each of them ends in :class:`libs.lockers.FailedToAcquireLock`.
+:class:`LockAwareScheduler` reads the status of the locks of every due
+entry with a single :meth:`libs.lockers.CreateLock.status_many` call and
+does not send the entries whose lock is held.
+
+A skipped entry is not retried, its next run is computed from the skipped
+tick as if it had run, so any number of ticks missed while the lock was
+held turn into at most one run once it is released.
+
+Example:
+
+    Run beat with the locks of the workers::
+
+        In [1]: app.conf.beat_locker = "redis://redis:6379/1"
+
+        In [2]: app.conf.beat_lock_resources = {"nightly-report": "report"}
+
+    then start it with ``celery -A app beat -S libs.beat:LockAwareScheduler``.
+"""
+import logging
+import time
+from typing import Dict, List
+
+from celery.beat import PersistentScheduler, ScheduleEntry
+
+from .lockers import CreateLock, LockResource, registry
+
+LOG = logging.getLogger(__name__)
+
+
+def _locker_of(locker) -> CreateLock:
+    if not locker:
+        raise ValueError("set a locker or the beat_locker setting of the app")
+    if isinstance(locker, str):
+        return registry.get_locker(locker)
+    if isinstance(locker, (list, tuple)):
+        return registry.get_locker(*locker)
+    return locker
+
+
+class LockAwareMixin:
+    """
+    Lock checks added to a celery beat scheduler class
+
+    Args:
+        locker: factory or url(s) of the locks taken by the tasks,
+            defaults to the ``beat_locker`` setting of the app
+        lock_resources: resource name by entry name, defaults to the
+            ``beat_lock_resources`` setting of the app, entries missing from
+            it use the name of their task function like
+            :func:`libs.scheduler.scheduled_task`
+        status_ttl: seconds a bulk status read is reused for
+    """
+
+    def __init__(
+        self,
+        *args,
+        locker: CreateLock | str | None = None,
+        lock_resources: Dict[str, str] | None = None,
+        status_ttl: float = 1.0,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        conf = self.app.conf
+        self.locker = _locker_of(locker or conf.get("beat_locker"))
+        self.lock_resources = dict(
+            lock_resources or conf.get("beat_lock_resources") or {}
+        )
+        self.status_ttl = status_ttl
+        self.skipped: Dict[str, int] = {}
+        self._status: Dict[str, bool] = {}
+        self._read_at = float("-inf")
+
+    def lock_resource(self, entry: ScheduleEntry) -> LockResource:
+        """Resource locked by the task of an entry"""
+        name = self.lock_resources.get(entry.name)
+        return LockResource(name or entry.task.rsplit(".", 1)[-1])
+
+    def _due(self) -> List[ScheduleEntry]:
+        return [entry for entry in self.schedule.values() if self.is_due(entry)[0]]
+
+    def locked(self, entry: ScheduleEntry) -> bool:
+        """
+        Whether the lock of an entry is held
+
+        The locks of all the due entries are read in one call and reused for
+        ``status_ttl`` seconds. Backend errors count as unlocked, the task
+        still checks its lock on the worker.
+        """
+        name = self.lock_resource(entry).name
+        now = time.monotonic()
+        if now - self._read_at >= self.status_ttl or name not in self._status:
+            resources = {self.lock_resource(due).name for due in self._due()}
+            resources.add(name)
+            try:
+                self._status = self.locker.status_many(
+                    [LockResource(resource) for resource in resources]
+                )
+            except Exception:
+                LOG.exception("Could not read the locks of the due entries")
+                self._status = {}
+            self._read_at = now
+        return self._status.get(name, False)
+
+    def apply_entry(self, entry: ScheduleEntry, producer=None) -> None:
+        if self.locked(entry):
+            self.skipped[entry.name] = self.skipped.get(entry.name, 0) + 1
+            LOG.info(
+                "Skipping %s, %s is locked", entry.name, self.lock_resource(entry).name
+            )
+            return
+        super().apply_entry(entry, producer=producer)
+        # sent tasks count as locked until the next read, so entries sharing
+        # the resource are not sent again before the task gets its lock
+        self._status[self.lock_resource(entry).name] = True
+
+
+class LockAwareScheduler(LockAwareMixin, PersistentScheduler):
+    """
+    :class:`celery.beat.PersistentScheduler` skipping the entries whose lock is held
+
+    Examples:
+
+        Start beat with the scheduler::
+
+            celery -A app beat -S libs.beat:LockAwareScheduler
+
+        Use it with an explicit locker::
+
+            In [1]: scheduler = LockAwareScheduler(app, locker=redisLocker)
+    """
@@ -1,7 +1,9 @@
+import sys
+import time
 from abc import ABC, abstractmethod
-from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List
 
 
 class FailedToAcquireLock(Exception):
@@ -16,11 +18,76 @@ class UnknownLockStatus(Exception):
     """Exception used when not able to either lock or release the lock"""
 
 
-@dataclass
+#: separator of the levels of hierarchical resource names
+SEPARATOR = "/"
+
+#: slots a lock class declaring ``__slots__`` needs besides its own attributes
+LOCK_STATE = ("token", "_valid_until", "_hooks_acquired_at")
+
+
+def check_prefix(prefix: str) -> str:
+    """
+    Normalise the prefix given to prefix scoped operations
+
+    Raises:
+        ValueError: the prefix is empty
+    """
+    prefix = prefix.strip(SEPARATOR)
+    if not prefix:
+        raise ValueError("prefix can not be empty")
+    return prefix
+
+
+@dataclass(frozen=True, slots=True, init=False)
 class LockResource:
-    """Data class representing item to lock"""
+    """
+    Data class representing item to lock
+
+    Names can be hierarchical, levels are separated by ``/`` as in
+    ``tenant/job/shard``, and locks can be listed or released by prefix
+    with :meth:`CreateLock.held` and :meth:`CreateLock.release_all`.
+
+    Resources are immutable and hashable, their names are interned so
+    resources and lock tables built for the same name share one string.
+    """
+
+    name: str
+
+    def __init__(self, name: str) -> None:
+        # frozen, set once without the generated __init__ and __post_init__
+        object.__setattr__(self, "name", sys.intern(name))
+
+    @property
+    def parts(self) -> List[str]:
+        """Levels of the name"""
+        return self.name.split(SEPARATOR)
+
+    @property
+    def parents(self) -> List[str]:
+        """Prefixes the resource is under, shortest first"""
+        parts = self.parts
+        return [SEPARATOR.join(parts[:depth]) for depth in range(1, len(parts))]
+
+    def is_under(self, prefix: str) -> bool:
+        """Whether the resource is ``prefix`` or is under it"""
+        prefix = check_prefix(prefix)
+        return self.name == prefix or self.name.startswith(prefix + SEPARATOR)
+
+
+@dataclass(frozen=True)
+class LockState:
+    """
+    Data class describing a held lock, see :meth:`CreateLock.export`
+
+    Args:
+        name: name of the locked resource
+        token: owner token written by the acquire of the lock
+        ttl: time left before the lock expires
+    """
 
     name: str
+    token: str | None
+    ttl: timedelta
 
 
 class Lock(ABC):
@@ -41,8 +108,45 @@ class Lock(ABC):
             with lock() as lock:
                 print lock
 
+    Each acquire writes a unique :attr:`token` with the lock, ``release``
+    and ``extend`` only act on the lock while it still holds that token so
+    a worker whose lock expired can not release the lock of another worker.
+
+    ``acquire``, ``release``, ``extend`` and ``status`` of every subclass are
+    instrumented, see :mod:`libs.lockers.hooks`.
+
+    After an acquire :attr:`validity` tells how long the lock can still be
+    relied on, measured on the local monotonic clock from the moment the
+    acquire started minus a margin for clock drift between hosts of
+    ``drift_factor`` of the ttl plus ``drift_margin``. Both can be set on a
+    lock class.
+
+    The locks of this package declare ``__slots__``, made of their own
+    attributes and :data:`LOCK_STATE`, so creating one allocates no
+    ``__dict__``. Subclasses without ``__slots__`` get a ``__dict__`` as usual.
     """
 
+    __slots__ = ()
+
+    #: share of the ttl kept as a margin for clock drift
+    drift_factor: float = 0.01
+    #: fixed margin for clock drift added to the share of the ttl
+    drift_margin: timedelta = timedelta(milliseconds=2)
+
+    #: owner token written by the last acquire
+    token: str | None = None
+
+    _valid_until: float | None = None
+
+    def __init__(self) -> None:
+        self._valid_until = None
+
+    def __init_subclass__(cls, **kwargs):
+        from .hooks import instrument
+
+        super().__init_subclass__(**kwargs)
+        instrument(cls)
+
     @abstractmethod
     def acquire(ABC) -> bool:
         """Method to get the lock"""
@@ -56,6 +160,42 @@ class Lock(ABC):
     def status(ABC) -> bool:
         """Method to get the lock status"""
 
+    def extend(self, timeout: timedelta | None = None) -> bool:
+        """
+        Method to reset the ttl of a held lock
+
+        Args:
+            timeout: new length of the lock, defaults to the current one
+
+        Raises:
+            FailedToAcquireLock: the lock is no longer held with this lock's token
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can not be extended")
+
+    def drift(self, timeout: timedelta) -> timedelta:
+        """Margin kept for clock drift on a lock of length ``timeout``"""
+        return timeout * self.drift_factor + self.drift_margin
+
+    def _start_validity(self, started: float) -> None:
+        """
+        Start the validity window of a successful acquire
+
+        Called with the monotonic time the acquire started at
+
+        :meta private:
+        """
+        timeout = getattr(self, "timeout", None)
+        if timeout is not None:
+            timeout = timeout - self.drift(timeout)
+            self._valid_until = started + timeout.total_seconds()
+
+    @property
+    def validity(self) -> timedelta:
+        """Time left before the lock may expire, zero when not acquired"""
+        if self._valid_until is None:
+            return timedelta(0)
+        return timedelta(seconds=max(0.0, self._valid_until - time.monotonic()))
+
     def __enter__(self):
         return self.acquire()
 
@@ -91,3 +231,83 @@ class CreateLock(ABC):
 
         :meta public:
         """
+
+    def status_many(
+        self, resources: Iterable[LockResource], timeout: timedelta | None = None
+    ) -> Dict[str, bool]:
+        """
+        Whether each resource is locked
+
+        Reads the status of one lock at a time, backends able to read
+        many locks in one call override it.
+
+        Args:
+            resources: resources to check
+            timeout: length of the locks, only used by backends whose status
+                depends on it such as rate limits, defaults to one second
+
+        Returns:
+            lock status by resource name
+        """
+        timeout = timeout or timedelta(seconds=1)
+        return {resource.name: self(resource, timeout).status for resource in resources}
+
+    def held(self, prefix: str) -> List[str]:
+        """
+        Names of the resources locked at or under ``prefix``
+
+        Args:
+            prefix: name prefix, a whole level such as ``tenant`` or ``tenant/job``
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can not list locks")
+
+    def release_all(self, prefix: str) -> int:
+        """
+        Release every lock at or under ``prefix`` whoever holds it
+
+        Meant for operators, the holders are not told their lock is gone.
+
+        Args:
+            prefix: name prefix, a whole level such as ``tenant`` or ``tenant/job``
+
+        Returns:
+            the number of locks released
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can not release locks")
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """
+        Held locks at or under ``prefix``, every held lock when not set
+
+        Locks are yielded as they are read so a whole table can be streamed,
+        see :mod:`libs.lockers.snapshot`.
+
+        Args:
+            prefix: name prefix, a whole level such as ``tenant`` or ``tenant/job``
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can not export locks")
+
+    def restore(self, states: Iterable[LockState]) -> int:
+        """
+        Lock every free resource of ``states`` with its owner token and time left
+
+        Locks already held in this backend are kept and states without time
+        left are skipped. Owners keep releasing and extending their lock
+        with their token once they use this backend. Every state needs a
+        token, :mod:`libs.lockers.snapshot` gives a new one to the locks
+        exported without an owner.
+
+        Args:
+            states: locks read by :meth:`export`
+
+        Returns:
+            the number of locks restored
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} can not restore locks")
+
+
+def __getattr__(name: str):
+    """Import lock factories on first use, see :mod:`libs.lockers.registry`"""
+    from .registry import lazy_attribute
+
+    return lazy_attribute(name)
@@ -0,0 +1,262 @@
+"""
+Circuit breaker failing fast when a lock backend is unhealthy
+"""
+import datetime
+import logging
+import threading
+import time
+
+from . import (
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    UnknownLockStatus,
+)
+
+LOG = logging.getLogger(__name__)
+
+_LOCK_ERRORS = (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    UnknownLockStatus,
+    NotImplementedError,
+)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker state shared by all the locks of a factory
+
+    The breaker starts ``closed``, after ``failure_threshold`` backend
+    errors in a row it goes ``open`` and calls fail straight away.
+    Every ``reset_timeout`` it goes ``half-open`` and lets
+    ``half_open_max_calls`` probes through, a successful probe closes it
+    and a failed one opens it again.
+
+    Lock contention (:class:`libs.lockers.FailedToAcquireLock` and friends)
+    is not a backend error and does not count as a failure.
+
+    Args:
+        failure_threshold: errors in a row needed to open the breaker
+        reset_timeout: how long the breaker stays open before probing
+        half_open_max_calls: number of probes allowed at once while half open
+        slow_call: calls taking longer than this count as failures
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: datetime.timedelta = datetime.timedelta(seconds=30),
+        half_open_max_calls: int = 1,
+        slow_call: datetime.timedelta | None = None,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout.total_seconds()
+        self.half_open_max_calls = half_open_max_calls
+        self.slow_call = slow_call.total_seconds() if slow_call else None
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._state = self.CLOSED
+        self._mutex = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Current state of the breaker"""
+        with self._mutex:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self.probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """Reserve a call, returns False when the call should fail fast"""
+        with self._mutex:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self.probes < self.half_open_max_calls:
+                self.probes += 1
+                return True
+            return False
+
+    def record(self, duration: float, error: bool) -> None:
+        """Record the outcome of a call reserved with :meth:`allow`"""
+        if self.slow_call is not None and duration > self.slow_call:
+            error = True
+        with self._mutex:
+            if not error:
+                if self._state != self.CLOSED:
+                    LOG.info("Lock backend recovered, closing circuit")
+                self._state, self.failures = self.CLOSED, 0
+                return
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    LOG.warning(
+                        "Opening circuit after %s lock backend failures", self.failures
+                    )
+                self._state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class CircuitBreakerLock(Lock):
+    """
+    Lock guarded by a circuit breaker.
+    This lock should be generating using a :class:`CircuitBreakerLockFactory` factory.
+
+    While the breaker is open calls fail straight away, or go to the
+    fallback locker when one is configured. A lock acquired on the
+    fallback is released on the fallback.
+
+    Args:
+        breaker: breaker shared with the factory
+        locker: factory of the guarded backend
+        resource: resource to lock
+        timeout: length of lock
+        fallback: factory used while the breaker is open
+    """
+
+    __slots__ = (
+        "_valid_until",
+        "_hooks_acquired_at",
+        "breaker",
+        "locker",
+        "resource",
+        "timeout",
+        "fallback",
+        "_lock",
+        "_fallback_lock",
+        "_held",
+    )
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker,
+        locker: CreateLock,
+        resource: LockResource,
+        timeout: datetime.timedelta,
+        fallback: CreateLock | None = None,
+    ) -> None:
+        self.breaker = breaker
+        self.locker = locker
+        self.resource = resource
+        self.timeout = timeout
+        self.fallback = fallback
+        self._lock: Lock | None = None
+        self._fallback_lock: Lock | None = None
+        self._held: Lock | None = None
+        super().__init__()
+
+    @property
+    def token(self) -> str | None:
+        return self._held.token if self._held is not None else None
+
+    @token.setter
+    def token(self, token: str | None) -> None:
+        """Take over a lock of the guarded backend held with ``token``"""
+        if self._lock is None:
+            self._lock = self.locker(self.resource, self.timeout)
+        self._lock.token = token
+        self._held = self._lock if token is not None else None
+
+    def _guarded(self, operation, fail: type):
+        if not self.breaker.allow():
+            if self.fallback is None:
+                raise fail(f"circuit open for {self.resource.name}")
+            if self._fallback_lock is None:
+                self._fallback_lock = self.fallback(self.resource, self.timeout)
+            return self._fallback_lock, operation(self._fallback_lock)
+        start = time.monotonic()
+        try:
+            if self._lock is None:
+                self._lock = self.locker(self.resource, self.timeout)
+            result = operation(self._lock)
+        except _LOCK_ERRORS:
+            self.breaker.record(time.monotonic() - start, error=False)
+            raise
+        except Exception:
+            self.breaker.record(time.monotonic() - start, error=True)
+            raise
+        self.breaker.record(time.monotonic() - start, error=False)
+        return self._lock, result
+
+    def acquire(self) -> bool:
+        self._held, result = self._guarded(
+            lambda lock: lock.acquire(), FailedToAcquireLock
+        )
+        return result
+
+    def release(self) -> bool:
+        if self._held is not None and self._held is self._fallback_lock:
+            result = self._fallback_lock.release()
+        else:
+            _, result = self._guarded(lambda lock: lock.release(), FailedToReleaseLock)
+        self._held = None
+        return result
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        if self._held is not None and self._held is self._fallback_lock:
+            return self._fallback_lock.extend(self.timeout)
+        _, result = self._guarded(
+            lambda lock: lock.extend(self.timeout), FailedToAcquireLock
+        )
+        return result
+
+    @property
+    def status(self) -> bool:
+        return self._guarded(lambda lock: lock.status, UnknownLockStatus)[1]
+
+
+class CircuitBreakerLockFactory(CreateLock):
+    """
+    Factory wrapping any :class:`libs.lockers.CreateLock` in a circuit breaker
+
+    Args:
+        locker: factory of the guarded backend
+        fallback: factory used while the breaker is open,
+            when not set calls fail straight away
+        **breaker_kwargs: settings passed to :class:`CircuitBreaker`
+
+    Examples:
+
+        Fail fast after three mongo errors and probe every ten seconds::
+
+            In [1]: blocker = CircuitBreakerLockFactory(
+               ...:     mongoLocker,
+               ...:     failure_threshold=3,
+               ...:     reset_timeout=timedelta(seconds=10),
+               ...: )
+
+        Fall back to redis while zookeeper is down::
+
+            In [2]: blocker = CircuitBreakerLockFactory(zkLocker, fallback=redisLocker)
+    """
+
+    def __init__(
+        self, locker: CreateLock, fallback: CreateLock | None = None, **breaker_kwargs
+    ) -> None:
+        self.locker = locker
+        self.fallback = fallback
+        self.breaker = CircuitBreaker(**breaker_kwargs)
+        super().__init__()
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> CircuitBreakerLock:
+        return CircuitBreakerLock(
+            self.breaker, self.locker, resource, timeout, self.fallback
+        )
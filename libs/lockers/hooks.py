@@ -0,0 +1,265 @@
+"""
+Listener registry used to instrument every lock operation
+
+Every :class:`libs.lockers.Lock` subclass is instrumented automatically,
+each ``acquire``, ``release``, ``extend`` and ``status`` call emits a :class:`LockEvent`
+to the registered listeners. Nothing but the validity of acquired locks
+is measured while no listener is registered.
+
+Example:
+
+    Log slow acquires::
+
+        In [1]: from libs.lockers import hooks
+
+        In [2]: def slow(event):
+           ...:     if event.duration > 0.1:
+           ...:         print(event)
+
+        In [3]: hooks.add_listener(slow)
+
+    Export metrics to prometheus::
+
+        In [4]: hooks.add_listener(hooks.PrometheusListener())
+"""
+import functools
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List
+
+LOG = logging.getLogger(__name__)
+
+OK = "ok"
+CONTENDED = "contended"
+ERROR = "error"
+
+OPERATIONS = ("acquire", "release", "extend", "status")
+_RESTARTS_VALIDITY = ("acquire", "extend")
+
+
+@dataclass(frozen=True)
+class LockEvent:
+    """
+    Data class describing a single lock operation
+
+    Args:
+        operation: ``acquire``, ``release``, ``extend`` or ``status``
+        backend: class name of the lock
+        resource: name of the locked resource
+        started_at: epoch time the operation started at
+        duration: length of the operation in seconds
+        outcome: ``ok``, ``contended`` when the lock was held or not released,
+            ``error`` when the backend raised anything else
+        hold: seconds the lock was held for, only set on release
+    """
+
+    operation: str
+    backend: str
+    resource: str
+    started_at: float
+    duration: float
+    outcome: str
+    hold: float | None = None
+
+
+Listener = Callable[[LockEvent], None]
+
+_listeners: List[Listener] = []
+
+
+def add_listener(listener: Listener) -> Listener:
+    """Register a callable receiving every :class:`LockEvent`, can be used as a decorator"""
+    _listeners.append(listener)
+    return listener
+
+
+def remove_listener(listener: Listener) -> None:
+    """Unregister a listener added with :func:`add_listener`"""
+    _listeners.remove(listener)
+
+
+def emit(event: LockEvent) -> None:
+    """Send an event to every listener, listener errors are logged and ignored"""
+    for listener in list(_listeners):
+        try:
+            listener(event)
+        except Exception:
+            LOG.exception("Lock listener %r failed", listener)
+
+
+def _wrap(operation: str, func: Callable) -> Callable:
+    from . import FailedToAcquireLock, FailedToReleaseLock
+
+    @functools.wraps(func)
+    def instrumented(self, *args, **kwargs):
+        if not _listeners:
+            if operation in _RESTARTS_VALIDITY:
+                start = time.monotonic()
+                result = func(self, *args, **kwargs)
+                self._start_validity(start)
+                return result
+            if operation == "release":
+                self._valid_until = None
+            return func(self, *args, **kwargs)
+        started_at, start = time.time(), time.monotonic()
+        outcome, hold = ERROR, None
+        try:
+            result = func(self, *args, **kwargs)
+            outcome = OK
+            return result
+        except (FailedToAcquireLock, FailedToReleaseLock):
+            outcome = CONTENDED
+            raise
+        finally:
+            end = time.monotonic()
+            if operation in _RESTARTS_VALIDITY and outcome == OK:
+                self._start_validity(start)
+                if operation == "acquire":
+                    self._hooks_acquired_at = end
+            elif operation == "release":
+                self._valid_until = None
+                acquired_at = getattr(self, "_hooks_acquired_at", None)
+                if acquired_at is not None and outcome == OK:
+                    hold, self._hooks_acquired_at = end - acquired_at, None
+            resource = getattr(self, "resource", None)
+            emit(
+                LockEvent(
+                    operation,
+                    self.__class__.__name__,
+                    getattr(resource, "name", ""),
+                    started_at,
+                    end - start,
+                    outcome,
+                    hold,
+                )
+            )
+
+    instrumented.__instrumented__ = True
+    return instrumented
+
+
+def instrument(cls: type) -> type:
+    """
+    Instrument the lock operations defined on ``cls``
+
+    Called by :class:`libs.lockers.Lock` for every subclass
+
+    :meta private:
+    """
+    for operation in OPERATIONS:
+        attr = cls.__dict__.get(operation)
+        if isinstance(attr, property) and attr.fget is not None:
+            if not getattr(attr.fget, "__instrumented__", False):
+                setattr(cls, operation, attr.getter(_wrap(operation, attr.fget)))
+        elif callable(attr) and not getattr(attr, "__instrumented__", False):
+            if not getattr(attr, "__isabstractmethod__", False):
+                setattr(cls, operation, _wrap(operation, attr))
+    return cls
+
+
+class PrometheusListener:
+    """
+    Listener exporting lock events as prometheus metrics
+
+    Needs the optional ``prometheus_client`` package.
+
+    Args:
+        registry: prometheus registry, defaults to the global registry
+        resource_label: add the resource name as a label,
+            turn off when there are too many resources
+        buckets: latency histogram buckets in seconds
+    """
+
+    def __init__(
+        self,
+        registry=None,
+        resource_label: bool = True,
+        buckets: tuple = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5),
+    ) -> None:
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        self.resource_label = resource_label
+        labels = ["operation", "backend", "outcome"]
+        if resource_label:
+            labels.append("resource")
+        self.latency = Histogram(
+            "ha_task_locker_operation_seconds",
+            "Latency of lock operations",
+            labels,
+            buckets=buckets,
+            registry=registry,
+        )
+        self.contended = Counter(
+            "ha_task_locker_contended_total",
+            "Lock operations that found the lock held",
+            labels[:2] + labels[3:],
+            registry=registry,
+        )
+        self.hold = Histogram(
+            "ha_task_locker_hold_seconds",
+            "Length of time locks were held",
+            ["backend"] + labels[3:],
+            registry=registry,
+        )
+
+    def __call__(self, event: LockEvent) -> None:
+        extra = [event.resource] if self.resource_label else []
+        self.latency.labels(
+            event.operation, event.backend, event.outcome, *extra
+        ).observe(event.duration)
+        if event.outcome == CONTENDED:
+            self.contended.labels(event.operation, event.backend, *extra).inc()
+        if event.hold is not None:
+            self.hold.labels(event.backend, *extra).observe(event.hold)
+
+
+class OpenTelemetryListener:
+    """
+    Listener recording lock events as opentelemetry metrics and spans
+
+    Needs the optional ``opentelemetry-api`` package.
+
+    Args:
+        meter: meter used for metrics, defaults to the global meter provider
+        tracer: tracer used for spans, defaults to the global tracer provider
+    """
+
+    def __init__(self, meter=None, tracer=None) -> None:
+        from opentelemetry import metrics, trace
+
+        meter = meter or metrics.get_meter(__name__)
+        self.tracer = tracer or trace.get_tracer(__name__)
+        self.latency = meter.create_histogram(
+            "ha_task_locker.operation.duration",
+            unit="s",
+            description="Latency of lock operations",
+        )
+        self.contended = meter.create_counter(
+            "ha_task_locker.contended",
+            description="Lock operations that found the lock held",
+        )
+        self.hold = meter.create_histogram(
+            "ha_task_locker.hold.duration",
+            unit="s",
+            description="Length of time locks were held",
+        )
+
+    def __call__(self, event: LockEvent) -> None:
+        attributes = {
+            "lock.operation": event.operation,
+            "lock.backend": event.backend,
+            "lock.resource": event.resource,
+            "lock.outcome": event.outcome,
+        }
+        self.latency.record(event.duration, attributes)
+        if event.outcome == CONTENDED:
+            self.contended.add(1, attributes)
+        if event.hold is not None:
+            self.hold.record(event.hold, attributes)
+        start = int(event.started_at * 1e9)
+        span = self.tracer.start_span(
+            f"lock.{event.operation}", start_time=start, attributes=attributes
+        )
+        span.end(end_time=start + int(event.duration * 1e9))
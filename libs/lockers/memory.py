@@ -0,0 +1,322 @@
+"""
+Lockers keeping their state in memory, for tests and single host deployments
+"""
+import ctypes
+import datetime
+import hashlib
+import heapq
+import multiprocessing
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from . import (
+    LOCK_STATE,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    check_prefix,
+)
+
+
+class _ExpiryTable:
+    """
+    Thread safe table of lock expiry times indexed by a heap
+
+    Expired locks are purged from the top of the heap on every call,
+    released locks leave a stale heap entry that is skipped when it comes up.
+    """
+
+    def __init__(self) -> None:
+        self.mutex = threading.Lock()
+        self.expires: Dict[str, Tuple[float, str]] = {}
+        self.heap: List[Tuple[float, str]] = []
+
+    def _purge(self, now: float) -> None:
+        while self.heap and self.heap[0][0] <= now:
+            expires, name = heapq.heappop(self.heap)
+            if self.expires.get(name, (None,))[0] == expires:
+                del self.expires[name]
+
+    def _set(self, name: str, ttl: float, token: str, now: float) -> None:
+        self.expires[name] = (now + ttl, token)
+        heapq.heappush(self.heap, (now + ttl, name))
+
+    def acquire(self, name: str, ttl: float, token: str) -> bool:
+        with self.mutex:
+            now = time.monotonic()
+            self._purge(now)
+            if name in self.expires:
+                return False
+            self._set(name, ttl, token, now)
+            return True
+
+    def extend(self, name: str, ttl: float, token: str) -> bool:
+        with self.mutex:
+            now = time.monotonic()
+            self._purge(now)
+            if self.expires.get(name, (None, None))[1] != token:
+                return False
+            self._set(name, ttl, token, now)
+            return True
+
+    def release(self, name: str, token: str) -> bool:
+        with self.mutex:
+            self._purge(time.monotonic())
+            if self.expires.get(name, (None, None))[1] != token:
+                return False
+            del self.expires[name]
+            return True
+
+    def locked(self, name: str) -> bool:
+        with self.mutex:
+            self._purge(time.monotonic())
+            return name in self.expires
+
+    def held(self, prefix: str) -> List[str]:
+        with self.mutex:
+            self._purge(time.monotonic())
+            return [
+                name for name in self.expires if LockResource(name).is_under(prefix)
+            ]
+
+    def release_all(self, prefix: str) -> int:
+        with self.mutex:
+            self._purge(time.monotonic())
+            names = [
+                name for name in self.expires if LockResource(name).is_under(prefix)
+            ]
+            for name in names:
+                del self.expires[name]
+            return len(names)
+
+    def export(self, prefix: str | None) -> List[Tuple[str, str, float]]:
+        with self.mutex:
+            now = time.monotonic()
+            self._purge(now)
+            return [
+                (name, token, expires - now)
+                for name, (expires, token) in self.expires.items()
+                if prefix is None or LockResource(name).is_under(prefix)
+            ]
+
+    def restore(self, states: Iterable[Tuple[str, str, float]]) -> int:
+        with self.mutex:
+            now = time.monotonic()
+            self._purge(now)
+            restored = 0
+            for name, token, ttl in states:
+                if ttl > 0 and name not in self.expires:
+                    self._set(name, ttl, token, now)
+                    restored += 1
+            return restored
+
+
+class _SharedTable:
+    """
+    Fixed size open addressing table in shared memory
+
+    Each resource is stored as a 64 bit hash of its name in one of the
+    ``max_probe`` slots following its hash, along with a 64 bit hash of its
+    owner token and its expiry time on the system wide monotonic clock.
+    The table must be created before the worker processes are forked.
+    """
+
+    def __init__(self, slots: int, max_probe: int) -> None:
+        self.slots = slots
+        self.max_probe = min(max_probe, slots)
+        self.mutex = multiprocessing.Lock()
+        self.keys = multiprocessing.RawArray(ctypes.c_uint64, slots)
+        self.owners = multiprocessing.RawArray(ctypes.c_uint64, slots)
+        self.expires = multiprocessing.RawArray(ctypes.c_double, slots)
+
+    @staticmethod
+    def _key(name: str) -> int:
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") | 1
+
+    def _find(self, key: int, now: float) -> Tuple[int, int]:
+        """Slot holding ``key`` or -1, and the first free slot or -1"""
+        free = -1
+        for probe in range(self.max_probe):
+            slot = (key + probe) % self.slots
+            if self.keys[slot] == key:
+                if self.expires[slot] > now:
+                    return slot, free
+                self.keys[slot] = 0
+            if free < 0 and (self.keys[slot] == 0 or self.expires[slot] <= now):
+                free = slot
+        return -1, free
+
+    def acquire(self, name: str, ttl: float, token: str) -> bool:
+        key = self._key(name)
+        with self.mutex:
+            now = time.monotonic()
+            slot, free = self._find(key, now)
+            if slot >= 0:
+                return False
+            if free < 0:
+                raise FailedToAcquireLock(f"shared lock table is full around {name}")
+            self.keys[free] = key
+            self.owners[free] = self._key(token)
+            self.expires[free] = now + ttl
+            return True
+
+    def _owned(self, name: str, token: str, now: float) -> int:
+        slot, _ = self._find(self._key(name), now)
+        if slot >= 0 and self.owners[slot] == self._key(token):
+            return slot
+        return -1
+
+    def extend(self, name: str, ttl: float, token: str) -> bool:
+        with self.mutex:
+            now = time.monotonic()
+            slot = self._owned(name, token, now)
+            if slot < 0:
+                return False
+            self.expires[slot] = now + ttl
+            return True
+
+    def release(self, name: str, token: str) -> bool:
+        with self.mutex:
+            slot = self._owned(name, token, time.monotonic())
+            if slot < 0:
+                return False
+            self.keys[slot] = 0
+            return True
+
+    def locked(self, name: str) -> bool:
+        key = self._key(name)
+        with self.mutex:
+            return self._find(key, time.monotonic())[0] >= 0
+
+    def held(self, prefix: str) -> List[str]:
+        raise NotImplementedError("shared memory locks only keep hashed names")
+
+    release_all = export = restore = held
+
+
+class InMemoryLock(Lock):
+    """
+    In memory lease object used to acquire and release locks.
+    This lock should be generating using a InMemoryLockFactory factory.
+
+    Args:
+        table: table shared by all the locks of the factory
+        resource: resource to lock
+        timeout: length of lock
+    """
+
+    __slots__ = LOCK_STATE + ("table", "resource", "timeout")
+
+    def __init__(
+        self, table, resource: LockResource, timeout: datetime.timedelta
+    ) -> None:
+        self.token = None
+        self.table = table
+        self.resource = resource
+        self.timeout = timeout
+        super().__init__()
+
+    def acquire(self) -> bool:
+        token = uuid.uuid4().hex
+        if not self.table.acquire(
+            self.resource.name, self.timeout.total_seconds(), token
+        ):
+            raise FailedToAcquireLock
+        self.token = token
+        return True
+
+    def release(self) -> bool:
+        if self.token is None or not self.table.release(self.resource.name, self.token):
+            raise FailedToReleaseLock
+        return True
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        if self.token is None or not self.table.extend(
+            self.resource.name, self.timeout.total_seconds(), self.token
+        ):
+            raise FailedToAcquireLock
+        return True
+
+    @property
+    def status(self) -> bool:
+        return self.table.locked(self.resource.name)
+
+
+class InMemoryLockFactory(CreateLock):
+    """
+    Factory to create locks held in the memory of the current process
+
+    Locks are shared between the threads of a single process, expiry uses
+    the monotonic clock so it is not affected by changes to the wall clock.
+
+    Examples:
+
+        Create a lock factory without any server::
+
+            In [1]: from libs.lockers.memory import InMemoryLockFactory
+
+            In [2]: memLocker = InMemoryLockFactory()
+
+            In [3]: lock = memLocker(LockResource("test"), timedelta(seconds=30))
+    """
+
+    def __init__(self) -> None:
+        self.table = self._table()
+        super().__init__()
+
+    def _table(self):
+        return _ExpiryTable()
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> InMemoryLock:
+        return InMemoryLock(self.table, resource, timeout)
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix``, scans every lock of the process"""
+        return self.table.held(check_prefix(prefix))
+
+    def release_all(self, prefix: str) -> int:
+        return self.table.release_all(check_prefix(prefix))
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix``, copied from the table at once"""
+        prefix = check_prefix(prefix) if prefix is not None else None
+        for name, token, ttl in self.table.export(prefix):
+            yield LockState(name, token, datetime.timedelta(seconds=ttl))
+
+    def restore(self, states: Iterable[LockState]) -> int:
+        return self.table.restore(
+            (state.name, state.token, state.ttl.total_seconds()) for state in states
+        )
+
+
+class SharedMemoryLockFactory(InMemoryLockFactory):
+    """
+    Factory to create locks shared by the processes forked from the current one
+
+    The factory has to be created before the processes are forked, for example
+    at import time of the module defining the celery tasks so prefork workers
+    share it. Resource names are stored as 64 bit hashes so locks can not be
+    listed or released by prefix.
+
+    Args:
+        slots: number of locks the table can hold
+        max_probe: number of slots searched for each resource, an acquire
+            raises :class:`libs.lockers.FailedToAcquireLock` when all of them are held
+    """
+
+    def __init__(self, slots: int = 65536, max_probe: int = 32) -> None:
+        self.slots = slots
+        self.max_probe = max_probe
+        super().__init__()
+
+    def _table(self):
+        return _SharedTable(self.slots, self.max_probe)
@@ -1,61 +1,104 @@
 import datetime
 import logging
-from re import T
+import re
+import uuid
+from typing import Iterable, Iterator, List
 from pymongo.database import Collection
-from pymongo import MongoClient
 from pymongo.errors import DuplicateKeyError
-from . import CreateLock, FailedToAcquireLock, Lock, LockResource
+from . import (
+    LOCK_STATE,
+    SEPARATOR,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    check_prefix,
+)
+from .ratelimit import RateLimit, RateLimitFactory, TokenBucket
 
 LOG = logging.getLogger(__name__)
 
 
 class MongoLock(Lock):
+    """
+    MongoDB lease object used to acquire and release locks.
+    This lock should be generating using a MongoLockFactory factory.
+
+    Expiry is computed with the clock of the MongoDB server (``$$NOW``)
+    so the clocks and timezones of the workers do not matter,
+    this needs MongoDB 4.2 or newer.
+    """
+
+    __slots__ = LOCK_STATE + ("coll", "resource", "timeout")
+
     def __init__(
         self, coll: Collection, resource: LockResource, timeout: datetime.timedelta
     ) -> None:
+        self.token = None
         self.coll = coll
         self.resource = resource
         self.timeout = timeout
         super().__init__()
 
+    def _expire_at(self):
+        return {"$add": ["$$NOW", int(self.timeout.total_seconds() * 1000)]}
+
     def acquire(self) -> bool:
-        if not self.resource.name in self.coll.list_collection_names():
-            self.coll.create_collection(self.resource.name)
-        collection = self.coll[self.resource.name]
+        token = uuid.uuid4().hex
         try:
-            collection.insert_one(
-                {"_id": self.resource.name, "date": datetime.datetime.utcnow()}
+            self.coll[self.resource.name].update_one(
+                {
+                    "_id": self.resource.name,
+                    "$expr": {"$lte": ["$expire_at", "$$NOW"]},
+                },
+                [{"$set": {"expire_at": self._expire_at(), "owner": token}}],
+                upsert=True,
             )
-        except DuplicateKeyError as e:
-            item = collection.find_one({"_id": self.resource.name})
-            if (item["date"] + self.timeout) < datetime.datetime.utcnow():
-                collection.find_one_and_delete({"_id": self.resource.name})
-                collection.insert_one(
-                    {"_id": self.resource.name, "date": datetime.datetime.utcnow()}
-                )
-                return True
+        except DuplicateKeyError:
             raise FailedToAcquireLock
+        self.token = token
         return True
 
     def release(self) -> bool:
-        return bool(
-            self.coll[self.resource.name].find_one_and_delete(
-                {"_id": self.resource.name}
-            )
+        result = self.coll[self.resource.name].delete_one(
+            {"_id": self.resource.name, "owner": self.token}
         )
+        if not result.deleted_count:
+            raise FailedToReleaseLock
+        return True
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        result = self.coll[self.resource.name].update_one(
+            {
+                "_id": self.resource.name,
+                "owner": self.token,
+                "$expr": {"$gt": ["$expire_at", "$$NOW"]},
+            },
+            [{"$set": {"expire_at": self._expire_at()}}],
+        )
+        if not result.matched_count:
+            raise FailedToAcquireLock
+        return True
 
     @property
     def status(self) -> bool:
-        collection = self.coll[self.resource.name]
-        item = collection.find_one({"_id": self.resource.name})
-        if item is not None:
-            if not (item["date"] + self.timeout) < datetime.datetime.utcnow():
-                return True
-        return False
+        item = self.coll[self.resource.name].find_one(
+            {"_id": self.resource.name, "$expr": {"$gt": ["$expire_at", "$$NOW"]}}
+        )
+        return item is not None
 
 
 class MongoLockFactory(CreateLock):
-    """Class to create MongoDB locks"""
+    """
+    Class to create MongoDB locks
+
+    Each resource has its own collection named after it, prefix scoped
+    operations find the collections of a prefix with a single filtered
+    ``listCollections`` and then read each of them.
+    """
 
     def __init__(self, client: Collection) -> None:
         self.coll = client
@@ -65,3 +108,188 @@ class MongoLockFactory(CreateLock):
         self, resource: LockResource, timeout: datetime.timedelta
     ) -> MongoLock:
         return MongoLock(self.coll, resource, timeout)
+
+    def _under(self, prefix: str) -> List[str]:
+        """Names of the lock collections at or under ``prefix``"""
+        pattern = f"^{re.escape(check_prefix(prefix))}({re.escape(SEPARATOR)}|$)"
+        return sorted(
+            self.coll.list_collection_names(filter={"name": {"$regex": pattern}})
+        )
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix``"""
+        alive = {"$expr": {"$gt": ["$expire_at", "$$NOW"]}}
+        return [
+            name
+            for name in self._under(prefix)
+            if self.coll[name].find_one({"_id": name, **alive}) is not None
+        ]
+
+    def release_all(self, prefix: str) -> int:
+        alive = {"$expr": {"$gt": ["$expire_at", "$$NOW"]}}
+        return sum(
+            self.coll[name].delete_one({"_id": name, **alive}).deleted_count
+            for name in self._under(prefix)
+        )
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix``, time left is computed by the server"""
+        names = (
+            sorted(self.coll.list_collection_names())
+            if prefix is None
+            else self._under(prefix)
+        )
+        for name in names:
+            for item in self.coll[name].aggregate(
+                [
+                    {
+                        "$match": {
+                            "_id": name,
+                            "$expr": {"$gt": ["$expire_at", "$$NOW"]},
+                        }
+                    },
+                    {
+                        "$project": {
+                            "owner": 1,
+                            "ttl": {"$subtract": ["$expire_at", "$$NOW"]},
+                        }
+                    },
+                ]
+            ):
+                yield LockState(
+                    name,
+                    item.get("owner"),
+                    datetime.timedelta(milliseconds=item["ttl"]),
+                )
+
+    def restore(self, states: Iterable[LockState]) -> int:
+        """
+        Restore the locks with one upsert each
+
+        Every resource has its own collection so there is no single
+        collection to ``insert_many`` into, each upsert only replaces an
+        expired lock like an acquire does.
+        """
+        restored = 0
+        for state in states:
+            if state.ttl <= datetime.timedelta(0):
+                continue
+            ttl = int(state.ttl.total_seconds() * 1000)
+            try:
+                self.coll[state.name].update_one(
+                    {"_id": state.name, "$expr": {"$lte": ["$expire_at", "$$NOW"]}},
+                    [
+                        {
+                            "$set": {
+                                "expire_at": {"$add": ["$$NOW", ttl]},
+                                "owner": state.token,
+                            }
+                        }
+                    ],
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue
+            restored += 1
+        return restored
+
+
+class MongoRateLimit(RateLimit):
+    """
+    MongoDB token bucket refilled and taken from in a single update
+    This lock should be generating using a MongoRateLimitFactory factory.
+
+    Refills are computed with the clock of the MongoDB server (``$$NOW``)
+    like the expiry of :class:`MongoLock`, so the clocks and timezones of
+    the workers do not matter.
+    """
+
+    __slots__ = ("coll",)
+
+    def __init__(
+        self,
+        coll: Collection,
+        bucket: TokenBucket,
+        resource: LockResource,
+        timeout: datetime.timedelta,
+    ) -> None:
+        self.coll = coll
+        super().__init__(bucket, resource, timeout)
+
+    def _refilled(self) -> dict:
+        """Expression of the tokens in the bucket now, a missing bucket is full"""
+        capacity = self.bucket.capacity
+        elapsed = {"$subtract": ["$$NOW", {"$ifNull": ["$date", "$$NOW"]}]}
+        return {
+            "$min": [
+                capacity,
+                {
+                    "$add": [
+                        {"$ifNull": ["$tokens", capacity]},
+                        {
+                            "$multiply": [
+                                {"$max": [0, elapsed]},
+                                self.bucket.per_second / 1000,
+                            ]
+                        },
+                    ]
+                },
+            ]
+        }
+
+    def acquire(self) -> bool:
+        refilled = self._refilled()
+        # the upsert of a missing bucket can race with another one, the
+        # second attempt finds the bucket
+        for _ in range(2):
+            try:
+                self.coll.update_one(
+                    {"_id": self.resource.name, "$expr": {"$gte": [refilled, 1]}},
+                    [
+                        {
+                            "$set": {
+                                "tokens": {"$subtract": [refilled, 1]},
+                                "date": "$$NOW",
+                            }
+                        }
+                    ],
+                    upsert=True,
+                )
+                return True
+            except DuplicateKeyError:
+                LOG.debug("No token left for %s", self.resource.name)
+        raise FailedToAcquireLock
+
+    @property
+    def tokens(self) -> float:
+        items = list(
+            self.coll.aggregate(
+                [
+                    {"$match": {"_id": self.resource.name}},
+                    {"$project": {"tokens": self._refilled()}},
+                ]
+            )
+        )
+        return items[0]["tokens"] if items else self.bucket.capacity
+
+
+class MongoRateLimitFactory(RateLimitFactory):
+    """
+    Class to create MongoDB rate limits
+
+    Buckets are stored in the ``ratelimits`` collection of the given database
+
+    Args:
+        client: database to store the buckets in
+        rate: number of acquires allowed every window
+        burst: number of acquires allowed at once, defaults to ``rate``
+    """
+
+    def __init__(self, client: Collection, rate: int, burst: int | None = None) -> None:
+        self.coll = client["ratelimits"]
+        super().__init__(rate, burst)
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> MongoRateLimit:
+        return MongoRateLimit(self.coll, self.bucket(timeout), resource, timeout)
@@ -1,22 +1,87 @@
 import datetime
-from typing import Counter, List
-import redis
-import os
+import time
+from typing import List
 import logging
-from redis.lock import Lock as RedisClientLock
 
 from . import (
+    LOCK_STATE,
     CreateLock,
     FailedToReleaseLock,
     Lock,
     LockResource,
     FailedToAcquireLock,
-    UnknownLockStatus,
 )
 
 LOG = logging.getLogger(__name__)
 
 
+class MemberHealth:
+    """
+    Health of a single quorom member tracked with exponentially weighted averages
+
+    A member whose error rate or latency goes over the limits is taken out
+    of the fast path for ``cooldown`` and then tried again.
+
+    Args:
+        alpha: weight given to the newest sample
+        max_error_rate: error rate over which the member is taken out
+        max_latency: average latency in seconds over which the member is taken out,
+            ``None`` to never take members out for being slow
+        min_samples: samples needed before the member can be taken out
+        cooldown: length of time the member stays out
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        max_error_rate: float = 0.5,
+        max_latency: float | None = None,
+        min_samples: int = 5,
+        cooldown: datetime.timedelta = datetime.timedelta(seconds=30),
+    ) -> None:
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        self.cooldown = cooldown.total_seconds()
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.samples = 0
+        self.ejected_until = 0.0
+
+    def record(self, latency: float, error: bool = False) -> None:
+        """
+        Record the outcome of a call to the member
+
+        Args:
+            latency: length of the call in seconds
+            error: the member raised something other than a lock failure
+        """
+        if self.samples:
+            self.latency += self.alpha * (latency - self.latency)
+            self.error_rate += self.alpha * (float(error) - self.error_rate)
+        else:
+            self.latency, self.error_rate = latency, float(error)
+        self.samples += 1
+        if self.samples < self.min_samples:
+            return
+        slow = self.max_latency is not None and self.latency > self.max_latency
+        if self.error_rate > self.max_error_rate or slow:
+            LOG.warning(
+                "Taking quorom member out for %ss, error rate %.2f latency %.3fs",
+                self.cooldown,
+                self.error_rate,
+                self.latency,
+            )
+            self.ejected_until = time.monotonic() + self.cooldown
+            self.error_rate, self.samples = 0.0, 0
+
+    @property
+    def healthy(self) -> bool:
+        """False while the member is taken out of the fast path"""
+        return time.monotonic() >= self.ejected_until
+
+
 class QuoromLock(Lock):
     """
     Quorom lease object used to acquire and release locks.
@@ -26,8 +91,10 @@ class QuoromLock(Lock):
         locks: List of lock objects
         resource: resource to lock
         timeout: length of lock
-            this is not used because the lock factory should
-            be passing this data to all the locks
+            this is only used for :attr:`validity` because the lock
+            factory should be passing this data to all the locks
+        weights: vote of each lock, defaults to one each
+        health: health of each lock, defaults to a fresh :class:`MemberHealth` each
 
     Example:
 
@@ -39,13 +106,75 @@ class QuoromLock(Lock):
             True
     """
 
+    __slots__ = LOCK_STATE + (
+        "resource",
+        "locks",
+        "timeout",
+        "weights",
+        "health",
+        "acquired",
+    )
+
     def __init__(
-        self, locks: List[Lock], resource: LockResource, timeout: datetime.timedelta
+        self,
+        locks: List[Lock],
+        resource: LockResource,
+        timeout: datetime.timedelta,
+        weights: List[float] | None = None,
+        health: List[MemberHealth] | None = None,
     ) -> None:
+        self.token = None
         self.resource = resource
         self.locks = locks
+        self.timeout = timeout
+        self.weights = weights or [1] * len(locks)
+        self.health = health or [MemberHealth() for _ in locks]
+        #: index of the members holding the lock since the last acquire
+        self.acquired: List[int] = []
         super().__init__()
 
+    def _has_quorom(self, weight: float) -> bool:
+        return weight * 2 > sum(self.weights)
+
+    def _members(self) -> List[int]:
+        """
+        Index of the members to use, healthy members first ordered by latency
+
+        Unhealthy members are skipped only while the healthy ones can
+        still form a quorom on their own, a skipped member counts as a no vote.
+        """
+        healthy = [i for i, health in enumerate(self.health) if health.healthy]
+        if not self._has_quorom(sum(self.weights[i] for i in healthy)):
+            healthy = list(range(len(self.locks)))
+        return sorted(healthy, key=lambda i: self.health[i].latency)
+
+    def _call(self, index: int, method: str, *args) -> bool:
+        """Call ``method`` on a member and record how it went"""
+        lock = self.locks[index]
+        start = time.monotonic()
+        try:
+            if method == "status":
+                result = bool(lock.status)
+            else:
+                result = bool(getattr(lock, method)(*args))
+        except NotImplementedError:
+            raise
+        except (FailedToAcquireLock, FailedToReleaseLock):
+            self.health[index].record(time.monotonic() - start)
+            raise
+        except Exception as e:
+            self.health[index].record(time.monotonic() - start, error=True)
+            LOG.error(
+                "Quorom member %s failed to %s %s: %s",
+                lock,
+                method,
+                self.resource.name,
+                e,
+            )
+            return False
+        self.health[index].record(time.monotonic() - start)
+        return result
+
     def acquire(self) -> bool:
         """
         Acqure the lock
@@ -65,18 +194,28 @@ class QuoromLock(Lock):
                 In [50]: lock.acquire()
                 Out[50]: True
         """
-        lock_status: Counter = Counter()
-        for lock in self.locks:
+        members = self._members()
+        acquired = 0
+        self.acquired = []
+        for index in members:
             try:
-                lock_status.update([lock.acquire()])
+                if self._call(index, "acquire"):
+                    acquired += self.weights[index]
+                    self.acquired.append(index)
             except FailedToAcquireLock as e:
-                lock_status.update([False])
-                LOG.error(f"Failed to lock {self.resource.name} with {lock}: {e}")
-        if not lock_status[True] > lock_status[False]:
-            for lock in self.locks:
+                LOG.error(
+                    "Failed to lock %s with %s: %s",
+                    self.resource.name,
+                    self.locks[index],
+                    e,
+                )
+        if not self._has_quorom(acquired):
+            # free the members that did lock so they do not block the next attempt
+            members, self.acquired = self.acquired, []
+            for index in members:
                 try:
-                    lock.acquire()
-                except FailedToAcquireLock:
+                    self._call(index, "release")
+                except FailedToReleaseLock:
                     pass
             raise FailedToAcquireLock
         return True
@@ -102,18 +241,54 @@ class QuoromLock(Lock):
         """
         if not self.status:
             raise FailedToReleaseLock
-        for lock in self.locks:
+        # members taken out since the acquire still hold their part of the lock
+        members, self.acquired = self.acquired or self._members(), []
+        for index in members:
             try:
-                lock.release()
+                self._call(index, "release")
             except FailedToReleaseLock as e:
-                LOG.error(f"Failed to Unlock {self.resource.name} with {lock}: {e}")
+                LOG.error(
+                    "Failed to Unlock %s with %s: %s",
+                    self.resource.name,
+                    self.locks[index],
+                    e,
+                )
         if self.status:
             raise FailedToReleaseLock
 
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        """
+        Extend the lock on each of the locks it has
+
+        Raises:
+            libs.lockers.FailedToAcquireLock: a majoraty of the locks could not be extended
+        """
+        self.timeout = timeout or self.timeout
+        extended = 0
+        for index in self.acquired or self._members():
+            try:
+                if self._call(index, "extend", self.timeout):
+                    extended += self.weights[index]
+            except FailedToAcquireLock as e:
+                LOG.error(
+                    "Failed to extend %s with %s: %s",
+                    self.resource.name,
+                    self.locks[index],
+                    e,
+                )
+        if not self._has_quorom(extended):
+            raise FailedToAcquireLock
+        return True
+
     @property
     def status(self) -> bool:
-        lock_status: Counter = Counter([x.status for x in self.locks])
-        return lock_status[True] > lock_status[False]
+        # members taken out since the acquire still hold their part of the lock
+        locked = sum(
+            self.weights[index]
+            for index in self.acquired or self._members()
+            if self._call(index, "status")
+        )
+        return self._has_quorom(locked)
 
 
 class QuoromLockFactory(CreateLock):
@@ -122,6 +297,10 @@ class QuoromLockFactory(CreateLock):
 
     Args:
         lockers: list of :class:`libs.lockers.CreateLock` connection to use for locks`
+        weights: vote of each locker, defaults to one each.
+            A lock is held when the lockers holding it have more than half the total weight.
+        health: :class:`MemberHealth` settings shared by every locker,
+            health is tracked across all the locks created by the factory
 
     Examples:
         Create multiple instances of :class:`libs.lockers.CreateLock`
@@ -130,10 +309,30 @@ class QuoromLockFactory(CreateLock):
             In [1]: lockers = [zkLocker, redisLocker]
 
             In [2]: qlocker = QuoromLockFactory(lockers)
+
+        Give the durable members more weight and take members out
+        when their average latency goes over 50ms::
+
+            In [3]: qlocker = QuoromLockFactory(
+               ...:     [zkLocker, redisLocker, mongoLocker],
+               ...:     weights=[2, 1, 2],
+               ...:     health={"max_latency": 0.05},
+               ...: )
     """
 
-    def __init__(self, lockers: List[CreateLock]) -> None:
+    def __init__(
+        self,
+        lockers: List[CreateLock],
+        weights: List[float] | None = None,
+        health: dict | None = None,
+    ) -> None:
         self.lockers = lockers
+        self.weights = weights or [1] * len(lockers)
+        if len(self.weights) != len(lockers):
+            raise ValueError("weights must have one entry per locker")
+        if any(weight <= 0 for weight in self.weights):
+            raise ValueError("weights must be positive")
+        self.health = [MemberHealth(**(health or {})) for _ in lockers]
         super().__init__()
 
     def __call__(
@@ -159,7 +358,11 @@ class QuoromLockFactory(CreateLock):
         """
 
         return QuoromLock(
-            [lock(resource, timeout) for lock in self.lockers], resource, timeout
+            [lock(resource, timeout) for lock in self.lockers],
+            resource,
+            timeout,
+            self.weights,
+            self.health,
         )
 
 
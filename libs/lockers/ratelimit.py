@@ -0,0 +1,117 @@
+"""
+Token bucket rate limiting built on the lock factory interface
+
+A rate limit behaves like a lock that can be acquired ``rate`` times per
+``timeout`` window (with up to ``burst`` acquires at once) instead of only
+once per ``timeout``. Backend implementations live next to their locks, see
+:class:`libs.lockers.redis.RedisRateLimitFactory`,
+:class:`libs.lockers.mongodb.MongoRateLimitFactory` and
+:class:`libs.lockers.sqlalchemy.SQLRateLimitFactory`.
+"""
+import datetime
+from abc import abstractmethod
+
+from . import LOCK_STATE, CreateLock, Lock, LockResource
+
+
+class TokenBucket:
+    """
+    Token bucket math shared by every rate limit backend
+
+    Args:
+        rate: number of tokens added every window
+        window: length of the window
+        burst: size of the bucket, defaults to ``rate``
+
+    Example:
+
+        Ten executions a minute with bursts of up to fifteen::
+
+            In [1]: bucket = TokenBucket(10, timedelta(minutes=1), burst=15)
+
+            In [2]: bucket.refill(0, 30)
+            Out[2]: 5.0
+    """
+
+    def __init__(
+        self, rate: int, window: datetime.timedelta, burst: int | None = None
+    ) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if window.total_seconds() <= 0:
+            raise ValueError("window must be positive")
+        self.capacity = float(burst if burst is not None else rate)
+        if self.capacity < 1:
+            raise ValueError("burst must allow at least one token")
+        self.per_second = rate / window.total_seconds()
+
+    def refill(self, tokens: float, elapsed: float) -> float:
+        """
+        Tokens in the bucket after ``elapsed`` seconds
+
+        Args:
+            tokens: tokens in the bucket at the last update
+            elapsed: seconds since the last update
+        """
+        return min(self.capacity, tokens + max(0.0, elapsed) * self.per_second)
+
+
+class RateLimit(Lock):
+    """
+    Base rate limit object used to take tokens from a bucket.
+    This lock should be generating using a :class:`RateLimitFactory` factory.
+
+    :meth:`acquire` takes a single token and raises
+    :class:`libs.lockers.FailedToAcquireLock` when the bucket is empty,
+    so a rate limit can be used anywhere a lock can, including
+    :func:`libs.scheduler.scheduled_task`.
+    """
+
+    __slots__ = LOCK_STATE + ("bucket", "resource", "timeout")
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        resource: LockResource,
+        timeout: datetime.timedelta,
+    ) -> None:
+        self.token = None
+        self.bucket = bucket
+        self.resource = resource
+        self.timeout = timeout
+        super().__init__()
+
+    def release(self) -> bool:
+        """Tokens are never given back, releasing is a no-op"""
+        return True
+
+    @property
+    @abstractmethod
+    def tokens(self) -> float:
+        """Tokens currently left in the bucket"""
+
+    @property
+    def status(self) -> bool:
+        """True when the bucket is empty and an acquire would fail"""
+        return self.tokens < 1
+
+
+class RateLimitFactory(CreateLock):
+    """
+    Base factory for rate limits
+
+    The ``timeout`` given when creating a lock is used as the window.
+
+    Args:
+        rate: number of acquires allowed every window
+        burst: number of acquires allowed at once, defaults to ``rate``
+    """
+
+    def __init__(self, rate: int, burst: int | None = None) -> None:
+        self.rate = rate
+        self.burst = burst
+        super().__init__()
+
+    def bucket(self, timeout: datetime.timedelta) -> TokenBucket:
+        """Token bucket for a window of ``timeout``"""
+        return TokenBucket(self.rate, timeout, self.burst)
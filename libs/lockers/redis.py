@@ -1,9 +1,289 @@
 import datetime
-import os
+import hashlib
+import logging
+import threading
+import uuid
+import weakref
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
 
 import redis
 
-from . import CreateLock, FailedToAcquireLock, FailedToReleaseLock, Lock, LockResource
+from . import (
+    LOCK_STATE,
+    SEPARATOR,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    check_prefix,
+)
+from .ratelimit import RateLimit, RateLimitFactory, TokenBucket
+
+LOG = logging.getLogger(__name__)
+
+# KEYS[2..] of the write scripts are the index sets of the parents of the lock,
+# each holds the keys of the locks under its prefix and lives as long as they do
+ACQUIRE_SCRIPT = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    if redis.call('PTTL', KEYS[i]) < tonumber(ARGV[2]) then
+        redis.call('PEXPIRE', KEYS[i], ARGV[2])
+    end
+end
+return 1
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('SREM', KEYS[i], KEYS[1])
+end
+return 1
+"""
+
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+for i = 2, #KEYS do
+    if redis.call('PTTL', KEYS[i]) < tonumber(ARGV[2]) then
+        redis.call('PEXPIRE', KEYS[i], ARGV[2])
+    end
+end
+return 1
+"""
+
+# KEYS[1] is the index set of a prefix and KEYS[2] the lock named after the prefix
+HELD_SCRIPT = """
+local held = {}
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    held[1] = KEYS[2]
+end
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if redis.call('EXISTS', key) == 1 then
+        held[#held + 1] = key
+    else
+        redis.call('SREM', KEYS[1], key)
+    end
+end
+return held
+"""
+
+RELEASE_ALL_SCRIPT = """
+local released = redis.call('DEL', KEYS[2])
+for _, key in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    released = released + redis.call('DEL', key)
+end
+redis.call('DEL', KEYS[1])
+return released
+"""
+
+STATUS_SCRIPT = """
+return {redis.call('GET', KEYS[1]), redis.call('PTTL', KEYS[1])}
+"""
+
+BULK_STATUS_SCRIPT = """
+local holders = {}
+for i, key in ipairs(KEYS) do
+    holders[i] = {redis.call('GET', key), redis.call('PTTL', key)}
+end
+return holders
+"""
+
+RATE_LIMIT_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local per_ms = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * per_ms)
+if requested == 0 or tokens < requested then
+    return {0, tostring(tokens)}
+end
+tokens = tokens - requested
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / per_ms) + 1)
+return {1, tostring(tokens)}
+"""
+
+
+def hash_tag_key(name: str, depth: int) -> str:
+    """
+    Redis key of a resource with the first ``depth`` levels of its name,
+    split on :data:`libs.lockers.SEPARATOR`, as a cluster hash tag so every
+    resource under them lands in one slot
+
+    Names already holding a ``{tag}`` are kept as they are.
+
+    Examples:
+
+        Keep the locks of a tenant in one slot::
+
+            In [1]: hash_tag_key("tenant-1/report/7", 1)
+            Out[1]: '{tenant-1}/report/7'
+    """
+    if depth <= 0 or "{" in name:
+        return name
+    parts = name.split(SEPARATOR)
+    tag, rest = SEPARATOR.join(parts[:depth]), SEPARATOR.join(parts[depth:])
+    return f"{{{tag}}}{SEPARATOR}{rest}" if rest else f"{{{tag}}}"
+
+
+class RedisScripts:
+    """
+    Lua scripts of the redis lockers, loaded once per connection pool
+
+    Every operation is a single ``EVALSHA``. The scripts are loaded with one
+    pipelined ``SCRIPT LOAD`` on the first call through a pool and an
+    ``EVAL`` is sent instead whenever the server answers ``NOSCRIPT``,
+    for example after a restart or a failover.
+
+    Use :meth:`for_client` to get the scripts of the pool of a client,
+    a :class:`redis.cluster.RedisCluster` client loads them on every primary.
+    """
+
+    SCRIPTS = {
+        "acquire": ACQUIRE_SCRIPT,
+        "release": RELEASE_SCRIPT,
+        "extend": EXTEND_SCRIPT,
+        "status": STATUS_SCRIPT,
+        "bulk_status": BULK_STATUS_SCRIPT,
+        "held": HELD_SCRIPT,
+        "release_all": RELEASE_ALL_SCRIPT,
+        "rate_limit": RATE_LIMIT_SCRIPT,
+    }
+
+    _pools: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+    _mutex = threading.Lock()
+
+    def __init__(self) -> None:
+        self.shas = {
+            name: hashlib.sha1(script.encode("utf-8")).hexdigest()
+            for name, script in self.SCRIPTS.items()
+        }
+        self.loaded = False
+
+    @classmethod
+    def for_client(cls, r: redis.Redis) -> "RedisScripts":
+        """Scripts shared by every client of the connection pool of ``r``"""
+        pool = getattr(r, "connection_pool", r)
+        scripts = cls._pools.get(pool)
+        if scripts is None:
+            with cls._mutex:
+                scripts = cls._pools.setdefault(pool, cls())
+        return scripts
+
+    def load(self, r: redis.Redis) -> None:
+        """Load every script on the server of ``r`` in a single round trip"""
+        if isinstance(r, redis.RedisCluster):
+            for script in self.SCRIPTS.values():
+                r.script_load(script)
+        else:
+            pipe = r.pipeline(transaction=False)
+            for script in self.SCRIPTS.values():
+                pipe.script_load(script)
+            pipe.execute()
+        self.loaded = True
+
+    def __call__(self, r: redis.Redis, name: str, keys: List[str], args: List):
+        """Run the script ``name`` with a single ``EVALSHA``"""
+        if not self.loaded:
+            self.load(r)
+        try:
+            return r.evalsha(self.shas[name], len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            self.loaded = False
+            return r.eval(self.SCRIPTS[name], len(keys), *keys, *args)
+
+    def many(
+        self, r: redis.Redis, name: str, calls: List[Tuple[List[str], List]]
+    ) -> List:
+        """Run the script ``name`` once per ``(keys, args)`` in a single pipeline"""
+        if not self.loaded:
+            self.load(r)
+        pipe = r.pipeline(transaction=False)
+        for keys, args in calls:
+            pipe.evalsha(self.shas[name], len(keys), *keys, *args)
+        try:
+            return pipe.execute()
+        except redis.exceptions.NoScriptError:
+            self.loaded = False
+            pipe = r.pipeline(transaction=False)
+            for keys, args in calls:
+                pipe.eval(self.SCRIPTS[name], len(keys), *keys, *args)
+            return pipe.execute()
+
+    def wait(
+        self,
+        r: redis.Redis,
+        name: str,
+        keys: List[str],
+        args: List,
+        replicas: int,
+        timeout: datetime.timedelta,
+    ) -> Tuple[object, int]:
+        """
+        Run the script ``name`` followed by ``WAIT`` in the same round trip
+
+        Returns:
+            the reply of the script and the number of replicas that acknowledged it
+        """
+        if not self.loaded:
+            self.load(r)
+        wait_ms = max(1, int(timeout.total_seconds() * 1000))
+        pipe = r.pipeline(transaction=False)
+        pipe.evalsha(self.shas[name], len(keys), *keys, *args)
+        pipe.wait(replicas, wait_ms)
+        try:
+            result, acks = pipe.execute()
+        except redis.exceptions.NoScriptError:
+            self.loaded = False
+            pipe = r.pipeline(transaction=False)
+            pipe.eval(self.SCRIPTS[name], len(keys), *keys, *args)
+            pipe.wait(replicas, wait_ms)
+            result, acks = pipe.execute()
+        return result, acks
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+@dataclass(frozen=True)
+class RedisHolder:
+    """
+    Data class describing who holds a redis lock
+
+    Args:
+        token: owner token of the lock, None when it is not held
+        ttl: time left before the lock expires, None when it is not held
+    """
+
+    token: str | None
+    ttl: datetime.timedelta | None
+
+    @classmethod
+    def from_reply(cls, reply) -> "RedisHolder":
+        """Build from the ``[token, pttl]`` reply of the status scripts"""
+        token, pttl = reply
+        if not token or pttl == -2:
+            return cls(None, None)
+        return cls(
+            _decode(token), datetime.timedelta(milliseconds=pttl) if pttl >= 0 else None
+        )
 
 
 class RedisLock(Lock):
@@ -11,10 +291,19 @@ class RedisLock(Lock):
     Redis lease object used to acquire and release locks.
     This lock should be generating using a RedisLockFactory factory.
 
+    Every operation is a single lua script call, see :class:`RedisScripts`.
+    With ``replicas`` set acquire and extend also wait for that many
+    replicas to acknowledge the write, in the same round trip.
+
     Args:
         r: Redis connection to use for locks
         resource: resource to lock
         timeout: length of lock
+        scripts: lua scripts, defaults to the scripts of the pool of ``r``
+        key: redis key of the lock, defaults to the resource name
+        indexes: keys of the index sets the lock is added to
+        replicas: replicas that must acknowledge acquire and extend
+        replica_timeout: how long to wait for the replicas
 
     Example:
 
@@ -32,45 +321,124 @@ class RedisLock(Lock):
                 ...:     print(lock)
                 ...:
             True
+
+        See who holds the lock and for how long::
+
+            In [18]: lock.holder
+            Out[18]: RedisHolder(token='8c4f...', ttl=datetime.timedelta(seconds=29, microseconds=998000))
     """
 
+    __slots__ = LOCK_STATE + (
+        "r",
+        "resource",
+        "timeout",
+        "scripts",
+        "key",
+        "keys",
+        "replicas",
+        "replica_timeout",
+    )
+
     def __init__(
         self,
         r: redis.Redis,
         resource: LockResource,
         timeout: datetime.timedelta,
-        lock: Lock | None = None,
+        scripts: RedisScripts | None = None,
+        key: str | None = None,
+        replicas: int = 0,
+        replica_timeout: datetime.timedelta = datetime.timedelta(milliseconds=100),
+        indexes: List[str] | None = None,
     ) -> None:
+        self.token = None
+        self.r = r
         self.resource = resource
-        timeout = timeout.microseconds * 1000 + timeout.seconds
-        self.lock = lock or r.lock(resource.name, timeout, blocking_timeout=0)
+        self.timeout = timeout
+        self.scripts = scripts or RedisScripts.for_client(r)
+        self.key = key or resource.name
+        self.keys = [self.key] + (indexes or [])
+        self.replicas = replicas
+        self.replica_timeout = replica_timeout
         super().__init__()
 
+    def _ttl_ms(self) -> int:
+        return max(1, int(self.timeout.total_seconds() * 1000))
+
+    def _write(self, name: str, args: List) -> Tuple[bool, bool]:
+        """Run a write script, returns whether it wrote and was replicated enough"""
+        if not self.replicas:
+            return bool(self.scripts(self.r, name, self.keys, args)), True
+        result, acks = self.scripts.wait(
+            self.r, name, self.keys, args, self.replicas, self.replica_timeout
+        )
+        if result and acks < self.replicas:
+            LOG.warning(
+                "%s of %s replicas acknowledged %s of %s",
+                acks,
+                self.replicas,
+                name,
+                self.resource.name,
+            )
+            return True, False
+        return bool(result), True
+
     def acquire(self) -> bool:
-        if not self.lock.acquire():
+        token = uuid.uuid4().hex
+        written, replicated = self._write("acquire", [token, self._ttl_ms()])
+        if written and not replicated:
+            # not replicated, do not keep a lock a failover could hand out again
+            self.scripts(self.r, "release", self.keys, [token])
+        if not (written and replicated):
             raise FailedToAcquireLock
+        self.token = token
         return True
 
     def release(self) -> bool:
-        try:
-            self.lock.release()
-            return True
-        except redis.exceptions.LockError:
+        if self.token is None or not self.scripts(
+            self.r, "release", self.keys, [self.token]
+        ):
             raise FailedToReleaseLock
+        return True
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        if self.token is None or not all(
+            self._write("extend", [self.token, self._ttl_ms()])
+        ):
+            raise FailedToAcquireLock
+        return True
+
+    @property
+    def holder(self) -> RedisHolder:
+        """Token and time left of whoever holds the lock, read together"""
+        return RedisHolder.from_reply(self.scripts(self.r, "status", [self.key], []))
 
     @property
     def status(self) -> bool:
-        return self.lock.locked()
+        return self.holder.token is not None
 
 
 class RedisLockFactory(CreateLock):
     """
     Factory to create redis locks
 
+    Works with a standalone :class:`redis.Redis`, a
+    :class:`redis.cluster.RedisCluster` or a sentinel discovered master,
+    see :meth:`from_sentinel`.
+
+    Locks with hierarchical names are added to an index set of each of
+    their parents, :meth:`held` and :meth:`release_all` read that set
+    instead of scanning the keyspace. On a cluster only the parents at
+    least ``hash_tag_depth`` deep are indexed, so listing by prefix needs a
+    ``hash_tag_depth`` of at least one.
+
     Args:
         r: Redis connection to use for locks
-        resource: resource to lock
-        timeout: length of lock
+        hash_tag_depth: on a cluster, the number of leading ``/`` separated
+            parts of resource names used as the hash tag of their keys,
+            see :func:`hash_tag_key`
+        replicas: replicas that must acknowledge acquire and extend with ``WAIT``
+        replica_timeout: how long to wait for the replicas
 
     Examples:
 
@@ -87,14 +455,273 @@ class RedisLockFactory(CreateLock):
              In [4]: r = redis.from_url("redis://redis:6379/1")
                ...: ttl = timedelta(seconds=30)
                ...: redisLocker = RedisLockFactory(r)
-    """
 
-    def __init__(self, r: redis.Redis) -> None:
+        Read the holders of many locks at once::
 
+             In [5]: redisLocker.holders([LockResource("a"), LockResource("b")])
+             Out[5]: {'a': RedisHolder(token=None, ttl=None), 'b': RedisHolder(token=None, ttl=None)}
+
+        Spread tenants over the shards of a cluster, keeping each tenant in one slot::
+
+             In [6]: from redis.cluster import RedisCluster
+
+             In [7]: redisLocker = RedisLockFactory(
+               ...:     RedisCluster.from_url("redis://redis-cluster:7000"), hash_tag_depth=1
+               ...: )
+    """
+
+    def __init__(
+        self,
+        r: redis.Redis,
+        hash_tag_depth: int = 0,
+        replicas: int = 0,
+        replica_timeout: datetime.timedelta = datetime.timedelta(milliseconds=100),
+    ) -> None:
         self.r = r
+        self.cluster = isinstance(r, redis.RedisCluster)
+        if self.cluster and replicas:
+            raise ValueError("WAIT for replicas is not supported on a redis cluster")
+        self.hash_tag_depth = hash_tag_depth if self.cluster else 0
+        self.replicas = replicas
+        self.replica_timeout = replica_timeout
+        self.scripts = RedisScripts.for_client(r)
         super().__init__()
 
+    @classmethod
+    def from_sentinel(
+        cls,
+        sentinels: Sequence[Tuple[str, int]],
+        service_name: str,
+        replicas: int = 0,
+        replica_timeout: datetime.timedelta = datetime.timedelta(milliseconds=100),
+        sentinel_kwargs: dict | None = None,
+        **connection_kwargs,
+    ) -> "RedisLockFactory":
+        """
+        Factory locking on the master of ``service_name`` found through sentinel
+
+        The client follows failovers, scripts are sent again on the new master.
+
+        Args:
+            sentinels: ``(host, port)`` of the sentinels
+            service_name: name of the monitored master
+            replicas: replicas that must acknowledge acquire and extend
+            replica_timeout: how long to wait for the replicas
+            sentinel_kwargs: connection settings of the sentinels
+            **connection_kwargs: connection settings of the master
+        """
+        from redis.sentinel import Sentinel
+
+        sentinel = Sentinel(
+            sentinels, sentinel_kwargs=sentinel_kwargs, **connection_kwargs
+        )
+        return cls(
+            sentinel.master_for(service_name),
+            replicas=replicas,
+            replica_timeout=replica_timeout,
+        )
+
+    def key(self, resource: LockResource) -> str:
+        """Redis key of the lock of ``resource``"""
+        return hash_tag_key(resource.name, self.hash_tag_depth)
+
+    def _name(self, key: str) -> str:
+        """Resource name of a lock key"""
+        if self.hash_tag_depth and key.startswith("{"):
+            name = key[1:].replace("}", "", 1)
+            if hash_tag_key(name, self.hash_tag_depth) == key:
+                return name
+        return key
+
+    def index_key(self, prefix: str) -> str:
+        """Redis key of the set indexing the locks under ``prefix``"""
+        return f"lockindex:{hash_tag_key(prefix, self.hash_tag_depth)}"
+
+    def _indexed(self, prefix: str) -> bool:
+        """
+        Whether locks are indexed under ``prefix``
+
+        On a cluster the index set has to be in the slot of the locks under
+        it, so only prefixes at least as deep as the hash tag are indexed,
+        and none without a hash tag.
+        """
+        if not self.cluster:
+            return True
+        return 1 <= self.hash_tag_depth <= len(LockResource(prefix).parts)
+
     def __call__(
         self, resource: LockResource, timeout: datetime.timedelta
     ) -> RedisLock:
-        return RedisLock(self.r, resource, timeout)
+        return RedisLock(
+            self.r,
+            resource,
+            timeout,
+            self.scripts,
+            self.key(resource),
+            self.replicas,
+            self.replica_timeout,
+            [self.index_key(p) for p in resource.parents if self._indexed(p)],
+        )
+
+    def _prefix_keys(self, prefix: str) -> List[str]:
+        prefix = check_prefix(prefix)
+        if not self._indexed(prefix):
+            raise ValueError(
+                f"{prefix} is not indexed on a cluster with hash tag depth "
+                f"{self.hash_tag_depth}, set hash_tag_depth to at most its depth"
+            )
+        return [self.index_key(prefix), self.key(LockResource(prefix))]
+
+    def held(self, prefix: str) -> List[str]:
+        """
+        Names locked at or under ``prefix``, read from its index set in one call
+
+        Keys of expired locks are dropped from the index on the way.
+        """
+        keys = self.scripts(self.r, "held", self._prefix_keys(prefix), [])
+        return sorted(self._name(_decode(key)) for key in keys)
+
+    def release_all(self, prefix: str) -> int:
+        return self.scripts(self.r, "release_all", self._prefix_keys(prefix), [])
+
+    def _slots(self, resources: Iterable[LockResource]) -> List[Dict[str, str]]:
+        """Keys of the resources by name, grouped by cluster slot"""
+        slots: Dict[int, Dict[str, str]] = {}
+        for resource in resources:
+            key = self.key(resource)
+            slot = self.r.keyslot(key) if self.cluster else 0
+            slots.setdefault(slot, {})[resource.name] = key
+        return list(slots.values())
+
+    def holders(self, resources: Iterable[LockResource]) -> Dict[str, RedisHolder]:
+        """Holder of each resource, read with a single script call per cluster slot"""
+        holders = {}
+        for keys in self._slots(resources):
+            replies = self.scripts(self.r, "bulk_status", list(keys.values()), [])
+            for name, reply in zip(keys, replies):
+                holders[name] = RedisHolder.from_reply(reply)
+        return holders
+
+    def status_many(
+        self,
+        resources: Iterable[LockResource],
+        timeout: datetime.timedelta | None = None,
+    ) -> Dict[str, bool]:
+        """Whether each resource is locked, see :meth:`holders`"""
+        return {
+            name: holder.token is not None
+            for name, holder in self.holders(resources).items()
+        }
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """
+        Held locks at or under ``prefix``, read from its index set
+
+        Lock keys have no namespace of their own so a prefix is needed.
+        """
+        if prefix is None:
+            raise ValueError("redis locks can only be exported by prefix")
+        return self._export(self.held(prefix))
+
+    def _export(self, names: List[str]) -> Iterator[LockState]:
+        for start in range(0, len(names), 1000):
+            resources = [LockResource(name) for name in names[start : start + 1000]]
+            for name, holder in self.holders(resources).items():
+                if holder.token is not None and holder.ttl is not None:
+                    yield LockState(name, holder.token, holder.ttl)
+
+    def restore(self, states: Iterable[LockState], chunk: int = 1000) -> int:
+        """Restore the locks with one pipeline of acquire scripts per ``chunk`` locks"""
+        restored, calls = 0, []
+        for state in states:
+            ttl = int(state.ttl.total_seconds() * 1000)
+            if ttl > 0:
+                lock = self(LockResource(state.name), state.ttl)
+                calls.append((lock.keys, [state.token, ttl]))
+            if len(calls) == chunk:
+                restored += sum(map(bool, self.scripts.many(self.r, "acquire", calls)))
+                calls = []
+        if calls:
+            restored += sum(map(bool, self.scripts.many(self.r, "acquire", calls)))
+        return restored
+
+
+class RedisRateLimit(RateLimit):
+    """
+    Redis token bucket, every call is a single atomic lua script
+    This lock should be generating using a RedisRateLimitFactory factory.
+
+    Args:
+        r: Redis connection to use for rate limits
+        scripts: lua scripts of the pool of ``r``
+        bucket: token bucket settings
+        resource: resource to limit
+        timeout: length of the window
+    """
+
+    __slots__ = ("r", "scripts", "key")
+
+    def __init__(
+        self,
+        r: redis.Redis,
+        scripts: RedisScripts,
+        bucket: TokenBucket,
+        resource: LockResource,
+        timeout: datetime.timedelta,
+    ) -> None:
+        self.r = r
+        self.scripts = scripts
+        self.key = f"ratelimit:{resource.name}"
+        super().__init__(bucket, resource, timeout)
+
+    def _take(self, requested: int):
+        allowed, tokens = self.scripts(
+            self.r,
+            "rate_limit",
+            [self.key],
+            [self.bucket.capacity, self.bucket.per_second / 1000, requested],
+        )
+        return bool(allowed), float(tokens)
+
+    def acquire(self) -> bool:
+        allowed, _ = self._take(1)
+        if not allowed:
+            raise FailedToAcquireLock
+        return True
+
+    @property
+    def tokens(self) -> float:
+        return self._take(0)[1]
+
+
+class RedisRateLimitFactory(RateLimitFactory):
+    """
+    Factory to create redis rate limits
+
+    Args:
+        r: Redis connection to use for rate limits
+        rate: number of acquires allowed every window
+        burst: number of acquires allowed at once, defaults to ``rate``
+
+    Examples:
+
+        Allow ten runs a minute with bursts of fifteen::
+
+             In [1]: limiter = RedisRateLimitFactory(r, rate=10, burst=15)
+
+             In [2]: @scheduled_task(ttl=timedelta(minutes=1), capp=app, locker=limiter)
+               ...: def limited_task():
+               ...:     return 1 + 1
+    """
+
+    def __init__(self, r: redis.Redis, rate: int, burst: int | None = None) -> None:
+        self.r = r
+        self.scripts = RedisScripts.for_client(r)
+        super().__init__(rate, burst)
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> RedisRateLimit:
+        return RedisRateLimit(
+            self.r, self.scripts, self.bucket(timeout), resource, timeout
+        )
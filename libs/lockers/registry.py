@@ -0,0 +1,302 @@
+"""
+Lazy registry of the lock factories
+
+Factories are registered as ``"module:Class"`` strings and their module,
+along with the driver it needs, is only imported when the factory is
+looked up. Importing :mod:`libs.lockers` or :mod:`libs.scheduler` does not
+import any driver, the factory classes can still be imported from the
+package and are resolved on first use.
+
+Example:
+
+    Pick the factory from the url of the lock server::
+
+        In [1]: from libs.lockers import registry
+
+        In [2]: registry.resolve("redis://redis:6379/1")
+        Out[2]: libs.lockers.redis.RedisLockFactory
+
+        In [3]: from libs.lockers import KazooLockFactory
+
+    Get a factory sharing its client with every other user of the url::
+
+        In [4]: redisLocker = registry.get_locker("redis://redis:6379/1")
+
+        In [5]: qlocker = registry.get_locker(
+           ...:     "redis://redis:6379/1", "zk://zookeeper:2181", "mongodb://mongodb/lock"
+           ...: )
+"""
+import importlib
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple, Type
+
+#: factory name to ``"module:Class"``
+FACTORIES: Dict[str, str] = {
+    "breaker": "libs.lockers.breaker:CircuitBreakerLockFactory",
+    "memory": "libs.lockers.memory:InMemoryLockFactory",
+    "mongodb": "libs.lockers.mongodb:MongoLockFactory",
+    "mongodb-ratelimit": "libs.lockers.mongodb:MongoRateLimitFactory",
+    "quorom": "libs.lockers.quorom:QuoromLockFactory",
+    "redis": "libs.lockers.redis:RedisLockFactory",
+    "redis-ratelimit": "libs.lockers.redis:RedisRateLimitFactory",
+    "sharded": "libs.lockers.sharded:ShardedLockFactory",
+    "shared-memory": "libs.lockers.memory:SharedMemoryLockFactory",
+    "sqlalchemy": "libs.lockers.sqlalchemy:SQLLockFacotory",
+    "sqlalchemy-ratelimit": "libs.lockers.sqlalchemy:SQLRateLimitFactory",
+    "sqlite": "libs.lockers.sqlite:SQLiteLockFactory",
+    "tiered": "libs.lockers.tiered:TieredLockFactory",
+    "zookeeper": "libs.lockers.zookeeper:KazooLockFactory",
+}
+
+#: url scheme to factory name, ``dialect+driver`` schemes match on the dialect
+SCHEMES: Dict[str, str] = {
+    "memory": "memory",
+    "mongodb": "mongodb",
+    "mongodb+srv": "mongodb",
+    "mssql": "sqlalchemy",
+    "mysql": "sqlalchemy",
+    "oracle": "sqlalchemy",
+    "postgres": "sqlalchemy",
+    "postgresql": "sqlalchemy",
+    "redis": "redis",
+    "rediss": "redis",
+    "shm": "shared-memory",
+    "sqlite": "sqlite",
+    "unix": "redis",
+    "zk": "zookeeper",
+    "zookeeper": "zookeeper",
+}
+
+_resolved: Dict[str, type] = {}
+
+
+def register(name: str, target: str, schemes: Iterable[str] = ()) -> None:
+    """
+    Register a factory without importing it
+
+    Args:
+        name: name the factory is resolved by
+        target: ``"module:Class"`` of the factory
+        schemes: url schemes handled by the factory
+    """
+    if ":" not in target:
+        raise ValueError(f"{target} is not a module:Class string")
+    FACTORIES[name] = target
+    _resolved.pop(name, None)
+    for scheme in schemes:
+        SCHEMES[scheme] = name
+
+
+def name_of(name_or_url: str) -> str:
+    """Registered name of a factory name or url"""
+    if "://" not in name_or_url:
+        name = name_or_url
+    else:
+        scheme = name_or_url.split("://", 1)[0].lower()
+        name = SCHEMES.get(scheme) or SCHEMES.get(scheme.split("+", 1)[0])
+    if name not in FACTORIES:
+        raise ValueError(f"no lock factory registered for {name_or_url}")
+    return name
+
+
+def resolve(name_or_url: str) -> Type:
+    """
+    Import and return the factory class registered for a name or url
+
+    Raises:
+        ValueError: nothing is registered for the name or the url scheme
+    """
+    name = name_of(name_or_url)
+    factory = _resolved.get(name)
+    if factory is None:
+        module, attr = FACTORIES[name].split(":")
+        factory = _resolved[name] = getattr(importlib.import_module(module), attr)
+    return factory
+
+
+def lazy_attribute(attr: str) -> type:
+    """
+    Resolve a factory by class name, used by :mod:`libs.lockers` ``__getattr__``
+
+    :meta private:
+    """
+    for name, target in FACTORIES.items():
+        if target.rsplit(":", 1)[1] == attr:
+            return resolve(name)
+    raise AttributeError(f"module 'libs.lockers' has no attribute {attr!r}")
+
+
+Connector = Callable[[str], Tuple[object, Callable[[], None] | None]]
+
+#: factory name to a function building a factory and its close callback from a url
+CONNECTORS: Dict[str, Connector] = {}
+
+#: factory names whose factories are kept by forked processes
+FORK_SAFE = {"shared-memory"}
+
+_QUOROM = re.compile(r"^quor[ou]m\+")
+_MEMBERS = re.compile(r",(?=[a-z][a-z0-9+.-]*://)")
+
+_mutex = threading.RLock()
+_lockers: Dict[Tuple[str, ...], object] = {}
+_closers: Dict[Tuple[str, ...], Callable[[], None]] = {}
+
+
+def connector(name: str) -> Callable[[Connector], Connector]:
+    """Register the connector of a factory name, used as a decorator"""
+
+    def register_connector(connect: Connector) -> Connector:
+        CONNECTORS[name] = connect
+        return connect
+
+    return register_connector
+
+
+@connector("memory")
+def _memory(url: str):
+    return resolve("memory")(), None
+
+
+@connector("shared-memory")
+def _shared_memory(url: str):
+    return resolve("shared-memory")(), None
+
+
+@connector("sqlite")
+def _sqlite(url: str):
+    # sqlite:///relative/path and sqlite:////absolute/path like sqlalchemy
+    path = url.split("://", 1)[1]
+    return resolve("sqlite")(path[1:] if path.startswith("/") else path), None
+
+
+@connector("redis")
+def _redis(url: str):
+    import redis
+
+    client = redis.from_url(url)
+    return resolve("redis")(client), client.close
+
+
+@connector("mongodb")
+def _mongodb(url: str):
+    from pymongo import MongoClient
+
+    client = MongoClient(url)
+    return resolve("mongodb")(client.get_default_database("lock")), client.close
+
+
+@connector("sqlalchemy")
+def _sqlalchemy(url: str):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import scoped_session, sessionmaker
+
+    from .sqlalchemy import _create_all
+
+    engine = create_engine(url, pool_pre_ping=True)
+    _create_all(engine)
+    session = scoped_session(sessionmaker(engine))
+
+    def close():
+        session.remove()
+        engine.dispose()
+
+    return resolve("sqlalchemy")(session), close
+
+
+@connector("zookeeper")
+def _zookeeper(url: str):
+    from kazoo.client import KazooClient
+
+    client = KazooClient(hosts=url.split("://", 1)[1])
+    client.start()
+
+    def close():
+        client.stop()
+        client.close()
+
+    return resolve("zookeeper")(client), close
+
+
+def _split(urls: Iterable[str]) -> List[str]:
+    members = []
+    for url in urls:
+        if _QUOROM.match(url):
+            members.extend(_MEMBERS.split(_QUOROM.sub("", url)))
+        else:
+            members.append(url)
+    return members
+
+
+def _connect(url: str):
+    name = name_of(url)
+    connect = CONNECTORS.get(name)
+    if connect is None:
+        raise ValueError(f"lock factory {name} can not be built from a url")
+    return connect(url)
+
+
+def get_locker(*urls: str):
+    """
+    Lock factory for one or more urls, shared by the whole process
+
+    Each url gets one client and one factory per process, later calls
+    with the same url return the same factory. Several urls, or a single
+    ``quorum+`` url listing them separated by commas, give a
+    :class:`libs.lockers.quorom.QuoromLockFactory` of their factories.
+
+    Processes forked from this one, such as prefork celery workers, start
+    with an empty cache and connect again on their first call. Clients are
+    never closed by a forked process since they still belong to its parent.
+
+    Args:
+        *urls: urls of the lock servers, ``memory://``, ``shm://``
+            and ``sqlite:///path`` need no server
+
+    Raises:
+        ValueError: no url was given or one of them has an unknown scheme
+    """
+    members = _split(urls)
+    if not members:
+        raise ValueError("get_locker needs at least one url")
+    key = tuple(members)
+    locker = _lockers.get(key)
+    if locker is not None:
+        return locker
+    with _mutex:
+        locker = _lockers.get(key)
+        if locker is not None:
+            return locker
+        if len(members) == 1:
+            locker, close = _connect(members[0])
+            if close is not None:
+                _closers[key] = close
+        else:
+            lockers = [get_locker(member) for member in members]
+            locker = resolve("quorom")(lockers)
+        _lockers[key] = locker
+    return locker
+
+
+def close_all() -> None:
+    """Close every client opened by :func:`get_locker` in this process"""
+    with _mutex:
+        closers = list(_closers.values())
+        _lockers.clear()
+        _closers.clear()
+    for close in closers:
+        close()
+
+
+def _after_fork() -> None:
+    global _mutex
+    _mutex = threading.RLock()
+    for key in list(_lockers):
+        if len(key) > 1 or name_of(key[0]) not in FORK_SAFE:
+            del _lockers[key]
+            _closers.pop(key, None)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,173 @@
+"""
+Spread locks over multiple backend instances using consistent hashing
+"""
+import bisect
+import datetime
+import hashlib
+import logging
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from . import CreateLock, Lock, LockResource, LockState
+
+LOG = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes
+
+    Each node is placed on the ring ``vnodes`` times so keys spread evenly,
+    adding or removing a node only moves the keys that land next to it.
+
+    Args:
+        nodes: mapping of node name to node
+        vnodes: number of points each node gets on the ring
+
+    Example:
+
+        Find the node owning a key::
+
+            In [1]: ring = HashRing({"a": locker_a, "b": locker_b})
+
+            In [2]: ring.get("tenant-1")
+            Out[2]: <libs.lockers.redis.RedisLockFactory at 0x7f...>
+    """
+
+    def __init__(self, nodes: Dict[str, object] | None = None, vnodes: int = 160):
+        self.vnodes = vnodes
+        self.nodes: Dict[str, object] = {}
+        self._ring: List[Tuple[int, str]] = []
+        self._keys: List[int] = []
+        for name, node in (nodes or {}).items():
+            self.add(name, node)
+
+    def add(self, name: str, node: object) -> None:
+        """Add a node to the ring"""
+        if name in self.nodes:
+            raise ValueError(f"node {name} is already in the ring")
+        self.nodes[name] = node
+        for i in range(self.vnodes):
+            bisect.insort(self._ring, (_hash(f"{name}#{i}"), name))
+        self._keys = [point for point, _ in self._ring]
+
+    def remove(self, name: str) -> None:
+        """Remove a node from the ring"""
+        del self.nodes[name]
+        self._ring = [item for item in self._ring if item[1] != name]
+        self._keys = [point for point, _ in self._ring]
+
+    def node_name(self, key: str) -> str:
+        """Name of the node owning ``key``"""
+        if not self._ring:
+            raise LookupError("hash ring is empty")
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+    def get(self, key: str) -> object:
+        """Node owning ``key``"""
+        return self.nodes[self.node_name(key)]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+class ShardedLockFactory(CreateLock):
+    """
+    Factory routing every resource to one of several lockers
+
+    All the lockers should be of the same kind, each resource name always
+    maps to the same locker so lock throughput scales with the number of
+    backend instances.
+
+    Args:
+        lockers: list of :class:`libs.lockers.CreateLock` or mapping of
+            a stable name to each locker. Names are used to place the
+            lockers on the ring so use a mapping when lockers can be
+            reordered between deploys.
+        vnodes: number of points each locker gets on the ring
+
+    Examples:
+
+        Shard locks over three redis servers::
+
+            In [1]: lockers = {
+               ...:     "redis-a": RedisLockFactory(redis.from_url("redis://redis-a")),
+               ...:     "redis-b": RedisLockFactory(redis.from_url("redis://redis-b")),
+               ...:     "redis-c": RedisLockFactory(redis.from_url("redis://redis-c")),
+               ...: }
+
+            In [2]: slocker = ShardedLockFactory(lockers)
+
+            In [3]: lock = slocker(LockResource("tenant-1"), ttl)
+    """
+
+    def __init__(
+        self, lockers: List[CreateLock] | Dict[str, CreateLock], vnodes: int = 160
+    ) -> None:
+        if not isinstance(lockers, dict):
+            lockers = {str(i): locker for i, locker in enumerate(lockers)}
+        self.ring = HashRing(lockers, vnodes)
+        super().__init__()
+
+    def add_locker(self, name: str, locker: CreateLock) -> None:
+        """
+        Add a locker to the ring
+
+        Only the resources landing next to the new locker move to it,
+        locks already held on their old locker are not moved.
+        """
+        LOG.info("Adding locker %s to the hash ring", name)
+        self.ring.add(name, locker)
+
+    def remove_locker(self, name: str) -> None:
+        """Remove a locker from the ring"""
+        LOG.info("Removing locker %s from the hash ring", name)
+        self.ring.remove(name)
+
+    def locker_for(self, resource: LockResource) -> CreateLock:
+        """Locker owning ``resource``"""
+        return self.ring.get(resource.name)
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix`` on any of the lockers"""
+        return sorted(
+            name for locker in self.ring.nodes.values() for name in locker.held(prefix)
+        )
+
+    def release_all(self, prefix: str) -> int:
+        return sum(locker.release_all(prefix) for locker in self.ring.nodes.values())
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix`` of every locker, one locker after the other"""
+        for locker in list(self.ring.nodes.values()):
+            yield from locker.export(prefix)
+
+    def restore(self, states: Iterable[LockState]) -> int:
+        """
+        Restore each lock on the locker owning it, one bulk restore per locker
+
+        Exporting and restoring moves the locks held on their old locker
+        after :meth:`add_locker`.
+        """
+        by_locker: Dict[str, List[LockState]] = {}
+        for state in states:
+            by_locker.setdefault(self.ring.node_name(state.name), []).append(state)
+        return sum(
+            self.ring.nodes[name].restore(states) for name, states in by_locker.items()
+        )
+
+    def __call__(self, resource: LockResource, timeout: datetime.timedelta) -> Lock:
+        """
+        Create Lock instance on the locker owning the resource
+
+        Args:
+            resource: resource to lock
+            timeout: length of lock
+
+        Returns: A lock from the locker owning the resource
+        """
+        return self.locker_for(resource)(resource, timeout)
@@ -0,0 +1,154 @@
+"""
+Snapshots of held locks as JSON lines, to migrate locks between backends
+
+Every line holds the name, owner token and milliseconds left of a lock
+along with the epoch time it was read at, so the time spent between the
+export and the restore is taken off when the snapshot is loaded::
+
+    {"name": "tenant-1/report", "token": "8c4f...", "ttl_ms": 29998, "at": 1700000000.0}
+
+Restored locks keep their owner token, their holders can release and
+extend them on the new backend. Locks exported without an owner, such as
+mongo documents without one, get a new token and stay held until they
+expire. Locks are only restored on free
+resources, so running the migration while workers move over to the new
+backend never hands a held lock out twice.
+
+Example:
+
+    Move every lock from redis to postgres::
+
+        In [1]: from libs.lockers import snapshot
+
+        In [2]: snapshot.migrate(redisLocker, sqlLocker, prefix="tenant-1")
+        Out[2]: 1250
+
+    Or through a file, from the shell::
+
+        python -m libs.lockers.snapshot export redis://redis:6379/1 --prefix tenant-1 > locks.jsonl
+        python -m libs.lockers.snapshot restore postgresql://db/locks locks.jsonl
+"""
+import argparse
+import dataclasses
+import json
+import sys
+import time
+import uuid
+from datetime import timedelta
+from itertools import islice
+from typing import IO, Iterable, Iterator, List
+
+from . import CreateLock, LockState
+
+
+def dumps(state: LockState, at: float | None = None) -> str:
+    """JSON line of a lock read at epoch time ``at``, defaults to now"""
+    return json.dumps(
+        {
+            "name": state.name,
+            "token": state.token,
+            "ttl_ms": int(state.ttl.total_seconds() * 1000),
+            "at": time.time() if at is None else at,
+        }
+    )
+
+
+def loads(line: str, now: float | None = None) -> LockState:
+    """Lock of a JSON line, with the time passed since it was read taken off"""
+    item = json.loads(line)
+    elapsed = (time.time() if now is None else now) - item.get("at", 0.0)
+    ttl = timedelta(milliseconds=item["ttl_ms"]) - timedelta(seconds=max(0.0, elapsed))
+    return _owned(LockState(item["name"], item["token"], ttl))
+
+
+def _owned(state: LockState) -> LockState:
+    """Lock with a new token when it was exported without an owner"""
+    if state.token is not None:
+        return state
+    return dataclasses.replace(state, token=uuid.uuid4().hex)
+
+
+def dump(states: Iterable[LockState], out: IO[str]) -> int:
+    """Write locks to ``out`` as they come, returns the count"""
+    count = 0
+    for state in states:
+        out.write(dumps(state) + "\n")
+        count += 1
+    return count
+
+
+def load(lines: Iterable[str]) -> Iterator[LockState]:
+    """Read locks written by :func:`dump`, skipping the ones that expired since"""
+    for line in lines:
+        if line.strip():
+            state = loads(line)
+            if state.ttl > timedelta(0):
+                yield state
+
+
+def _batches(states: Iterable[LockState], size: int) -> Iterator[List[LockState]]:
+    states = iter(states)
+    while batch := list(islice(states, size)):
+        yield batch
+
+
+def migrate(
+    source: CreateLock,
+    target: CreateLock,
+    prefix: str | None = None,
+    batch: int = 1000,
+) -> int:
+    """
+    Copy the held locks of ``source`` to ``target``
+
+    Locks are restored ``batch`` at a time while the export is read, so
+    memory stays flat and each lock reaches the target shortly after it
+    was read.
+
+    Args:
+        source: factory to read the locks from
+        target: factory to restore the locks to
+        prefix: only copy the locks at or under this prefix
+        batch: number of locks per bulk restore
+
+    Returns:
+        the number of locks restored
+    """
+    return sum(
+        target.restore(states)
+        for states in _batches(map(_owned, source.export(prefix)), batch)
+    )
+
+
+def main(argv: List[str] | None = None) -> int:
+    from . import registry
+
+    parser = argparse.ArgumentParser(
+        prog="python -m libs.lockers.snapshot", description=__doc__.split("\n")[1]
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write held locks as JSON lines")
+    export.add_argument("url", help="url of the lock server")
+    export.add_argument("--prefix", help="only export locks under this prefix")
+    restore = commands.add_parser("restore", help="restore locks from JSON lines")
+    restore.add_argument("url", help="url of the lock server")
+    restore.add_argument("path", help="snapshot file, - for stdin")
+    restore.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    locker = registry.get_locker(args.url)
+    if args.command == "export":
+        count = dump(locker.export(args.prefix), sys.stdout)
+        print(f"exported {count} locks", file=sys.stderr)
+        return 0
+    lines = sys.stdin if args.path == "-" else open(args.path)
+    with lines:
+        count = sum(
+            locker.restore(states) for states in _batches(load(lines), args.batch)
+        )
+    print(f"restored {count} locks", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,38 @@
-from datetime import datetime, timedelta
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List
 
-from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy import (
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session
 from sqlalchemy.sql.sqltypes import DateTime
 
-from . import CreateLock, FailedToAcquireLock, Lock, LockResource
+from . import (
+    LOCK_STATE,
+    SEPARATOR,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    check_prefix,
+)
+from .ratelimit import RateLimit, RateLimitFactory, TokenBucket
 
 Base = declarative_base()
 
@@ -19,7 +45,21 @@ class LockTable(Base):
     __tablename__ = "resources"
     ID = Column(Integer, primary_key=True, autoincrement=True)
     resource_name = Column(String, unique=True)
-    expire_at = Column(DateTime)
+    expire_at = Column(DateTime(timezone=True))
+    owner = Column(String)
+
+
+class RateLimitTable(Base):
+    """
+    :meta private:
+    """
+
+    __tablename__ = "rate_limits"
+    ID = Column(Integer, primary_key=True, autoincrement=True)
+    resource_name = Column(String, unique=True)
+    tokens = Column(Float)
+    updated_at = Column(DateTime(timezone=True))
+    version = Column(Integer, default=0)
 
 
 def _create_all(engine):
@@ -30,8 +70,42 @@ def _drop_all(engine):
     return Base.metadata.create_all(engine)
 
 
+def _now(session: Session):
+    """
+    Current time on the database server
+
+    SQLite has no server so the local clock is used in UTC
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        return datetime.now(timezone.utc)
+    return func.now()
+
+
+def _server_now(session: Session) -> datetime:
+    """Value of :func:`_now`, read from the database server when it has one"""
+    now = _now(session)
+    if not isinstance(now, datetime):
+        now = session.execute(select(now)).scalar_one()
+    # sqlite hands back the stored UTC times without their timezone
+    return now if now.tzinfo else now.replace(tzinfo=timezone.utc)
+
+
 class SQLLock(Lock):
+    """
+    SQL lease object used to acquire and release locks.
+    This lock should be generating using a SQLLockFacotory factory.
+
+    Expiry is computed with the clock of the database server (``now()``)
+    and stored with its timezone, so the clocks and timezones of the
+    workers do not matter. Existing ``resources`` tables created without
+    a timezone on ``expire_at`` or without an ``owner`` column have to be
+    recreated.
+    """
+
+    __slots__ = LOCK_STATE + ("session", "resource", "timeout")
+
     def __init__(self, session, resource, timeout) -> None:
+        self.token = None
         self.session = session
         self.resource = resource
         self.timeout = timeout
@@ -39,32 +113,51 @@ class SQLLock(Lock):
 
     def acquire(self) -> bool:
         self._clear_expired()
-        ttl = datetime.now() + self.timeout
-        data = LockTable(resource_name=self.resource.name, expire_at=ttl)
+        token = uuid.uuid4().hex
+        ttl = _now(self.session) + self.timeout
+        data = LockTable(resource_name=self.resource.name, expire_at=ttl, owner=token)
         try:
             self.session.add(data)
             self.session.commit()
         except IntegrityError as error:
             self.session.rollback()
             raise FailedToAcquireLock
+        self.token = token
         return True
 
+    def _owned(self, statement):
+        """Restrict ``statement`` to the lock row still holding our token"""
+        return statement.where(LockTable.resource_name == self.resource.name).where(
+            LockTable.owner == self.token
+        )
+
     def release(self) -> bool:
-        data = LockTable(resource_name=self.resource.name)
-        items = (
-            self.session.query(LockTable)
-            .filter(LockTable.resource_name == self.resource.name)
-            .all()
+        result = self.session.execute(
+            self._owned(delete(LockTable)).execution_options(synchronize_session=False)
         )
-        for item in items:
-            self.session.delete(item)
         self.session.commit()
+        if result.rowcount != 1:
+            raise FailedToReleaseLock
+        return True
+
+    def extend(self, timeout: timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        now = _now(self.session)
+        result = self.session.execute(
+            self._owned(update(LockTable))
+            .where(LockTable.expire_at > now)
+            .values(expire_at=now + self.timeout)
+            .execution_options(synchronize_session=False)
+        )
+        self.session.commit()
+        if result.rowcount != 1:
+            raise FailedToAcquireLock
         return True
 
     def _clear_expired(self):
         items = (
             self.session.query(LockTable)
-            .filter(LockTable.expire_at < datetime.now())
+            .filter(LockTable.expire_at < _now(self.session))
             .all()
         )
         for item in items:
@@ -82,6 +175,16 @@ class SQLLock(Lock):
         return bool(items)
 
 
+def _under(prefix: str):
+    """Rows of the locks at or under ``prefix``, a prefix ``LIKE`` on the unique index"""
+    prefix = check_prefix(prefix)
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return or_(
+        LockTable.resource_name == prefix,
+        LockTable.resource_name.like(f"{escaped}{SEPARATOR}%", escape="\\"),
+    )
+
+
 class SQLLockFacotory(CreateLock):
     def __init__(self, client: Session) -> None:
         self.table = client
@@ -89,3 +192,215 @@ class SQLLockFacotory(CreateLock):
 
     def __call__(self, resource: LockResource, timeout: timedelta) -> SQLLock:
         return SQLLock(self.table, resource, timeout)
+
+    def status_many(
+        self, resources: Iterable[LockResource], timeout: timedelta | None = None
+    ) -> Dict[str, bool]:
+        """Whether each resource is locked, read with a single query"""
+        names = [resource.name for resource in resources]
+        if not names:
+            return {}
+        rows = self.table.execute(
+            select(LockTable.resource_name)
+            .where(LockTable.resource_name.in_(names))
+            .where(LockTable.expire_at > _now(self.table))
+        )
+        status = dict.fromkeys(names, False)
+        status.update((name, True) for name, in rows)
+        self.table.commit()
+        return status
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix``"""
+        rows = self.table.execute(
+            select(LockTable.resource_name)
+            .where(_under(prefix))
+            .where(LockTable.expire_at > _now(self.table))
+            .order_by(LockTable.resource_name)
+        )
+        names = [name for name, in rows]
+        self.table.commit()
+        return names
+
+    def release_all(self, prefix: str) -> int:
+        result = self.table.execute(
+            delete(LockTable)
+            .where(_under(prefix))
+            .where(LockTable.expire_at > _now(self.table))
+            .execution_options(synchronize_session=False)
+        )
+        self.table.commit()
+        return result.rowcount
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix``, streamed from a single query"""
+        now = _server_now(self.table)
+        statement = (
+            select(LockTable.resource_name, LockTable.owner, LockTable.expire_at)
+            .where(LockTable.expire_at > now)
+            .order_by(LockTable.resource_name)
+            .execution_options(yield_per=1000)
+        )
+        if prefix is not None:
+            statement = statement.where(_under(prefix))
+        try:
+            for name, owner, expire_at in self.table.execute(statement):
+                if not expire_at.tzinfo:
+                    expire_at = expire_at.replace(tzinfo=timezone.utc)
+                yield LockState(name, owner, expire_at - now)
+        finally:
+            self.table.commit()
+
+    def restore(self, states: Iterable[LockState], chunk: int = 500) -> int:
+        """
+        Restore the locks with one multi row ``INSERT`` per ``chunk`` locks
+
+        Expired rows of the restored names are deleted and held ones skipped
+        first, a chunk racing with an acquire is retried one row at a time.
+        """
+        now = _server_now(self.table)
+        rows = [
+            {
+                "resource_name": state.name,
+                "expire_at": now + state.ttl,
+                "owner": state.token,
+            }
+            for state in states
+            if state.ttl > timedelta(0)
+        ]
+        return sum(
+            self._restore(rows[start : start + chunk], now)
+            for start in range(0, len(rows), chunk)
+        )
+
+    def _restore(self, rows: List[dict], now: datetime) -> int:
+        names = [row["resource_name"] for row in rows]
+        self.table.execute(
+            delete(LockTable)
+            .where(LockTable.resource_name.in_(names))
+            .where(LockTable.expire_at <= now)
+            .execution_options(synchronize_session=False)
+        )
+        held = set(
+            self.table.scalars(
+                select(LockTable.resource_name).where(
+                    LockTable.resource_name.in_(names)
+                )
+            )
+        )
+        rows = [row for row in rows if row["resource_name"] not in held]
+        try:
+            if rows:
+                self.table.execute(insert(LockTable), rows)
+            self.table.commit()
+        except IntegrityError:
+            self.table.rollback()
+            if len(rows) == 1:
+                return 0
+            return sum(self._restore([row], now) for row in rows)
+        return len(rows)
+
+
+class SQLRateLimit(RateLimit):
+    """
+    SQL token bucket updated with compare and swap on a version column
+    This lock should be generating using a SQLRateLimitFactory factory.
+
+    Refills are computed with the clock of the database server and
+    ``updated_at`` is stored with its timezone, like the expiry of
+    :class:`SQLLock`. Existing ``rate_limits`` tables created without a
+    timezone on ``updated_at`` have to be recreated.
+    """
+
+    __slots__ = ("session", "retries")
+
+    def __init__(
+        self,
+        session: Session,
+        bucket: TokenBucket,
+        resource: LockResource,
+        timeout: timedelta,
+        retries: int = 5,
+    ) -> None:
+        self.session = session
+        self.retries = retries
+        super().__init__(bucket, resource, timeout)
+
+    def _row(self):
+        return (
+            self.session.query(RateLimitTable)
+            .filter(RateLimitTable.resource_name == self.resource.name)
+            .one_or_none()
+        )
+
+    def _current(self, row, now: datetime) -> float:
+        if row is None:
+            return self.bucket.capacity
+        updated_at = row.updated_at
+        if updated_at.tzinfo is None:
+            updated_at = updated_at.replace(tzinfo=timezone.utc)
+        return self.bucket.refill(row.tokens, (now - updated_at).total_seconds())
+
+    def acquire(self) -> bool:
+        for _ in range(self.retries):
+            now = _server_now(self.session)
+            row = self._row()
+            tokens = self._current(row, now)
+            if tokens < 1:
+                self.session.rollback()
+                raise FailedToAcquireLock
+            if row is None:
+                try:
+                    self.session.add(
+                        RateLimitTable(
+                            resource_name=self.resource.name,
+                            tokens=tokens - 1,
+                            updated_at=now,
+                            version=0,
+                        )
+                    )
+                    self.session.commit()
+                    return True
+                except IntegrityError:
+                    self.session.rollback()
+                    continue
+            result = self.session.execute(
+                update(RateLimitTable)
+                .where(RateLimitTable.resource_name == self.resource.name)
+                .where(RateLimitTable.version == row.version)
+                .values(
+                    tokens=tokens - 1,
+                    updated_at=now,
+                    version=RateLimitTable.version + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            self.session.commit()
+            if result.rowcount == 1:
+                return True
+        raise FailedToAcquireLock
+
+    @property
+    def tokens(self) -> float:
+        row = self._row()
+        tokens = self._current(row, _server_now(self.session))
+        self.session.rollback()
+        return tokens
+
+
+class SQLRateLimitFactory(RateLimitFactory):
+    """
+    Class to create SQL rate limits
+
+    Args:
+        client: session used to store the buckets
+        rate: number of acquires allowed every window
+        burst: number of acquires allowed at once, defaults to ``rate``
+    """
+
+    def __init__(self, client: Session, rate: int, burst: int | None = None) -> None:
+        self.table = client
+        super().__init__(rate, burst)
+
+    def __call__(self, resource: LockResource, timeout: timedelta) -> SQLRateLimit:
+        return SQLRateLimit(self.table, self.bucket(timeout), resource, timeout)
@@ -0,0 +1,251 @@
+"""
+Locker backed by a local SQLite file, for hosts without a lock server
+
+Every process on the host opening the same file shares the locks. The
+database runs in WAL mode with memory mapped reads and every operation is
+a single statement in its own implicit write transaction, so an acquire
+never has to upgrade a read lock and never leaves the host.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from typing import Dict, Iterable, Iterator, List
+
+from . import (
+    LOCK_STATE,
+    SEPARATOR,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    check_prefix,
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    owner TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+_ACQUIRE = """
+INSERT INTO locks (name, expires_at, owner) VALUES (?, ?, ?)
+ON CONFLICT (name) DO UPDATE
+SET expires_at = excluded.expires_at, owner = excluded.owner
+WHERE locks.expires_at <= ?
+"""
+
+_EXTEND = """
+UPDATE locks SET expires_at = ? WHERE name = ? AND owner = ? AND expires_at > ?
+"""
+
+_RELEASE = "DELETE FROM locks WHERE name = ? AND owner = ? AND expires_at > ?"
+
+_STATUS = "SELECT 1 FROM locks WHERE name = ? AND expires_at > ?"
+
+# prefix scans are a range of the primary key, 'prefix/' <= name < 'prefix0'
+_UNDER = "(name = ? OR (name >= ? AND name < ?)) AND expires_at > ?"
+
+_HELD = f"SELECT name FROM locks WHERE {_UNDER} ORDER BY name"
+
+_RELEASE_ALL = f"DELETE FROM locks WHERE {_UNDER}"
+
+_EXPORT = "SELECT name, owner, expires_at FROM locks WHERE expires_at > ? ORDER BY name"
+
+_EXPORT_UNDER = (
+    f"SELECT name, owner, expires_at FROM locks WHERE {_UNDER} ORDER BY name"
+)
+
+
+def _under(prefix: str, now: float) -> tuple:
+    prefix = check_prefix(prefix)
+    end = prefix + chr(ord(SEPARATOR) + 1)
+    return (prefix, prefix + SEPARATOR, end, now)
+
+
+class SQLiteLock(Lock):
+    """
+    SQLite lease object used to acquire and release locks.
+    This lock should be generating using a SQLiteLockFactory factory.
+
+    Args:
+        factory: factory owning the connections
+        resource: resource to lock
+        timeout: length of lock
+    """
+
+    __slots__ = LOCK_STATE + ("factory", "resource", "timeout")
+
+    def __init__(
+        self,
+        factory: "SQLiteLockFactory",
+        resource: LockResource,
+        timeout: datetime.timedelta,
+    ) -> None:
+        self.token = None
+        self.factory = factory
+        self.resource = resource
+        self.timeout = timeout
+        super().__init__()
+
+    def acquire(self) -> bool:
+        now = time.time()
+        token = uuid.uuid4().hex
+        cursor = self.factory.connection.execute(
+            _ACQUIRE,
+            (self.resource.name, now + self.timeout.total_seconds(), token, now),
+        )
+        if cursor.rowcount != 1:
+            raise FailedToAcquireLock
+        self.token = token
+        return True
+
+    def release(self) -> bool:
+        cursor = self.factory.connection.execute(
+            _RELEASE, (self.resource.name, self.token, time.time())
+        )
+        if cursor.rowcount != 1:
+            raise FailedToReleaseLock
+        return True
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        now = time.time()
+        cursor = self.factory.connection.execute(
+            _EXTEND,
+            (now + self.timeout.total_seconds(), self.resource.name, self.token, now),
+        )
+        if cursor.rowcount != 1:
+            raise FailedToAcquireLock
+        return True
+
+    @property
+    def status(self) -> bool:
+        cursor = self.factory.connection.execute(
+            _STATUS, (self.resource.name, time.time())
+        )
+        return cursor.fetchone() is not None
+
+
+class SQLiteLockFactory(CreateLock):
+    """
+    Factory to create locks stored in a local SQLite file
+
+    Each thread of each process gets its own connection to the file.
+
+    Args:
+        path: path of the database file, created when missing
+        busy_timeout: how long to wait for another process holding the write lock
+        mmap_size: bytes of the file to memory map for reads
+
+    Examples:
+
+        Share locks between every worker on the host::
+
+            In [1]: from libs.lockers.sqlite import SQLiteLockFactory
+
+            In [2]: liteLocker = SQLiteLockFactory("/var/lib/locks/locks.db")
+
+            In [3]: lock = liteLocker(LockResource("test"), timedelta(seconds=30))
+    """
+
+    def __init__(
+        self,
+        path: str,
+        busy_timeout: datetime.timedelta = datetime.timedelta(seconds=5),
+        mmap_size: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self.connection.execute(_SCHEMA)
+        super().__init__()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection of the current thread, reopened after a fork"""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.connection = self._connect()
+            local.pid = os.getpid()
+        return local.connection
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout.total_seconds(),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return connection
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> SQLiteLock:
+        return SQLiteLock(self, resource, timeout)
+
+    def status_many(
+        self,
+        resources: Iterable[LockResource],
+        timeout: datetime.timedelta | None = None,
+    ) -> Dict[str, bool]:
+        """Whether each resource is locked, read with a single query"""
+        names = [resource.name for resource in resources]
+        status = dict.fromkeys(names, False)
+        for start in range(0, len(names), 500):
+            chunk = names[start : start + 500]
+            cursor = self.connection.execute(
+                f"SELECT name FROM locks WHERE name IN ({','.join('?' * len(chunk))})"
+                " AND expires_at > ?",
+                (*chunk, time.time()),
+            )
+            status.update((name, True) for name, in cursor.fetchall())
+        return status
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix``, read from a range of the primary key"""
+        cursor = self.connection.execute(_HELD, _under(prefix, time.time()))
+        return [name for name, in cursor.fetchall()]
+
+    def release_all(self, prefix: str) -> int:
+        cursor = self.connection.execute(_RELEASE_ALL, _under(prefix, time.time()))
+        return cursor.rowcount
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix``, streamed from a single query"""
+        now = time.time()
+        if prefix is None:
+            cursor = self.connection.execute(_EXPORT, (now,))
+        else:
+            cursor = self.connection.execute(_EXPORT_UNDER, _under(prefix, now))
+        for name, owner, expires_at in cursor:
+            yield LockState(name, owner, datetime.timedelta(seconds=expires_at - now))
+
+    def restore(self, states: Iterable[LockState]) -> int:
+        """Restore the locks with one ``executemany`` in a single write transaction"""
+        now = time.time()
+        rows = [
+            (state.name, now + state.ttl.total_seconds(), state.token, now)
+            for state in states
+            if state.ttl > datetime.timedelta(0)
+        ]
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = connection.executemany(_ACQUIRE, rows)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return cursor.rowcount
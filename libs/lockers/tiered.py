@@ -0,0 +1,476 @@
+"""
+Two tier locker, a fast backend in front of a durable one
+
+Locks are taken on the fast tier only, such as redis. Locks still held
+after ``durable_after`` are copied to the durable tier, such as postgres
+or ZooKeeper, by a background reconciler with one bulk
+:meth:`libs.lockers.CreateLock.restore` per pass, and their extends and
+releases follow asynchronously. Short locks never reach the durable tier.
+
+When the fast tier raises a backend error the factory fails over: for the
+length of the longest lock it handed out, every acquire takes the durable
+tier first and the fast tier on a best effort basis, so locks written to
+the durable tier are respected even when the fast tier lost them.
+
+Processes share the failover through the :data:`FAILOVER` lock on the
+durable tier, and the :data:`SENTINEL` lock on the fast tier tells them
+the fast tier lost its locks without raising any error, such as after a
+restart. Both are read at most once an ``interval`` by every process, on
+its next acquire.
+"""
+import collections
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+from . import (
+    LOCK_STATE,
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+    UnknownLockStatus,
+)
+
+LOG = logging.getLogger(__name__)
+
+#: held on the durable tier while a process fails over
+FAILOVER = LockResource("_tiered/failover")
+#: held on the fast tier, gone when the fast tier lost its locks
+SENTINEL = LockResource("_tiered/sentinel")
+SENTINEL_TTL = datetime.timedelta(days=365)
+
+_LOCK_ERRORS = (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    UnknownLockStatus,
+    NotImplementedError,
+)
+
+
+class Reconciler:
+    """
+    Background thread writing the locks of a :class:`TieredLockFactory` to its durable tier
+
+    Every ``interval`` the locks held for longer than ``durable_after`` are
+    restored on the durable tier in one call, then the queued extends and
+    releases of copied locks are applied in order. The thread is started on
+    first use and again in forked processes.
+
+    Args:
+        durable: factory of the durable tier
+        interval: time between two passes
+        durable_after: how long a lock is held before it is copied
+    """
+
+    def __init__(
+        self,
+        durable: CreateLock,
+        interval: datetime.timedelta,
+        durable_after: datetime.timedelta,
+    ) -> None:
+        self.durable = durable
+        self.interval = interval.total_seconds()
+        self.durable_after = durable_after.total_seconds()
+        self._pending: Dict["TieredLock", float] = {}
+        self._tasks: collections.deque = collections.deque()
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+    def _start(self) -> None:
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._mutex:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="lock-reconciler", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                LOG.exception("Lock reconciliation failed")
+
+    def close(self) -> None:
+        """Stop the thread after a last pass"""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.run_once()
+
+    def held(self, lock: "TieredLock") -> None:
+        """Copy ``lock`` to the durable tier if it is still held after ``durable_after``"""
+        with self._mutex:
+            self._pending[lock] = time.monotonic() + self.durable_after
+        self._start()
+
+    def forget(self, lock: "TieredLock") -> bool:
+        """Stop tracking ``lock``, False when it may have been copied already"""
+        with self._mutex:
+            return self._pending.pop(lock, None) is not None
+
+    def pending(self, lock: "TieredLock") -> bool:
+        """Whether ``lock`` waits for its copy, its updates then need no task"""
+        with self._mutex:
+            return lock in self._pending
+
+    def submit(self, task: Callable[[], None]) -> None:
+        """Run ``task`` after the next copy of the held locks"""
+        self._tasks.append(task)
+        self._start()
+
+    def run_once(self, now: float | None = None) -> int:
+        """
+        Copy the due locks and run the queued tasks
+
+        Returns:
+            the number of locks copied to the durable tier
+        """
+        now = time.monotonic() if now is None else now
+        with self._mutex:
+            due = [lock for lock, at in self._pending.items() if at <= now]
+            for lock in due:
+                del self._pending[lock]
+        copied = self._copy(due)
+        while self._tasks:
+            task = self._tasks.popleft()
+            try:
+                task()
+            except Exception:
+                LOG.exception("Durable lock update failed")
+        return copied
+
+    def _copy(self, locks: List["TieredLock"]) -> int:
+        states = []
+        for lock in locks:
+            token = lock.token
+            ttl = lock.validity + lock.drift(lock.timeout)
+            if token is not None and ttl > datetime.timedelta(0):
+                states.append((lock, LockState(lock.resource.name, token, ttl)))
+        if not states:
+            return 0
+        try:
+            copied = self.durable.restore([state for _, state in states])
+        except Exception:
+            LOG.exception("Could not copy %s locks to the durable tier", len(states))
+            with self._mutex:
+                for lock, _ in states:
+                    self._pending.setdefault(lock, 0.0)
+            return 0
+        if copied < len(states):
+            LOG.warning(
+                "%s of %s locks were already held on the durable tier",
+                len(states) - copied,
+                len(states),
+            )
+            restored = []
+            for lock, state in states:
+                if self._owns(state):
+                    restored.append((lock, state))
+                    continue
+                # held by a copy waiting for its release, tried again next pass
+                with self._mutex:
+                    if lock.held_fast:
+                        self._pending.setdefault(lock, 0.0)
+            states = restored
+        for lock, state in states:
+            lock._copied(state.token)
+        return copied
+
+    def _owns(self, state: LockState) -> bool:
+        """Whether the durable tier holds ``state`` with its token"""
+        return any(
+            held.name == state.name and held.token == state.token
+            for held in self.durable.export(state.name)
+        )
+
+
+class TieredLock(Lock):
+    """
+    Lock taken on the fast tier and copied to the durable tier when held long enough.
+    This lock should be generating using a :class:`TieredLockFactory` factory.
+
+    Args:
+        factory: factory owning the tiers and the reconciler
+        resource: resource to lock
+        timeout: length of lock
+    """
+
+    __slots__ = LOCK_STATE + (
+        "factory",
+        "resource",
+        "timeout",
+        "fast",
+        "durable",
+        "synced",
+        "held_fast",
+    )
+
+    def __init__(
+        self,
+        factory: "TieredLockFactory",
+        resource: LockResource,
+        timeout: datetime.timedelta,
+    ) -> None:
+        self.token = None
+        self.factory = factory
+        self.resource = resource
+        self.timeout = timeout
+        self.fast = factory.fast(resource, timeout)
+        #: copy of the lock on the durable tier
+        self.durable: Lock | None = None
+        #: the durable tier was written synchronously, while failing over
+        self.synced = False
+        self.held_fast = False
+        super().__init__()
+
+    def _fast_acquire(self) -> bool:
+        """Acquire on the fast tier, False when the fast tier is down"""
+        try:
+            self.fast.acquire()
+        except _LOCK_ERRORS:
+            raise
+        except Exception:
+            self.factory.fail_over()
+            return False
+        self.held_fast = True
+        return True
+
+    def acquire(self) -> bool:
+        self.factory.check()
+        if not self.factory.failing_over and self._fast_acquire():
+            self.token = self.fast.token
+            self.factory.reconciler.held(self)
+            return True
+        durable = self.factory.durable(self.resource, self.timeout)
+        durable.acquire()
+        try:
+            self._fast_acquire()
+        except FailedToAcquireLock:
+            durable.release()
+            raise
+        self.durable, self.synced, self.token = durable, True, durable.token
+        return True
+
+    def _copied(self, token: str) -> None:
+        """
+        Called by the reconciler once the lock was restored on the durable tier
+
+        :meta private:
+        """
+        durable = self.factory.durable(self.resource, self.timeout)
+        durable.token = token
+        self.durable = durable
+
+    def _release_copy(self) -> None:
+        durable, self.durable = self.durable, None
+        if durable is not None:
+            try:
+                durable.release()
+            except FailedToReleaseLock:
+                pass
+
+    def _extend_copy(self) -> None:
+        if self.durable is not None:
+            try:
+                self.durable.extend(self.timeout)
+            except (FailedToAcquireLock, NotImplementedError):
+                LOG.warning("Durable copy of %s was lost", self.resource.name)
+
+    def release(self) -> bool:
+        held_fast, self.held_fast = self.held_fast, False
+        if self.synced:
+            if held_fast:
+                try:
+                    self.fast.release()
+                except Exception:
+                    pass
+            durable, self.durable, self.synced = self.durable, None, False
+            return durable.release()
+        try:
+            self.fast.release()
+        finally:
+            if not self.factory.reconciler.forget(self):
+                self.factory.reconciler.submit(self._release_copy)
+        return True
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        self.timeout = timeout or self.timeout
+        if self.synced:
+            self.durable.extend(self.timeout)
+            if self.held_fast:
+                try:
+                    self.fast.extend(self.timeout)
+                except Exception:
+                    pass
+            return True
+        self.fast.extend(self.timeout)
+        # a copy in progress reads the ttl before the extend
+        if self.durable is not None or not self.factory.reconciler.pending(self):
+            self.factory.reconciler.submit(self._extend_copy)
+        return True
+
+    @property
+    def status(self) -> bool:
+        if self.factory.failing_over:
+            if self.factory.durable(self.resource, self.timeout).status:
+                return True
+        try:
+            return self.fast.status
+        except _LOCK_ERRORS:
+            raise
+        except Exception:
+            self.factory.fail_over()
+            return self.factory.durable(self.resource, self.timeout).status
+
+
+class TieredLockFactory(CreateLock):
+    """
+    Factory taking locks on a fast tier backed by a durable tier
+
+    Unlike :class:`libs.lockers.quorom.QuoromLockFactory` an acquire only
+    waits on the fast tier while it is healthy. Locks held for less than
+    ``durable_after`` are only as durable as the fast tier.
+
+    Args:
+        fast: factory of the fast tier
+        durable: factory of the durable tier, it needs
+            :meth:`libs.lockers.CreateLock.restore`
+        durable_after: how long a lock is held before it is copied to the durable tier
+        interval: time between two passes of the reconciler
+        failover_window: how long acquires go through the durable tier after
+            a fast tier error, defaults to the longest lock handed out
+
+    Examples:
+
+        Lock on redis, keep the locks held for more than a second in postgres::
+
+            In [1]: tlocker = TieredLockFactory(redisLocker, sqlLocker)
+
+            In [2]: lock = tlocker(LockResource("report"), timedelta(minutes=5))
+    """
+
+    def __init__(
+        self,
+        fast: CreateLock,
+        durable: CreateLock,
+        durable_after: datetime.timedelta = datetime.timedelta(seconds=1),
+        interval: datetime.timedelta = datetime.timedelta(milliseconds=500),
+        failover_window: datetime.timedelta | None = None,
+    ) -> None:
+        self.fast = fast
+        self.durable = durable
+        self.reconciler = Reconciler(durable, interval, durable_after)
+        self.failover_window = failover_window
+        self.longest = interval
+        self._failing_over_until = 0.0
+        self._failover: Lock | None = None
+        self._checked_at = float("-inf")
+        self._sentinel_seen = False
+        super().__init__()
+
+    def __call__(
+        self, resource: LockResource, timeout: datetime.timedelta
+    ) -> TieredLock:
+        if timeout > self.longest:
+            self.longest = timeout
+        return TieredLock(self, resource, timeout)
+
+    @property
+    def failing_over(self) -> bool:
+        """True while acquires go through the durable tier"""
+        return time.monotonic() < self._failing_over_until
+
+    def fail_over(self) -> None:
+        """Send acquires through the durable tier for the failover window"""
+        window = self.failover_window
+        window = (self.longest if window is None else window).total_seconds()
+        if not self.failing_over:
+            LOG.warning("Fast lock tier failed, using the durable tier for %ss", window)
+        self._failing_over_until = time.monotonic() + window
+        try:
+            if self._failover is None:
+                failover = self.durable(FAILOVER, datetime.timedelta(seconds=window))
+                failover.acquire()
+                self._failover = failover
+            else:
+                self._failover.extend(datetime.timedelta(seconds=window))
+        except FailedToAcquireLock:
+            # another process is failing over
+            self._failover = None
+        except Exception:
+            LOG.exception("Could not share the failover of the fast lock tier")
+
+    def check(self) -> None:
+        """
+        Fail over when another process does or when the fast tier lost its
+        locks, read at most once an interval
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.reconciler.interval:
+            return
+        self._checked_at = now
+        try:
+            if self.durable(FAILOVER, self.longest).status:
+                self._failing_over_until = max(
+                    self._failing_over_until, now + self.reconciler.interval
+                )
+        except Exception:
+            LOG.exception("Could not read the failover of the fast lock tier")
+        sentinel = self.fast(SENTINEL, SENTINEL_TTL)
+        try:
+            if sentinel.status:
+                self._sentinel_seen = True
+                return
+            sentinel.acquire()
+        except FailedToAcquireLock:
+            return
+        except Exception:
+            self.fail_over()
+            return
+        if self._sentinel_seen:
+            LOG.warning("Fast lock tier lost its locks")
+            self.fail_over()
+        self._sentinel_seen = True
+
+    def status_many(
+        self,
+        resources: Iterable[LockResource],
+        timeout: datetime.timedelta | None = None,
+    ) -> Dict[str, bool]:
+        """Whether each resource is locked, the durable tier is read while failing over"""
+        resources = list(resources)
+        try:
+            status = self.fast.status_many(resources, timeout)
+        except Exception:
+            self.fail_over()
+            status = dict.fromkeys((resource.name for resource in resources), False)
+        if self.failing_over:
+            for name, locked in self.durable.status_many(resources, timeout).items():
+                status[name] = status.get(name, False) or locked
+        return status
+
+    def held(self, prefix: str) -> List[str]:
+        """Names locked at or under ``prefix`` on either tier"""
+        return sorted(set(self.fast.held(prefix)) | set(self.durable.held(prefix)))
+
+    def release_all(self, prefix: str) -> int:
+        released = self.durable.release_all(prefix)
+        return max(self.fast.release_all(prefix), released)
+
+    def close(self) -> None:
+        """Copy the due locks, apply the queued updates and stop the reconciler"""
+        self.reconciler.close()
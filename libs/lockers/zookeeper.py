@@ -1,18 +1,162 @@
 import datetime
 import logging
-
-from kazoo.exceptions import NoNodeError
-from kazoo.client import KazooClient
-from . import CreateLock, FailedToAcquireLock, Lock, LockResource, FailedToReleaseLock
+import time
+import uuid
+import weakref
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Tuple
+
+from kazoo.exceptions import (
+    BadVersionError,
+    NoNodeError,
+    NodeExistsError,
+    NotEmptyError,
+)
+from . import (
+    LOCK_STATE,
+    CreateLock,
+    FailedToAcquireLock,
+    Lock,
+    LockResource,
+    FailedToReleaseLock,
+    LockState,
+    check_prefix,
+)
+
+if TYPE_CHECKING:
+    from kazoo.client import KazooClient
 
 LOG = logging.getLogger(__name__)
 
+#: znode holding every lock
+ROOT = "/tasks"
+
+#: znode written to read the clock of the ZooKeeper servers
+CLOCK = "/tasks-clock"
+
+_ensured: "weakref.WeakKeyDictionary[KazooClient, set]" = weakref.WeakKeyDictionary()
+_clocks: "weakref.WeakKeyDictionary[KazooClient, ServerClock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def ensure_path(kz: "KazooClient", path: str) -> None:
+    """
+    Create ``path`` once per client, later calls do not go to ZooKeeper
+
+    :meta private:
+    """
+    paths = _ensured.setdefault(kz, set())
+    if path not in paths:
+        kz.ensure_path(path)
+        paths.add(path)
+
+
+def forget_path(kz: "KazooClient", path: str) -> None:
+    """
+    Drop ``path`` from the cache after it turned out to be missing
+
+    :meta private:
+    """
+    _ensured.get(kz, set()).discard(path)
+
+
+def forget_tree(kz: "KazooClient", path: str) -> None:
+    """
+    Drop ``path`` and every path under it from the cache after the subtree was deleted
+
+    :meta private:
+    """
+    paths = _ensured.get(kz, set())
+    for cached in [
+        cached for cached in paths if cached == path or cached.startswith(f"{path}/")
+    ]:
+        paths.discard(cached)
+
+
+class ServerClock:
+    """
+    Clock of the ZooKeeper servers seen from one client
+
+    The server sets the ``mtime`` of a node it writes, so writing the
+    :data:`CLOCK` node gives the server time, which is then carried
+    forward on the local monotonic clock. The node is written again every
+    ``refresh`` seconds, the time read is off by at most half the round
+    trip of that write.
+
+    Args:
+        kz: client to read the time with
+        refresh: seconds between two writes of the clock node
+    """
+
+    def __init__(self, kz: "KazooClient", refresh: float = 60.0) -> None:
+        self.kz = kz
+        self.refresh = refresh
+        self._server_ms = 0.0
+        self._read_at = float("-inf")
+
+    def _read(self) -> None:
+        ensure_path(self.kz, CLOCK)
+        start = time.monotonic()
+        stat = self.kz.set(CLOCK, b"")
+        end = time.monotonic()
+        # the server stamped the node somewhere during the round trip
+        self._server_ms, self._read_at = stat.mtime, (start + end) / 2
+
+    def now(self) -> float:
+        """Current server time in epoch milliseconds"""
+        if time.monotonic() - self._read_at >= self.refresh:
+            self._read()
+        return self._server_ms + (time.monotonic() - self._read_at) * 1000
+
+
+def server_now(kz: "KazooClient") -> float:
+    """Current time of the ZooKeeper servers of ``kz`` in epoch milliseconds"""
+    clock = _clocks.get(kz)
+    if clock is None:
+        clock = _clocks[kz] = ServerClock(kz)
+    return clock.now()
+
+
+def node_held(data: bytes, stat, now: float, margin: float = 0.0) -> bool:
+    """
+    Check if the data of a lock node describes a lock that has not expired
+
+    The node holds the ttl in milliseconds and the owner token, the lock
+    expires ttl after the ZooKeeper server last modified the node.
+
+    Args:
+        data: data of the node
+        stat: stat of the node
+        now: server time in epoch milliseconds, see :func:`server_now`
+        margin: milliseconds a lock is still held after it expired
+    """
+    try:
+        ttl = int(data.split(b" ", 1)[0])
+    except ValueError:
+        return False
+    return stat.mtime + ttl + margin > now
+
+
+def node_ttl(data: bytes, stat, now: float) -> Tuple[str, datetime.timedelta]:
+    """Owner token and time left of a held lock node"""
+    ttl, _, token = data.decode("utf-8").partition(" ")
+    return token, datetime.timedelta(milliseconds=stat.mtime + int(ttl) - now)
+
 
 class KazooLease(Lock):
     """
     Kazoo lease object used to acquire and release locks.
     This lock should be generating using a KazooLockFactory factory.
 
+    Expiry is based on the modification time the ZooKeeper server sets on
+    the lock node and compared with the server time of
+    :class:`ServerClock`, so the clocks and timezones of the workers do not
+    matter.
+
+    A free lock is acquired with a single ``create`` of its node, only an
+    expired node left behind takes a ``get`` and a versioned ``set``.
+    Hierarchical names map to subtrees, ``tenant/job`` is ``/tasks/tenant/job``.
+
     Example:
 
         Create lock resource and TTL and lock::
@@ -33,14 +177,36 @@ class KazooLease(Lock):
 
     """
 
+    #: time a lock is still considered held after it expired, set it to the
+    #: expected clock skew between the ZooKeeper servers
+    expiry_margin: datetime.timedelta = datetime.timedelta(0)
+
+    __slots__ = LOCK_STATE + ("kz", "resource", "timeout", "path", "version")
+
     def __init__(
-        self, kz: KazooClient, resource: LockResource, timeout: datetime.timedelta
+        self, kz: "KazooClient", resource: LockResource, timeout: datetime.timedelta
     ) -> None:
+        self.token = None
         self.kz = kz
         self.resource = resource
         self.timeout = timeout
-        self.timefmt = "%Y-%m-%dT%H:%M:%S"
-        self.path = f"/tasks/{self.resource.name}"
+        self.path = f"{ROOT}/{self.resource.name}"
+        self.version: int | None = None
+        super().__init__()
+
+    @property
+    def parent(self) -> str:
+        """Path of the parent node, only needed when it is missing"""
+        return self.path.rsplit("/", 1)[0]
+
+    def _held(self, data: bytes, stat) -> bool:
+        """Check if the node data describes a lock that has not expired, see :func:`node_held`"""
+        return node_held(
+            data,
+            stat,
+            server_now(self.kz),
+            self.expiry_margin.total_seconds() * 1000,
+        )
 
     def acquire(self) -> bool:
         """
@@ -80,22 +246,69 @@ class KazooLease(Lock):
 
         """
 
-        now = datetime.datetime.now()
-        self.kz.ensure_path(self.path)
-        LOG.debug(f"ensuring path {self.path}")
-        current_lock, _ = self.kz.get(path=self.path)
-        if current_lock != b"":
-            if (
-                datetime.datetime.strptime(current_lock.decode("utf-8"), self.timefmt)
-                > now
-            ):
-                raise FailedToAcquireLock
-        self.kz.set(
-            self.path,
-            datetime.datetime.strftime(now + self.timeout, self.timefmt).encode(
-                "utf-8"
-            ),
-        )
+        token = uuid.uuid4().hex
+        try:
+            self._create(token)
+            version = 0
+        except NodeExistsError:
+            version = self._take_over(token)
+        self.token, self.version = token, version
+        return True
+
+    def _create(self, token: str) -> None:
+        try:
+            self.kz.create(self.path, self._data(token))
+        except NoNodeError:
+            LOG.debug("creating missing path %s", self.parent)
+            forget_path(self.kz, self.parent)
+            ensure_path(self.kz, self.parent)
+            self.kz.create(self.path, self._data(token))
+
+    def _take_over(self, token: str) -> int:
+        """Replace an expired lock node, returns the version written"""
+        try:
+            current_lock, stat = self.kz.get(path=self.path)
+        except NoNodeError:
+            raise FailedToAcquireLock
+        if self._held(current_lock, stat):
+            raise FailedToAcquireLock
+        try:
+            return self.kz.set(
+                self.path, self._data(token), version=stat.version
+            ).version
+        except (BadVersionError, NoNodeError):
+            raise FailedToAcquireLock
+
+    def _data(self, token: str) -> bytes:
+        ttl = int(self.timeout.total_seconds() * 1000)
+        return f"{ttl} {token}".encode("utf-8")
+
+    def _owned(self) -> int | None:
+        """
+        Version of the node written by our acquire, read from the node when
+        only the token is known such as for restored locks, None when not ours
+        """
+        if self.version is None and self.token is not None:
+            try:
+                data, stat = self.kz.get(path=self.path)
+            except NoNodeError:
+                return None
+            if data.partition(b" ")[2] == self.token.encode("utf-8"):
+                self.version = stat.version
+        return self.version
+
+    def extend(self, timeout: datetime.timedelta | None = None) -> bool:
+        """
+        Reset the ttl of the lock, only while nobody changed the node since our acquire
+        """
+        self.timeout = timeout or self.timeout
+        if self._owned() is None:
+            raise FailedToAcquireLock
+        try:
+            stat = self.kz.set(self.path, self._data(self.token), version=self.version)
+        except (BadVersionError, NoNodeError):
+            raise FailedToAcquireLock
+        self.version = stat.version
         return True
 
     def release(self):
@@ -107,24 +320,33 @@ class KazooLease(Lock):
             Release the Lock::
 
                 In [14]: lock.release()
+
+        The node is only deleted while nobody changed it since our acquire,
+        a node with locks under it is emptied instead
         """
+        if self._owned() is None:
+            raise FailedToReleaseLock
         try:
-            self.kz.delete(path=self.path)
-            return True
-        except NoNodeError:
+            self.kz.delete(path=self.path, version=self.version)
+        except NotEmptyError:
+            try:
+                self.kz.set(self.path, b"", version=self.version)
+            except (BadVersionError, NoNodeError):
+                raise FailedToReleaseLock
+        except (BadVersionError, NoNodeError):
             raise FailedToReleaseLock
+        finally:
+            self.version = None
+        return True
 
     @property
     def status(self) -> bool:
         """Get lock status returned as bool"""
-        self.kz.ensure_path(self.path)
-        current_lock, _ = self.kz.get(path=self.path)
-        now = datetime.datetime.now()
-        if current_lock == b"":
+        try:
+            current_lock, stat = self.kz.get(path=self.path)
+        except NoNodeError:
             return False
-        return (
-            datetime.datetime.strptime(current_lock.decode("utf-8"), self.timefmt) > now
-        )
+        return self._held(current_lock, stat)
 
 
 class KazooLockFactory(CreateLock):
@@ -152,14 +374,228 @@ class KazooLockFactory(CreateLock):
             In [6]: zk.start()
 
             In [7]: zkLocker = KazooLockFactory(zk)
+
+        Lock several resources at once, all or none of them::
+
+            In [8]: leases = zkLocker.acquire_many(
+               ...:     [LockResource("a"), LockResource("b")], datetime.timedelta(seconds=30)
+               ...: )
+
+            In [9]: zkLocker.release_many(leases)
     """
 
-    def __init__(self, client: KazooClient) -> None:
+    def __init__(self, client: "KazooClient") -> None:
         self.kz = client
         super().__init__()
 
     def __call__(
         self, resource: LockResource, timeout: datetime.timedelta
     ) -> KazooLease:
-        self.kz.ensure_path("/tasks")
-        return KazooLease(self.kz, resource, timeout)
+        lease = KazooLease(self.kz, resource, timeout)
+        ensure_path(self.kz, lease.parent)
+        return lease
+
+    def _get_many(self, leases: List[KazooLease]) -> list:
+        """Pipelined ``get`` of the lock nodes, None for missing nodes"""
+        pending = [self.kz.get_async(lease.path) for lease in leases]
+        nodes = []
+        for result in pending:
+            try:
+                nodes.append(result.get())
+            except NoNodeError:
+                nodes.append(None)
+        return nodes
+
+    def status_many(
+        self,
+        resources: Iterable[LockResource],
+        timeout: datetime.timedelta | None = None,
+    ) -> Dict[str, bool]:
+        """Whether each resource is locked, read in a single round trip"""
+        leases = [self(resource, datetime.timedelta(0)) for resource in resources]
+        return {
+            lease.resource.name: node is not None and lease._held(*node)
+            for lease, node in zip(leases, self._get_many(leases))
+        }
+
+    def acquire_many(
+        self, resources: Iterable[LockResource], timeout: datetime.timedelta
+    ) -> List[KazooLease]:
+        """
+        Acquire every resource in one ZooKeeper transaction, or none of them
+
+        The lock nodes are read in one pipelined round trip, then free
+        locks are created and expired ones replaced with their version
+        checked in a single multi-op.
+
+        Raises:
+            FailedToAcquireLock: one of the resources is held or changed meanwhile
+
+        Returns:
+            the acquired leases, release them with :meth:`release_many`
+        """
+        leases = [self(resource, timeout) for resource in resources]
+        start = time.monotonic()
+        tokens, results = self._acquire_many(leases)
+        if any(isinstance(result, NoNodeError) for result in results):
+            LOG.debug("creating missing paths of %s locks", len(leases))
+            for lease in leases:
+                forget_path(self.kz, lease.parent)
+                ensure_path(self.kz, lease.parent)
+            tokens, results = self._acquire_many(leases)
+        if any(isinstance(result, Exception) for result in results):
+            raise FailedToAcquireLock(
+                ", ".join(lease.resource.name for lease in leases)
+            )
+        for lease, token, result in zip(leases, tokens, results):
+            lease.token = token
+            lease.version = result.version if hasattr(result, "version") else 0
+            lease._start_validity(start)
+        return leases
+
+    def _acquire_many(self, leases: List[KazooLease]) -> Tuple[List[str], list]:
+        """Tokens and transaction results of the acquire of ``leases``"""
+        transaction = self.kz.transaction()
+        tokens = []
+        for lease, node in zip(leases, self._get_many(leases)):
+            token = uuid.uuid4().hex
+            tokens.append(token)
+            if node is None:
+                transaction.create(lease.path, lease._data(token))
+            elif lease._held(*node):
+                raise FailedToAcquireLock(lease.resource.name)
+            else:
+                transaction.set_data(
+                    lease.path, lease._data(token), version=node[1].version
+                )
+        return tokens, transaction.commit()
+
+    def _walk(self, prefix: str | None) -> Iterator[Tuple[str, bytes, object]]:
+        """
+        Name, data and stat of the held lock nodes at or under ``prefix``
+
+        The subtree is read one level per round trip with pipelined ``get``
+        and ``get_children`` calls, from the top level when ``prefix`` is not set.
+        """
+        now = server_now(self.kz)
+        margin = KazooLease.expiry_margin.total_seconds() * 1000
+        if prefix is not None:
+            level = [check_prefix(prefix)]
+        else:
+            try:
+                level = self.kz.get_children(ROOT)
+            except NoNodeError:
+                return
+        while level:
+            nodes = [
+                (
+                    name,
+                    self.kz.get_async(f"{ROOT}/{name}"),
+                    self.kz.get_children_async(f"{ROOT}/{name}"),
+                )
+                for name in level
+            ]
+            level = []
+            for name, node, children in nodes:
+                try:
+                    data, stat = node.get()
+                    level.extend(f"{name}/{child}" for child in children.get())
+                except NoNodeError:
+                    continue
+                if node_held(data, stat, now, margin):
+                    yield name, data, stat
+
+    def held(self, prefix: str) -> List[str]:
+        """
+        Names locked at or under ``prefix``
+
+        The subtree of the prefix is read one level per round trip with
+        pipelined ``get`` and ``get_children`` calls.
+        """
+        return sorted(name for name, _, _ in self._walk(check_prefix(prefix)))
+
+    def export(self, prefix: str | None = None) -> Iterator[LockState]:
+        """Held locks at or under ``prefix``, the subtree is read as in :meth:`held`"""
+        now = server_now(self.kz)
+        for name, data, stat in self._walk(prefix):
+            yield LockState(name, *node_ttl(data, stat, now))
+
+    def restore(self, states: Iterable[LockState], chunk: int = 500) -> int:
+        """
+        Restore the locks in one transaction per ``chunk`` locks
+
+        The nodes are read in one pipelined round trip, free locks are
+        created and expired ones replaced with their version checked. When
+        a lock changed meanwhile the locks of the chunk are restored one at
+        a time instead.
+        """
+        states = [state for state in states if state.ttl > datetime.timedelta(0)]
+        return sum(
+            self._restore(states[start : start + chunk])
+            for start in range(0, len(states), chunk)
+        )
+
+    def _restore(self, states: List[LockState]) -> int:
+        leases = [self(LockResource(state.name), state.ttl) for state in states]
+        transaction = self.kz.transaction()
+        restoring = []
+        for lease, state, node in zip(leases, states, self._get_many(leases)):
+            if node is None:
+                transaction.create(lease.path, lease._data(state.token))
+            elif not lease._held(*node):
+                transaction.set_data(
+                    lease.path, lease._data(state.token), version=node[1].version
+                )
+            else:
+                continue
+            restoring.append((lease, state.token))
+        if not restoring:
+            return 0
+        results = transaction.commit()
+        if not any(isinstance(result, Exception) for result in results):
+            return len(restoring)
+        restored = 0
+        for lease, token in restoring:
+            try:
+                try:
+                    lease._create(token)
+                except NodeExistsError:
+                    lease._take_over(token)
+            except FailedToAcquireLock:
+                continue
+            restored += 1
+        return restored
+
+    def release_all(self, prefix: str) -> int:
+        """Delete the subtree of ``prefix``, returns the number of locks that were held"""
+        held = self.held(prefix)
+        path = f"{ROOT}/{check_prefix(prefix)}"
+        try:
+            self.kz.delete(path, recursive=True)
+        except NoNodeError:
+            pass
+        finally:
+            forget_tree(self.kz, path)
+        return len(held)
+
+    def release_many(self, leases: Iterable[KazooLease]) -> bool:
+        """
+        Release leases from :meth:`acquire_many` in one transaction, or none of them
+
+        Raises:
+            FailedToReleaseLock: one of the leases is no longer held
+        """
+        leases = list(leases)
+        if any(lease.version is None for lease in leases):
+            raise FailedToReleaseLock
+        transaction = self.kz.transaction()
+        for lease in leases:
+            transaction.delete(lease.path, version=lease.version)
+        results = transaction.commit()
+        if any(isinstance(result, Exception) for result in results):
+            raise FailedToReleaseLock(
+                ", ".join(lease.resource.name for lease in leases)
+            )
+        for lease in leases:
+            lease.version, lease._valid_until = None, None
+        return True
@@ -0,0 +1,249 @@
+"""
+Opt-in profiler of lock hold times and contention
+
+The :class:`Profiler` is a :mod:`libs.lockers.hooks` listener keeping the
+last lock events in a ring buffer, so it covers every lock including the
+ones taken by :func:`libs.scheduler.scheduled_task` whose resources are
+named after the task. Those locks are left to expire, they are reported
+with their acquires and contention but no hold time. Events are dumped as
+JSON lines and reported with::
+
+    python -m libs.profile report locks.jsonl --top 10 --sort hold
+    python -m libs.profile flame locks.jsonl > locks.folded
+
+Example:
+
+    Profile the workers of a host::
+
+        In [1]: from libs.profile import Profiler
+
+        In [2]: profiler = Profiler(capacity=100_000).start()
+
+        In [3]: profiler.dump("/tmp/locks.jsonl")
+"""
+import argparse
+import collections
+import dataclasses
+import json
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+from .lockers import hooks
+from .lockers.hooks import LockEvent
+
+SORT_KEYS = ("hold", "contention", "wait", "calls")
+
+
+class Profiler:
+    """
+    Listener keeping the last ``capacity`` lock events
+
+    Args:
+        capacity: number of events kept, older events are dropped first
+    """
+
+    def __init__(self, capacity: int = 10000) -> None:
+        self.events = collections.deque(maxlen=capacity)
+
+    def __call__(self, event: LockEvent) -> None:
+        self.events.append(event)
+
+    def start(self) -> "Profiler":
+        """Start recording lock events"""
+        hooks.add_listener(self)
+        return self
+
+    def stop(self) -> None:
+        """Stop recording lock events, recorded events are kept"""
+        hooks.remove_listener(self)
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.stop()
+
+    def dump(self, path: str) -> int:
+        """Write the recorded events to ``path`` as JSON lines, returns the count"""
+        events = list(self.events)
+        with open(path, "w") as out:
+            for event in events:
+                out.write(json.dumps(dataclasses.asdict(event)) + "\n")
+        return len(events)
+
+
+def load(path: str) -> List[LockEvent]:
+    """Read events written by :meth:`Profiler.dump`"""
+    with open(path) as lines:
+        return [LockEvent(**json.loads(line)) for line in lines if line.strip()]
+
+
+def _quantile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+@dataclasses.dataclass
+class ResourceStats:
+    """
+    Data class summarising the events of one resource on one lock class
+
+    Args:
+        resource: name of the locked resource
+        backend: class name of the locks
+        acquires: number of acquire calls
+        contended: acquires that found the lock held
+        errors: operations that failed with a backend error
+        waits: durations of the acquire calls in seconds
+        holds: seconds each released lock was held for
+    """
+
+    resource: str
+    backend: str
+    acquires: int = 0
+    contended: int = 0
+    errors: int = 0
+    waits: List[float] = dataclasses.field(default_factory=list)
+    holds: List[float] = dataclasses.field(default_factory=list)
+
+    @property
+    def contention(self) -> float:
+        """Share of acquires that found the lock held"""
+        return self.contended / self.acquires if self.acquires else 0.0
+
+    @property
+    def hold(self) -> float:
+        """Total seconds the resource was held"""
+        return sum(self.holds)
+
+    @property
+    def wait(self) -> float:
+        """Total seconds spent in acquire calls"""
+        return sum(self.waits)
+
+    def sort_key(self, key: str) -> float:
+        if key == "calls":
+            return self.acquires
+        return getattr(self, key)
+
+    def row(self) -> Dict:
+        return {
+            "resource": self.resource,
+            "backend": self.backend,
+            "acquires": self.acquires,
+            "contention": round(self.contention, 4),
+            "errors": self.errors,
+            "wait_p50": _quantile(self.waits, 0.5),
+            "wait_p99": _quantile(self.waits, 0.99),
+            "hold_p50": _quantile(self.holds, 0.5),
+            "hold_p99": _quantile(self.holds, 0.99),
+            "hold_max": max(self.holds, default=0.0),
+            "hold_total": self.hold,
+        }
+
+
+def summarize(events: Iterable[LockEvent]) -> Dict[Tuple[str, str], ResourceStats]:
+    """
+    Group events by resource and lock class
+
+    Wrapper locks such as :class:`libs.lockers.quorom.QuoromLock` report
+    under the name of the locks they wrap, each class is counted apart so
+    a quorom acquire is not counted once more per member.
+    """
+    stats: Dict[Tuple[str, str], ResourceStats] = {}
+    for event in events:
+        key = (event.resource, event.backend)
+        stat = stats.get(key)
+        if stat is None:
+            stat = stats[key] = ResourceStats(event.resource, event.backend)
+        if event.outcome == hooks.ERROR:
+            stat.errors += 1
+        if event.operation == "acquire":
+            stat.acquires += 1
+            stat.waits.append(event.duration)
+            if event.outcome == hooks.CONTENDED:
+                stat.contended += 1
+        if event.hold is not None:
+            stat.holds.append(event.hold)
+    return stats
+
+
+def top(
+    events: Iterable[LockEvent], n: int = 10, sort: str = "hold"
+) -> List[ResourceStats]:
+    """The ``n`` hottest resources by ``sort``, one of :data:`SORT_KEYS`"""
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    stats = summarize(events).values()
+    return sorted(stats, key=lambda stat: stat.sort_key(sort), reverse=True)[:n]
+
+
+def folded(events: Iterable[LockEvent]) -> List[str]:
+    """
+    Folded stacks of time spent per ``backend;operation;resource``
+
+    Held time is reported under a ``held`` frame, lines are weighted in
+    microseconds and can be fed to ``flamegraph.pl`` or speedscope.
+    """
+    weights: Dict[str, float] = collections.defaultdict(float)
+    for event in events:
+        stack = f"{event.backend};{event.operation};{event.resource}"
+        weights[stack] += event.duration
+        if event.hold is not None:
+            weights[f"{event.backend};held;{event.resource}"] += event.hold
+    return [
+        f"{stack} {int(weight * 1e6)}"
+        for stack, weight in sorted(weights.items())
+        if int(weight * 1e6)
+    ]
+
+
+def _format(value) -> str:
+    return f"{value:.6f}" if isinstance(value, float) else str(value)
+
+
+def _report(rows: List[Dict]) -> str:
+    if not rows:
+        return "no lock events"
+    table = [list(rows[0])] + [
+        [_format(value) for value in row.values()] for row in rows
+    ]
+    widths = [max(len(line[i]) for line in table) for i in range(len(table[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        for line in table
+    )
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m libs.profile", description=__doc__.split("\n")[1]
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="top N hot resources")
+    report.add_argument("path", help="events written by Profiler.dump")
+    report.add_argument("--top", type=int, default=10)
+    report.add_argument("--sort", choices=SORT_KEYS, default="hold")
+    report.add_argument("--json", action="store_true", help="print JSON lines")
+    flame = commands.add_parser("flame", help="folded stacks for flame graphs")
+    flame.add_argument("path", help="events written by Profiler.dump")
+    args = parser.parse_args(argv)
+
+    events = load(args.path)
+    if args.command == "flame":
+        for line in folded(events):
+            print(line)
+        return 0
+    rows = [stat.row() for stat in top(events, args.top, args.sort)]
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print(_report(rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Task runtimes and the lock ttl they call for
+
+:func:`libs.scheduler.scheduled_task` holds its lock for a ttl set by
+hand, too long and a dead worker blocks the task for nothing, too short
+and a slow run is sent a second time. :class:`AdaptiveTTL` records the
+runtime of every run in a :class:`QuantileSketch` and sets the ttl of the
+next runs to a quantile of the runtimes times a safety factor, while an
+extend renews the lock of runs outliving their ttl.
+
+Sketches are kept in the memory of the process with :class:`LocalRuntimes`
+or shared by the workers in redis with :class:`RedisRuntimes`.
+
+Example:
+
+    Fit the ttl of a task to twice its p99 runtime::
+
+        In [1]: from libs.runtimes import AdaptiveTTL, RedisRuntimes
+
+        In [2]: adaptive = AdaptiveTTL(RedisRuntimes(redisLocker.r))
+
+        In [3]: @scheduled_task(ttl=timedelta(minutes=10), capp=app, locker=redisLocker, adaptive=adaptive)
+           ...: def report():
+           ...:     ...
+
+        In [4]: adaptive.suggest("report")
+        Out[4]: datetime.timedelta(seconds=42, microseconds=318000)
+"""
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Tuple
+
+from .lockers import FailedToAcquireLock, Lock
+
+LOG = logging.getLogger(__name__)
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch with a bounded relative error
+
+    Values are counted in buckets growing geometrically by
+    ``gamma = (1 + relative_accuracy) / (1 - relative_accuracy)``, so any
+    quantile is known within ``relative_accuracy`` of its value and runtimes
+    from a millisecond to a day fit in about 900 buckets at 1%. Past
+    ``max_buckets`` the lowest buckets are merged, the error then only grows
+    on the lowest quantiles.
+
+    Args:
+        relative_accuracy: relative error of the quantiles
+        min_value: values up to this one are counted as zero
+        max_buckets: number of buckets kept
+    """
+
+    __slots__ = (
+        "relative_accuracy",
+        "min_value",
+        "max_buckets",
+        "buckets",
+        "zeros",
+        "count",
+        "_gamma",
+        "_log_gamma",
+    )
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.01,
+        min_value: float = 1e-6,
+        max_buckets: int = 2048,
+    ) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_buckets = max_buckets
+        #: count by bucket index, bucket ``k`` holds ``(gamma ** (k - 1), gamma ** k]``
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def bucket(self, value: float) -> int | None:
+        """Index of the bucket of ``value``, None for the zero bucket"""
+        if value <= self.min_value:
+            return None
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value: float, count: int = 1) -> None:
+        """Count ``value`` ``count`` times"""
+        self.add_bucket(self.bucket(value), count)
+
+    def add_bucket(self, bucket: int | None, count: int) -> None:
+        """Count ``count`` values in a bucket, None for the zero bucket"""
+        if bucket is None:
+            self.zeros += count
+        else:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+            if len(self.buckets) > self.max_buckets:
+                lowest, second = sorted(self.buckets)[:2]
+                self.buckets[second] += self.buckets.pop(lowest)
+        self.count += count
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add the values of a sketch with the same relative accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("can not merge sketches of different accuracies")
+        self.add_bucket(None, other.zeros)
+        for bucket, count in other.buckets.items():
+            self.add_bucket(bucket, count)
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile ``q`` between 0 and 1, None when empty"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                return 2 * self._gamma**bucket / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+
+class LocalRuntimes:
+    """Runtimes recorded by the current process only"""
+
+    def __init__(self, relative_accuracy: float = 0.01) -> None:
+        self.relative_accuracy = relative_accuracy
+        self._sketches: Dict[str, QuantileSketch] = {}
+        self._mutex = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._mutex:
+            sketch = self._sketches.get(name)
+            if sketch is None:
+                sketch = self._sketches[name] = QuantileSketch(self.relative_accuracy)
+            sketch.add(seconds)
+
+    def sketch(self, name: str) -> QuantileSketch:
+        """Copy of the runtimes of ``name``"""
+        copy = QuantileSketch(self.relative_accuracy)
+        with self._mutex:
+            if name in self._sketches:
+                copy.merge(self._sketches[name])
+        return copy
+
+    def reset(self, name: str) -> None:
+        with self._mutex:
+            self._sketches.pop(name, None)
+
+
+class RedisRuntimes:
+    """
+    Runtimes shared by every worker in redis
+
+    Each task has a hash of counts by bucket index, a record is one
+    ``HINCRBY`` so workers never overwrite each other.
+
+    Args:
+        r: redis client, the one of a :class:`libs.lockers.redis.RedisLockFactory` works
+        prefix: prefix of the keys of the hashes
+        relative_accuracy: relative error of the quantiles
+    """
+
+    def __init__(
+        self, r, prefix: str = "runtimes", relative_accuracy: float = 0.01
+    ) -> None:
+        self.r = r
+        self.prefix = prefix
+        self.relative_accuracy = relative_accuracy
+        self._bucket = QuantileSketch(relative_accuracy).bucket
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    def record(self, name: str, seconds: float) -> None:
+        bucket = self._bucket(seconds)
+        self.r.hincrby(self.key(name), "z" if bucket is None else str(bucket), 1)
+
+    def sketch(self, name: str) -> QuantileSketch:
+        sketch = QuantileSketch(self.relative_accuracy)
+        for field, count in self.r.hgetall(self.key(name)).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            sketch.add_bucket(None if field == "z" else int(field), int(count))
+        return sketch
+
+    def reset(self, name: str) -> None:
+        self.r.delete(self.key(name))
+
+
+class _Renewal:
+    """Thread extending a lock every third of its ttl until stopped"""
+
+    def __init__(self, lock: Lock) -> None:
+        self.lock = lock
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.lock.timeout.total_seconds() / 3):
+            try:
+                self.lock.extend()
+            except NotImplementedError:
+                return
+            except FailedToAcquireLock:
+                LOG.warning("Lock %s was lost while running", self.lock.resource.name)
+                return
+            except Exception:
+                LOG.exception("Could not renew %s", self.lock.resource.name)
+
+    def __enter__(self) -> "_Renewal":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class AdaptiveTTL:
+    """
+    Lock ttl of tasks fitted to their recorded runtimes
+
+    Once a task has ``min_samples`` runtimes its ttl is the ``quantile`` of
+    its runtimes times ``factor``, within ``min_ttl`` and ``max_ttl``.
+    Before that, or with ``apply`` off, the ttl given to the task is used
+    and the suggestion is only logged.
+
+    With ``renew`` on the lock is extended every third of its ttl while the
+    task runs, on lockers that support :meth:`libs.lockers.Lock.extend`, so
+    a run slower than the quantile keeps its lock.
+
+    Args:
+        store: where runtimes are recorded, defaults to :class:`LocalRuntimes`
+        quantile: quantile of the runtimes the ttl is based on
+        factor: safety factor applied to the quantile
+        min_samples: number of runtimes needed before suggesting a ttl
+        min_ttl: shortest ttl suggested
+        max_ttl: longest ttl suggested
+        renew: extend the lock while the task runs
+        apply: use the suggested ttl, otherwise only log it
+        refresh: seconds a sketch read from the store is reused for
+    """
+
+    def __init__(
+        self,
+        store: LocalRuntimes | RedisRuntimes | None = None,
+        quantile: float = 0.99,
+        factor: float = 2.0,
+        min_samples: int = 20,
+        min_ttl: timedelta = timedelta(seconds=1),
+        max_ttl: timedelta | None = None,
+        renew: bool = True,
+        apply: bool = True,
+        refresh: float = 60.0,
+    ) -> None:
+        self.store = store if store is not None else LocalRuntimes()
+        self.quantile = quantile
+        self.factor = factor
+        self.min_samples = min_samples
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.renew = renew
+        self.apply = apply
+        self.refresh = refresh
+        self._sketches: Dict[str, Tuple[float, QuantileSketch]] = {}
+        self._mutex = threading.Lock()
+
+    def _sketch(self, name: str) -> QuantileSketch:
+        """Sketch of ``name`` read at most every ``refresh`` seconds, the mutex must be held"""
+        read_at, sketch = self._sketches.get(name, (float("-inf"), None))
+        if time.monotonic() - read_at >= self.refresh:
+            sketch = self.store.sketch(name)
+            self._sketches[name] = (time.monotonic(), sketch)
+        return sketch
+
+    def suggest(self, name: str) -> timedelta | None:
+        """Suggested ttl of the task ``name``, None until it has enough runtimes"""
+        with self._mutex:
+            sketch = self._sketch(name)
+            if sketch.count < self.min_samples:
+                return None
+            seconds = sketch.quantile(self.quantile) * self.factor
+        ttl = max(timedelta(seconds=seconds), self.min_ttl)
+        return min(ttl, self.max_ttl) if self.max_ttl is not None else ttl
+
+    def ttl(self, name: str, default: timedelta) -> timedelta:
+        """Ttl to lock the task ``name`` with, ``default`` is the one set on the task"""
+        suggested = self.suggest(name)
+        if suggested is None:
+            return default
+        if not self.apply:
+            if suggested != default:
+                LOG.info(
+                    "Suggested ttl of %s is %s, set to %s", name, suggested, default
+                )
+            return default
+        return suggested
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record a runtime of the task ``name``"""
+        self.store.record(name, seconds)
+        with self._mutex:
+            if name in self._sketches:
+                self._sketches[name][1].add(seconds)
+
+    def run(self, lock: Lock, name: str, task: Callable, *args, **kwargs):
+        """Run ``task`` under its acquired ``lock``, renewing it and recording the runtime"""
+        started = time.monotonic()
+        try:
+            if not self.renew:
+                return task(*args, **kwargs)
+            with _Renewal(lock):
+                return task(*args, **kwargs)
+        finally:
+            self.record(name, time.monotonic() - started)
@@ -1,18 +1,132 @@
 """
 Module to task locks Locks
 """
+import collections
+import hashlib
+import inspect
+import json
 import logging
+import threading
+import time
+import uuid
 from datetime import timedelta
-from typing import Union
+from typing import TYPE_CHECKING, Callable, Iterable, Union
 
-from celery import Celery, shared_task
+from .lockers import (
+    CreateLock,
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+)
 
-from .lockers import CreateLock, LockResource
+if TYPE_CHECKING:
+    from celery import Celery
+    from celery.result import AsyncResult
+
+    from .runtimes import AdaptiveTTL
 
 LOG = logging.getLogger(__name__)
 
+#: key of a task call, see :class:`TaskLocks`
+LockKey = Union[str, Callable[..., str], Iterable[str], None]
+
 
-def scheduled_task(ttl: timedelta, capp: Celery, locker: CreateLock, **lock_kwargs):
+class TaskLocks:
+    """
+    Locks of the calls of a task, one per lock key
+
+    Without a key every call of the task shares the lock named after the
+    function. With a key each call locks ``"<function name>/<key>"`` so
+    calls with different keys run in parallel. The key is either:
+
+    * a template formatted with the arguments of the call,
+      ``"{customer_id}"``
+    * a callable taking the arguments of the call and returning the key
+    * the names of the arguments to hash, ``["customer_id", "region"]``
+
+    The lock objects of the ``cache_size`` most recent keys are kept.
+
+    Args:
+        func: function of the task
+        ttl: The length the lock should last for
+        locker: The factory used to create lock instances for the object
+        key: key of a call, see above
+        cache_size: number of lock objects kept
+    """
+
+    def __init__(
+        self,
+        func: Callable,
+        ttl: timedelta,
+        locker: CreateLock,
+        key: LockKey = None,
+        cache_size: int = 1024,
+        **lock_kwargs,
+    ) -> None:
+        self.func = func
+        self.ttl = ttl
+        self.locker = locker
+        self.key = key
+        self.cache_size = cache_size
+        self.lock_kwargs = lock_kwargs
+        self._signature = inspect.signature(func)
+        self._locks: collections.OrderedDict = collections.OrderedDict()
+        self._mutex = threading.Lock()
+        if key is None:
+            self._lock = self._create(LockResource(func.__name__))
+
+    def _create(self, resource: LockResource) -> Lock:
+        return self.locker(resource, self.ttl, **self.lock_kwargs)
+
+    def _arguments(self, args: tuple, kwargs: dict) -> dict:
+        bound = self._signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return bound.arguments
+
+    def resource(self, args: tuple, kwargs: dict) -> LockResource:
+        """Resource locked by a call"""
+        if self.key is None:
+            return LockResource(self.func.__name__)
+        if isinstance(self.key, str):
+            part = self.key.format(**self._arguments(args, kwargs))
+        elif callable(self.key):
+            part = str(self.key(*args, **kwargs))
+        else:
+            arguments = self._arguments(args, kwargs)
+            part = args_digest((), {name: arguments[name] for name in self.key})
+        return LockResource(f"{self.func.__name__}/{part}")
+
+    def __call__(self, args: tuple, kwargs: dict, ttl: timedelta | None = None) -> Lock:
+        """
+        Lock of a call, a lock of its own when ``ttl`` differs from the one
+        of the task as the cached locks are shared by the calls
+        """
+        if ttl is not None and ttl != self.ttl:
+            return self.locker(self.resource(args, kwargs), ttl, **self.lock_kwargs)
+        if self.key is None:
+            return self._lock
+        name = self.resource(args, kwargs).name
+        with self._mutex:
+            lock = self._locks.get(name)
+            if lock is not None:
+                self._locks.move_to_end(name)
+                return lock
+            lock = self._locks[name] = self._create(LockResource(name))
+            if len(self._locks) > self.cache_size:
+                self._locks.popitem(last=False)
+        return lock
+
+
+def scheduled_task(
+    ttl: timedelta,
+    capp: "Celery",
+    locker: CreateLock,
+    key: LockKey = None,
+    cache_size: int = 1024,
+    adaptive: Union["AdaptiveTTL", None] = None,
+    **lock_kwargs,
+):
     """
     Create a scheduled task locking celery task using a celery app
 
@@ -20,27 +134,48 @@ def scheduled_task(ttl: timedelta, capp: Celery, locker: CreateLock, **lock_kwar
         tts: The length the lock should last for
         capp: The Celery application used to run the task
         locker: The factory used to create lock instances for the object
+        key: lock each call on a key of its arguments, see :class:`TaskLocks`
+        cache_size: number of lock objects kept for the keys
+        adaptive: fit the ttl to the recorded runtimes of the task and renew
+            the lock while it runs, see :class:`libs.runtimes.AdaptiveTTL`
     """
 
     def get_task_lock(func):
         LOG.info(
-            f"Attempting to run {func.__name__} with locker {locker.__class__.__name__}"
+            "Attempting to run %s with locker %s",
+            func.__name__,
+            locker.__class__.__name__,
         )
-        lock = locker(LockResource(func.__name__), ttl, **lock_kwargs)
+        locks = TaskLocks(func, ttl, locker, key, cache_size, **lock_kwargs)
 
         def run_task_if_lock(*args, **kwargs):
+            if adaptive is None:
+                lock = locks(args, kwargs)
+            else:
+                lock = locks(args, kwargs, adaptive.ttl(func.__name__, ttl))
             lock.acquire()
             LOG.info(
-                f"Successfully locked {func.__name__} with locker {locker.__class__.__name__}"
+                "Successfully locked %s with locker %s",
+                func.__name__,
+                locker.__class__.__name__,
             )
-            return capp.task(func)(*args, **kwargs)
+            if adaptive is None:
+                return capp.task(func)(*args, **kwargs)
+            return adaptive.run(lock, func.__name__, capp.task(func), *args, **kwargs)
 
         return run_task_if_lock
 
     return get_task_lock
 
 
-def shared_scheduled_task(ttl: Union[timedelta], locker: CreateLock, **lock_kwargs):
+def shared_scheduled_task(
+    ttl: Union[timedelta],
+    locker: CreateLock,
+    key: LockKey = None,
+    cache_size: int = 1024,
+    adaptive: Union["AdaptiveTTL", None] = None,
+    **lock_kwargs,
+):
     """
     Create a scheduled task shared locking celery task
 
@@ -48,18 +183,167 @@ def shared_scheduled_task(ttl: Union[timedelta], locker: CreateLock, **lock_kwar
         tts: The length the lock should last for
         capp: The Celery application used to run the task
         locker: The factory used to create lock instances for the object
+        key: lock each call on a key of its arguments, see :class:`TaskLocks`
+        cache_size: number of lock objects kept for the keys
+        adaptive: fit the ttl to the recorded runtimes of the task and renew
+            the lock while it runs, see :class:`libs.runtimes.AdaptiveTTL`
     """
 
+    from celery import shared_task
+
     def get_task_lock(func):
-        lock = locker(LockResource(func.__name__), ttl, **lock_kwargs)
+        locks = TaskLocks(func, ttl, locker, key, cache_size, **lock_kwargs)
 
         def run_task_if_lock(*args, **kwargs):
+            if adaptive is None:
+                lock = locks(args, kwargs)
+            else:
+                lock = locks(args, kwargs, adaptive.ttl(func.__name__, ttl))
             lock.acquire()
             LOG.info(
-                f"Successfully locked {func.__name__} with locker {locker.__class__.__name__}"
+                "Successfully locked %s with locker %s",
+                func.__name__,
+                locker.__class__.__name__,
             )
-            return shared_task(func)(*args, **kwargs)
+            if adaptive is None:
+                return shared_task(func)(*args, **kwargs)
+            return adaptive.run(lock, func.__name__, shared_task(func), *args, **kwargs)
 
         return run_task_if_lock
 
     return get_task_lock
+
+
+def args_digest(args: tuple, kwargs: dict) -> str:
+    """Stable hash of the arguments of a call, kwargs order does not matter"""
+    payload = json.dumps([args, kwargs], sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def singleflight_task(
+    ttl: timedelta,
+    locker: CreateLock,
+    capp: Union["Celery", None] = None,
+    wait: timedelta = timedelta(seconds=1),
+    **lock_kwargs,
+):
+    """
+    Create a celery task sending a single run for identical calls
+
+    Calling the decorated function sends the task and returns its
+    :class:`celery.result.AsyncResult`. Calls with the same arguments made
+    while a run is in flight do not send the task again, they get the
+    result of the running task instead of :class:`libs.lockers.FailedToAcquireLock`.
+
+    Calls are keyed by ``LockResource("<function name>/<arguments hash>")``.
+    Every run gets its own task id, the caller that sent it stores the id
+    in the result backend under an id derived from the key, so callers in
+    other processes find the running task too. The worker releases the
+    lock of the caller with its token once the result is stored, the lock
+    only expires after ``ttl`` when the worker dies.
+
+    A key still locked by a run that already finished, on lockers whose
+    locks can not be released with their token alone such as
+    :class:`libs.lockers.quorom.QuoromLockFactory`, is not joined: after
+    ``wait`` the call sends its own run.
+
+    Args:
+        ttl: The length the lock should last for, longer than a run
+        locker: The factory used to create lock instances for the object
+        capp: The Celery application used to run the task,
+            shared tasks are used when not set, its result backend needs to
+            store results by task id, such as redis or a database
+        wait: how long a call waits for the id of a run that was just sent
+
+    Examples:
+
+        Share one report between concurrent requests::
+
+            In [1]: @singleflight_task(ttl=timedelta(minutes=5), locker=redisLocker)
+               ...: def report(customer_id):
+               ...:     ...
+
+            In [2]: report(7).id == report(7).id
+            Out[2]: True
+    """
+    from celery import shared_task, states
+
+    def get_task_lock(func):
+        def after_return(task, status, retval, task_id, args, kwargs, einfo):
+            token = task.request.get(_FLIGHT_TOKEN) or (task.request.headers or {}).get(
+                _FLIGHT_TOKEN
+            )
+            if token is None:
+                return
+            lock = locker(
+                _singleflight_resource(func, args, kwargs), ttl, **lock_kwargs
+            )
+            try:
+                lock.token = token
+                lock.release()
+            except FailedToReleaseLock:
+                # expired, the key may belong to a later run by now
+                pass
+            except Exception:
+                LOG.warning(
+                    "Could not release %s, it expires after %s",
+                    lock.resource.name,
+                    ttl,
+                    exc_info=True,
+                )
+
+        create_task = capp.task if capp is not None else shared_task
+        task = create_task(func, after_return=after_return)
+
+        def running(pointer: str) -> Union["AsyncResult", None]:
+            """Run stored under ``pointer``, None when it is not known or finished"""
+            # the pointer stays in a running state, finished results are never
+            # overwritten nor read again by the backend
+            stored = task.backend.get_task_meta(pointer, cache=False)
+            if stored["status"] != states.STARTED:
+                return None
+            result = task.AsyncResult(stored["result"])
+            return None if result.ready() else result
+
+        def send(args, kwargs, task_id: str, token: str | None) -> "AsyncResult":
+            headers = {_FLIGHT_TOKEN: token} if token is not None else None
+            return task.apply_async(args, kwargs, task_id=task_id, headers=headers)
+
+        def send_task_if_lock(*args, **kwargs) -> "AsyncResult":
+            resource = _singleflight_resource(func, args, kwargs)
+            pointer = str(uuid.uuid5(uuid.NAMESPACE_URL, resource.name))
+            lock = locker(resource, ttl, **lock_kwargs)
+            deadline = time.monotonic() + wait.total_seconds()
+            while True:
+                try:
+                    lock.acquire()
+                    break
+                except FailedToAcquireLock:
+                    result = running(pointer)
+                if result is not None:
+                    LOG.info("Joining running %s as %s", resource.name, result.id)
+                    return result
+                if time.monotonic() >= deadline:
+                    LOG.warning("%s is locked by a finished run", resource.name)
+                    return send(args, kwargs, str(uuid.uuid4()), None)
+                time.sleep(0.05)
+            task_id = str(uuid.uuid4())
+            try:
+                task.backend.store_result(pointer, task_id, states.STARTED)
+                return send(args, kwargs, task_id, lock.token)
+            except Exception:
+                lock.release()
+                raise
+
+        send_task_if_lock.task = task
+        return send_task_if_lock
+
+    return get_task_lock
+
+
+#: header carrying the token of the lock of a singleflight run
+_FLIGHT_TOKEN = "singleflight_token"
+
+
+def _singleflight_resource(func, args, kwargs) -> LockResource:
+    return LockResource(f"{func.__name__}/{args_digest(tuple(args), kwargs)}")
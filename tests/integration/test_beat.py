@@ -0,0 +1,98 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from celery import Celery
+
+from libs.beat import LockAwareScheduler
+from libs.lockers import LockResource
+from libs.lockers.memory import InMemoryLockFactory
+
+
+@pytest.fixture
+def app():
+    app = Celery(broker="memory://")
+    app.conf.beat_schedule = {
+        "report": {"task": "main.report", "schedule": timedelta(seconds=1)},
+        "cleanup": {"task": "main.cleanup", "schedule": timedelta(seconds=1)},
+    }
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def memlocker():
+    return InMemoryLockFactory()
+
+
+@pytest.fixture
+def scheduler(app, memlocker, tmp_path):
+    scheduler = LockAwareScheduler(
+        app,
+        schedule_filename=str(tmp_path / "beat"),
+        locker=memlocker,
+        lock_resources={"cleanup": "janitor"},
+    )
+    for entry in scheduler.schedule.values():
+        entry.last_run_at = app.now() - timedelta(minutes=1)
+    with mock.patch.object(scheduler, "apply_async") as apply_async:
+        scheduler.sent = apply_async
+        yield scheduler
+    scheduler.close()
+
+
+def _sent(scheduler):
+    return [call.args[0].name for call in scheduler.sent.call_args_list]
+
+
+def test_sends_unlocked_entries(scheduler):
+    scheduler.apply_entry(scheduler.schedule["report"])
+    assert _sent(scheduler) == ["report"]
+
+
+def test_skips_locked_entries(scheduler, memlocker):
+    memlocker(LockResource("janitor"), timedelta(seconds=30)).acquire()
+    scheduler.apply_entry(scheduler.schedule["cleanup"])
+    scheduler.apply_entry(scheduler.schedule["report"])
+    assert _sent(scheduler) == ["report"]
+    assert scheduler.skipped == {"cleanup": 1}
+
+
+def test_reads_locks_in_bulk(scheduler, memlocker):
+    with mock.patch.object(
+        memlocker, "status_many", wraps=memlocker.status_many
+    ) as status_many:
+        scheduler.apply_entry(scheduler.schedule["report"])
+        scheduler.apply_entry(scheduler.schedule["cleanup"])
+    assert status_many.call_count == 1
+    assert {resource.name for resource in status_many.call_args.args[0]} == {
+        "report",
+        "janitor",
+    }
+
+
+def test_coalesces_dispatches_until_next_read(scheduler):
+    scheduler.apply_entry(scheduler.schedule["report"])
+    scheduler.apply_entry(scheduler.schedule["report"])
+    assert _sent(scheduler) == ["report"]
+    scheduler._read_at = float("-inf")
+    scheduler.apply_entry(scheduler.schedule["report"])
+    assert _sent(scheduler) == ["report", "report"]
+
+
+def test_sends_when_locks_can_not_be_read(scheduler, memlocker):
+    with mock.patch.object(memlocker, "status_many", side_effect=ConnectionError):
+        scheduler.apply_entry(scheduler.schedule["report"])
+    assert _sent(scheduler) == ["report"]
+
+
+def test_locker_from_app_settings(app, tmp_path):
+    app.conf.beat_locker = "memory://"
+    scheduler = LockAwareScheduler(app, schedule_filename=str(tmp_path / "beat"))
+    assert isinstance(scheduler.locker, InMemoryLockFactory)
+    scheduler.close()
+
+
+def test_needs_a_locker(app, tmp_path):
+    with pytest.raises(ValueError):
+        LockAwareScheduler(app, schedule_filename=str(tmp_path / "beat"))
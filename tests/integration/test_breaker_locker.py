@@ -0,0 +1,86 @@
+from datetime import timedelta
+from time import sleep
+from unittest import mock
+
+import pytest
+
+from libs.lockers import (
+    CreateLock,
+    FailedToAcquireLock,
+    LockResource,
+    UnknownLockStatus,
+)
+from libs.lockers.breaker import CircuitBreaker, CircuitBreakerLockFactory
+
+
+@pytest.fixture
+def backend():
+    locker = mock.MagicMock(spec=CreateLock)
+    locker.return_value.acquire.side_effect = ConnectionError()
+    return locker
+
+
+@pytest.fixture
+def blocker(backend):
+    return CircuitBreakerLockFactory(
+        backend, failure_threshold=2, reset_timeout=timedelta(seconds=0.2)
+    )
+
+
+def _trip(lock):
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            lock.acquire()
+
+
+def test_opens_after_threshold(blocker, backend):
+    lock = blocker(LockResource("test"), timedelta(seconds=1))
+    _trip(lock)
+    assert blocker.breaker.state == CircuitBreaker.OPEN
+    backend.return_value.acquire.reset_mock()
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+    with pytest.raises(UnknownLockStatus):
+        lock.status
+    backend.return_value.acquire.assert_not_called()
+
+
+def test_contention_is_not_a_failure(blocker, backend):
+    backend.return_value.acquire.side_effect = FailedToAcquireLock()
+    lock = blocker(LockResource("test"), timedelta(seconds=1))
+    for _ in range(3):
+        with pytest.raises(FailedToAcquireLock):
+            lock.acquire()
+    assert blocker.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_closes(blocker, backend):
+    lock = blocker(LockResource("test"), timedelta(seconds=1))
+    _trip(lock)
+    sleep(0.2)
+    assert blocker.breaker.state == CircuitBreaker.HALF_OPEN
+    backend.return_value.acquire.side_effect = None
+    backend.return_value.acquire.return_value = True
+    assert lock.acquire()
+    assert blocker.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_reopens(blocker, backend):
+    lock = blocker(LockResource("test"), timedelta(seconds=1))
+    _trip(lock)
+    sleep(0.2)
+    with pytest.raises(ConnectionError):
+        lock.acquire()
+    assert blocker.breaker.state == CircuitBreaker.OPEN
+
+
+def test_fallback_while_open(backend):
+    fallback = mock.MagicMock(spec=CreateLock)
+    fallback.return_value.acquire.return_value = True
+    blocker = CircuitBreakerLockFactory(backend, fallback=fallback, failure_threshold=2)
+    lock = blocker(LockResource("test"), timedelta(seconds=1))
+    _trip(lock)
+    assert lock.acquire()
+    lock.release()
+    fallback.return_value.release.assert_called_once()
+    backend.return_value.release.assert_not_called()
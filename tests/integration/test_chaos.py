@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.chaos import overlaps
+
+
+@pytest.mark.parametrize(
+    "sections, ttl, expected",
+    [
+        # one after the other
+        ([(0, "a", 0, 1, 2), (1, "a", 1, 2, 3)], 10, (0, 0)),
+        # entered while the first lock was still valid
+        ([(0, "a", 0, 1, 5), (1, "a", 1, 2, 3)], 10, (1, 0)),
+        # entered after the first lock expired under its holder
+        ([(0, "a", 0, 1, 5), (1, "a", 1, 2, 3)], 1, (0, 1)),
+        # different resources never overlap
+        ([(0, "a", 0, 1, 5), (1, "b", 1, 2, 3)], 10, (0, 0)),
+        # the longest section is the holder of the ones inside it
+        ([(0, "a", 0, 1, 10), (1, "a", 1, 2, 3), (2, "a", 3, 4, 5)], 10, (2, 0)),
+        # order of the sections does not matter
+        ([(1, "a", 1, 2, 3), (0, "a", 0, 1, 5)], 10, (1, 0)),
+        ([], 10, (0, 0)),
+    ],
+)
+def test_overlaps(sections, ttl, expected):
+    assert overlaps(sections, ttl) == expected
@@ -0,0 +1,115 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    hooks,
+)
+from libs.lockers.quorom import QuoromLock
+
+
+class DictLock(Lock):
+    held = {}
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def acquire(self) -> bool:
+        if self.held.get(self.resource.name):
+            raise FailedToAcquireLock
+        self.held[self.resource.name] = True
+        return True
+
+    def release(self) -> bool:
+        if not self.held.pop(self.resource.name, False):
+            raise FailedToReleaseLock
+        return True
+
+    @property
+    def status(self) -> bool:
+        return bool(self.held.get(self.resource.name))
+
+
+@pytest.fixture
+def events():
+    events = []
+    hooks.add_listener(events.append)
+    DictLock.held.clear()
+    yield events
+    hooks.remove_listener(events.append)
+
+
+def test_events(events):
+    lock = DictLock(LockResource("test"))
+    lock.acquire()
+    assert lock.status
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+    lock.release()
+    assert [(e.operation, e.outcome) for e in events] == [
+        ("acquire", hooks.OK),
+        ("status", hooks.OK),
+        ("acquire", hooks.CONTENDED),
+        ("release", hooks.OK),
+    ]
+    assert {e.backend for e in events} == {"DictLock"}
+    assert {e.resource for e in events} == {"test"}
+    assert events[-1].hold is not None and events[-1].hold >= 0
+
+
+def test_backend_error(events):
+    lock = DictLock(LockResource("test"))
+    with mock.patch.object(DictLock, "held", new=None):
+        with pytest.raises(AttributeError):
+            lock.acquire()
+    assert events[0].outcome == hooks.ERROR
+
+
+def test_quorom_member_events(events):
+    resource = LockResource("test")
+    lock = QuoromLock([DictLock(resource)], resource, timedelta(seconds=1))
+    lock.acquire()
+    assert [(e.backend, e.operation) for e in events] == [
+        ("DictLock", "acquire"),
+        ("QuoromLock", "acquire"),
+    ]
+
+
+def test_listener_errors_are_ignored(events):
+    @hooks.add_listener
+    def broken(event):
+        raise ValueError
+
+    try:
+        DictLock(LockResource("test")).acquire()
+    finally:
+        hooks.remove_listener(broken)
+    assert len(events) == 1
+
+
+def test_prometheus_listener(events):
+    prometheus_client = pytest.importorskip("prometheus_client")
+    registry = prometheus_client.CollectorRegistry()
+    listener = hooks.add_listener(hooks.PrometheusListener(registry))
+    try:
+        lock = DictLock(LockResource("test"))
+        lock.acquire()
+        with pytest.raises(FailedToAcquireLock):
+            lock.acquire()
+        lock.release()
+    finally:
+        hooks.remove_listener(listener)
+    labels = {"operation": "acquire", "backend": "DictLock", "resource": "test"}
+    assert registry.get_sample_value("ha_task_locker_contended_total", labels) == 1
+    assert (
+        registry.get_sample_value(
+            "ha_task_locker_hold_seconds_count",
+            {"backend": "DictLock", "resource": "test"},
+        )
+        == 1
+    )
@@ -0,0 +1,221 @@
+import multiprocessing
+from datetime import timedelta
+from time import sleep
+
+import pytest
+from celery import Celery
+
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    LockResource,
+    LockState,
+)
+from libs.lockers.memory import InMemoryLockFactory, SharedMemoryLockFactory
+from libs.scheduler import TaskLocks, scheduled_task, shared_scheduled_task
+
+
+@pytest.fixture
+def app():
+    app = Celery()
+    app.config_from_object("celeryconfig")
+    yield app
+    app.close()
+
+
+@pytest.fixture(params=[InMemoryLockFactory, SharedMemoryLockFactory])
+def memlocker(request):
+    return request.param()
+
+
+@pytest.fixture
+def memlock(memlocker):
+    return memlocker(resource=LockResource("test"), timeout=timedelta(seconds=1))
+
+
+def test_memory_scheduled_task_locker(app, memlocker):
+    ttl = timedelta(seconds=1)
+
+    @scheduled_task(ttl=ttl, capp=app, locker=memlocker)
+    def test_memory_scheduled_task():
+        return 1 + 1
+
+    test_memory_scheduled_task()
+    with pytest.raises(FailedToAcquireLock):
+        test_memory_scheduled_task()
+    sleep(1)
+    test_memory_scheduled_task()
+
+
+def test_memory_shared_task_locker(memlocker):
+    ttl = timedelta(seconds=1)
+
+    @shared_scheduled_task(ttl=ttl, locker=memlocker)
+    def test_memory_shared_task():
+        return 1 + 1
+
+    test_memory_shared_task()
+    with pytest.raises(FailedToAcquireLock):
+        test_memory_shared_task()
+    sleep(1)
+    test_memory_shared_task()
+
+
+@pytest.mark.parametrize(
+    "key",
+    ["{customer_id}", lambda customer_id, day=None: customer_id, ["customer_id"]],
+    ids=["template", "callable", "hash"],
+)
+def test_memory_scheduled_task_per_key(app, memlocker, key):
+    ttl = timedelta(seconds=1)
+
+    @scheduled_task(ttl=ttl, capp=app, locker=memlocker, key=key)
+    def test_memory_keyed_task(customer_id, day=None):
+        return customer_id
+
+    test_memory_keyed_task(1)
+    test_memory_keyed_task(2)
+    with pytest.raises(FailedToAcquireLock):
+        test_memory_keyed_task(1, day="monday")
+    with pytest.raises(FailedToAcquireLock):
+        test_memory_keyed_task(customer_id=2)
+
+
+def test_task_locks_names_and_cache(memlocker):
+    def report(customer_id, region="eu"):
+        pass
+
+    locks = TaskLocks(
+        report, timedelta(seconds=1), memlocker, "{region}/{customer_id}", 2
+    )
+    assert locks.resource((7,), {}).name == "report/eu/7"
+    first = locks((1,), {})
+    assert locks((1,), {}) is first
+    locks((2,), {})
+    locks((3,), {})
+    assert locks((1,), {}) is not first
+    assert TaskLocks(report, timedelta(seconds=1), memlocker).resource(
+        (7,), {}
+    ).name == ("report")
+
+
+def test_locks_are_slotted(memlock):
+    assert not hasattr(memlock, "__dict__")
+    assert memlock.token is None
+    assert LockResource("".join(["te", "st"])).name is memlock.resource.name
+    with pytest.raises(AttributeError):
+        memlock.resource.name = "other"
+
+
+def test_lock_status(memlock):
+    memlock.acquire()
+    assert memlock.status
+    memlock.release()
+    assert not memlock.status
+    memlock.acquire()
+    sleep(1)
+    assert not memlock.status
+
+
+def test_lock_context_manager(memlock):
+    with memlock:
+        assert memlock.status
+    assert not memlock.status
+
+
+def test_raises_failed_to_release(memlock):
+    with pytest.raises(FailedToReleaseLock):
+        memlock.release()
+
+
+def _acquire_in_child(locker, queue):
+    try:
+        locker(LockResource("test"), timedelta(seconds=1)).acquire()
+        queue.put(True)
+    except FailedToAcquireLock:
+        queue.put(False)
+
+
+def test_shared_between_processes():
+    locker = SharedMemoryLockFactory()
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    children = [
+        ctx.Process(target=_acquire_in_child, args=(locker, queue)) for _ in range(4)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+    assert sorted(queue.get() for _ in children) == [False, False, False, True]
+    assert locker(LockResource("test"), timedelta(seconds=1)).status
+
+
+def test_shared_table_full():
+    locker = SharedMemoryLockFactory(slots=2, max_probe=2)
+    for name in ("a", "b"):
+        locker(LockResource(name), timedelta(seconds=1)).acquire()
+    with pytest.raises(FailedToAcquireLock):
+        locker(LockResource("c"), timedelta(seconds=1)).acquire()
+
+
+def test_validity(memlock):
+    assert memlock.validity == timedelta(0)
+    memlock.acquire()
+    assert (
+        timedelta(0)
+        < memlock.validity
+        <= timedelta(seconds=1) - memlock.drift(timedelta(seconds=1))
+    )
+    memlock.release()
+    assert memlock.validity == timedelta(0)
+
+
+def test_stale_lock_can_not_release(memlocker):
+    ttl = timedelta(seconds=1)
+    stale = memlocker(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = memlocker(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_held_under_prefix():
+    memlocker = InMemoryLockFactory()
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        memlocker(LockResource(name), ttl).acquire()
+    assert sorted(memlocker.held("tenant/job")) == ["tenant/job/1", "tenant/job/2"]
+    assert memlocker.release_all("tenant/") == 3
+    assert memlocker.held("tenant") == []
+    assert memlocker.held("tenant-2") == ["tenant-2/job"]
+    with pytest.raises(ValueError):
+        memlocker.held("/")
+    with pytest.raises(NotImplementedError):
+        SharedMemoryLockFactory(slots=8).held("tenant")
+
+
+def test_export_restore():
+    memlocker = InMemoryLockFactory()
+    ttl = timedelta(seconds=30)
+    lock = memlocker(LockResource("export/a"), ttl)
+    lock.acquire()
+    memlocker(LockResource("other"), ttl).acquire()
+    (state,) = memlocker.export("export")
+    assert (state.name, state.token) == ("export/a", lock.token)
+    assert len(list(memlocker.export())) == 2
+    target = InMemoryLockFactory()
+    target(LockResource("other"), ttl).acquire()
+    assert target.restore(memlocker.export()) == 1
+    lock.table = target.table
+    lock.release()
+    with pytest.raises(NotImplementedError):
+        list(SharedMemoryLockFactory(slots=8).export())
@@ -5,7 +5,13 @@ import pytest
 from celery import Celery
 from libs.lockers.mongodb import MongoLockFactory
 from libs.scheduler import scheduled_task, shared_scheduled_task
-from libs.lockers import FailedToAcquireLock, FailedToReleaseLock, Lock, LockResource
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+)
 from time import sleep
 
 
@@ -69,3 +75,51 @@ def test_lock_status(mongodb: MongoLockFactory):
     lock.acquire()
     sleep(1)
     assert not lock.status
+
+
+def test_stale_lock_can_not_release(mongodb):
+    ttl = timedelta(seconds=1)
+    stale = mongodb(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = mongodb(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_held_under_prefix(mongodb):
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        mongodb(LockResource(name), ttl).acquire()
+    assert mongodb.held("tenant/job") == ["tenant/job/1", "tenant/job/2"]
+    assert mongodb.held("tenant") == ["tenant", "tenant/job/1", "tenant/job/2"]
+    assert mongodb.release_all("tenant/") == 3
+    assert mongodb.held("tenant") == []
+    assert mongodb.held("tenant-2") == ["tenant-2/job"]
+    mongodb(LockResource("tenant/job/1"), ttl).acquire()
+
+
+def test_export_restore(mongodb):
+    ttl = timedelta(seconds=30)
+    lock = mongodb(LockResource("export/a"), ttl)
+    lock.acquire()
+    mongodb(LockResource("export/b/c"), ttl).acquire()
+    states = sorted(mongodb.export("export"), key=lambda state: state.name)
+    assert [state.name for state in states] == ["export/a", "export/b/c"]
+    assert states[0].token == lock.token
+    assert timedelta(seconds=25) < states[0].ttl <= ttl
+    assert mongodb.release_all("export") == 2
+    expired = LockState("export/d", "token", timedelta(0))
+    assert mongodb.restore(states + [expired]) == 2
+    assert mongodb.restore(states) == 0
+    assert sorted(mongodb.held("export")) == ["export/a", "export/b/c"]
+    lock.release()
+    assert mongodb.held("export") == ["export/b/c"]
+    mongodb.release_all("export")
@@ -0,0 +1,84 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from libs import profile
+from libs.lockers import FailedToAcquireLock, LockResource, hooks
+from libs.lockers.memory import InMemoryLockFactory
+from libs.lockers.quorom import QuoromLockFactory
+
+
+@pytest.fixture
+def profiler():
+    with profile.Profiler(capacity=100) as profiler:
+        yield profiler
+
+
+def run(locker, name, contended=0):
+    lock = locker(LockResource(name), timedelta(seconds=30))
+    lock.acquire()
+    for _ in range(contended):
+        with pytest.raises(FailedToAcquireLock):
+            locker(LockResource(name), timedelta(seconds=30)).acquire()
+    lock.release()
+
+
+def test_ring_buffer():
+    profiler = profile.Profiler(capacity=3)
+    for index in range(5):
+        profiler(hooks.LockEvent("acquire", "Lock", str(index), 0.0, 0.0, hooks.OK))
+    assert [event.resource for event in profiler.events] == ["2", "3", "4"]
+
+
+def test_stop(profiler):
+    locker = InMemoryLockFactory()
+    run(locker, "test")
+    profiler.stop()
+    run(locker, "test")
+    assert len(profiler.events) == 2
+    profiler.start()
+
+
+def test_top(profiler):
+    locker = InMemoryLockFactory()
+    run(locker, "cold")
+    run(locker, "hot", contended=3)
+    stats = profile.top(profiler.events, n=1, sort="contention")
+    assert [stat.resource for stat in stats] == ["hot"]
+    assert stats[0].acquires == 4
+    assert stats[0].contention == 0.75
+    assert stats[0].backend == "InMemoryLock"
+    assert len(stats[0].holds) == 1
+    with pytest.raises(ValueError):
+        profile.top(profiler.events, sort="size")
+
+
+def test_dump_and_report(profiler, tmp_path, capsys):
+    locker = InMemoryLockFactory()
+    run(locker, "test", contended=1)
+    path = str(tmp_path / "locks.jsonl")
+    assert profiler.dump(path) == 3
+    assert profile.load(path) == list(profiler.events)
+
+    assert profile.main(["report", path, "--json"]) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert rows[0]["resource"] == "test"
+    assert rows[0]["contention"] == 0.5
+
+    assert profile.main(["report", path]) == 0
+    assert capsys.readouterr().out.startswith("resource")
+
+    profile.main(["flame", path])
+    stacks = [line.rsplit(" ", 1)[0] for line in capsys.readouterr().out.splitlines()]
+    assert "InMemoryLock;acquire;test" in stacks
+
+
+def test_wrapped_locks_counted_apart(profiler):
+    members = [InMemoryLockFactory() for _ in range(3)]
+    run(QuoromLockFactory(members), "test")
+    stats = profile.summarize(profiler.events)
+    quorom = stats[("test", "QuoromLock")]
+    assert quorom.acquires == 1
+    assert len(quorom.holds) == 1
+    assert stats[("test", "InMemoryLock")].acquires == 3
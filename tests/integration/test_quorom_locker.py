@@ -10,6 +10,7 @@ from libs.lockers.redis import RedisLockFactory
 from libs.scheduler import scheduled_task, shared_scheduled_task
 from libs.lockers import FailedToAcquireLock, FailedToReleaseLock, LockResource
 from libs.lockers.zookeeper import KazooLease, KazooLockFactory
+from libs.lockers.memory import InMemoryLockFactory
 from libs.lockers.quorom import QuoromLock, QuoromLockFactory
 from libs.lockers.mongodb import MongoLock, MongoLockFactory
 from pymongo.mongo_client import MongoClient
@@ -114,8 +115,9 @@ def test_quorom_acquire(quorom_lock):
     lock.locks[0].release()
     with pytest.raises(FailedToAcquireLock):
         lock.acquire()
+    # the failed acquire freed the member it locked
+    assert not lock.locks[0].status
     lock.locks[1].release()
-    lock.locks[0].release()
     lock.acquire()
 
 
@@ -159,3 +161,93 @@ def test_lock_status(quorom_lock):
     lock.acquire()
     sleep(1)
     assert not lock.status
+
+
+def _member(acquire=True, status=True):
+    member = mock.MagicMock()
+    member.acquire.return_value = acquire
+    type(member).status = mock.PropertyMock(return_value=status)
+    return member
+
+
+def test_weighted_quorom():
+    ttl = timedelta(seconds=1)
+    heavy, light_a, light_b = _member(), _member(), _member()
+    light_a.acquire.side_effect = FailedToAcquireLock()
+    light_b.acquire.side_effect = FailedToAcquireLock()
+    lock = QuoromLock([heavy, light_a, light_b], LockResource("test"), ttl, [3, 1, 1])
+    assert lock.acquire()
+    lock = QuoromLock([heavy, light_a, light_b], LockResource("test"), ttl)
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+
+
+def test_backend_error_counts_as_no_vote():
+    ttl = timedelta(seconds=1)
+    broken = _member()
+    broken.acquire.side_effect = ConnectionError()
+    lock = QuoromLock([_member(), _member(), broken], LockResource("test"), ttl)
+    assert lock.acquire()
+    assert lock.health[2].error_rate == 1
+
+
+def test_unhealthy_member_skipped():
+    ttl = timedelta(seconds=1)
+    members = [_member(), _member(), _member()]
+    members[2].acquire.side_effect = ConnectionError()
+    factory = QuoromLockFactory(
+        [mock.MagicMock(return_value=member) for member in members],
+        health={"min_samples": 2},
+    )
+    for _ in range(2):
+        factory(LockResource("test"), ttl).acquire()
+    assert not factory.health[2].healthy
+    members[2].acquire.reset_mock()
+    factory(LockResource("test"), ttl).acquire()
+    members[2].acquire.assert_not_called()
+
+
+def test_unhealthy_member_used_when_needed_for_quorom():
+    ttl = timedelta(seconds=1)
+    members = [_member(), _member(), _member()]
+    factory = QuoromLockFactory(
+        [mock.MagicMock(return_value=member) for member in members]
+    )
+    for health in factory.health[1:]:
+        health.ejected_until = float("inf")
+    assert factory(LockResource("test"), ttl).acquire()
+    members[2].acquire.assert_called()
+
+
+def test_release_on_member_ejected_while_held():
+    ttl = timedelta(seconds=30)
+    lockers = [InMemoryLockFactory() for _ in range(3)]
+    lock = QuoromLockFactory(lockers)(LockResource("test"), ttl)
+    assert lock.acquire()
+    lock.health[2].ejected_until = float("inf")
+    lock.release()
+    assert [locker.held("test") for locker in lockers] == [[], [], []]
+
+
+def test_failed_acquire_releases_acquired_members():
+    ttl = timedelta(seconds=30)
+    lockers = [InMemoryLockFactory() for _ in range(3)]
+    for locker in lockers[1:]:
+        locker(LockResource("test"), ttl).acquire()
+    lock = QuoromLockFactory(lockers)(LockResource("test"), ttl)
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+    assert lockers[0].held("test") == []
+    assert lock.acquired == []
+
+
+def test_release_with_acquired_member_ejected():
+    ttl = timedelta(seconds=30)
+    lockers = [InMemoryLockFactory() for _ in range(3)]
+    lock = QuoromLockFactory(lockers)(LockResource("test"), ttl)
+    with mock.patch.object(lockers[2].table, "acquire", side_effect=ConnectionError):
+        assert lock.acquire()
+    lock.health[0].ejected_until = float("inf")
+    assert lock.status
+    lock.release()
+    assert [locker.held("test") for locker in lockers] == [[], [], []]
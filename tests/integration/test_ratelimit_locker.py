@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import pytest
+import redis
+from celery import Celery
+from pymongo.mongo_client import MongoClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from libs.lockers import FailedToAcquireLock, LockResource
+from libs.lockers.mongodb import MongoRateLimitFactory
+from libs.lockers.ratelimit import TokenBucket
+from libs.lockers.redis import RedisRateLimitFactory
+from libs.lockers.sqlalchemy import SQLRateLimitFactory, _create_all, _drop_all
+from libs.scheduler import scheduled_task
+from time import sleep
+
+
+@pytest.fixture
+def app():
+    app = Celery()
+    app.config_from_object("celeryconfig")
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def redislimiter():
+    r = redis.from_url("redis://redis:6379/1")
+    r.flushall()
+    yield RedisRateLimitFactory(r, rate=2, burst=3)
+    r.close()
+
+
+@pytest.fixture
+def mongolimiter():
+    mongo_client = MongoClient("mongodb://mongodb")
+    mongo_client.drop_database("lock")
+    yield MongoRateLimitFactory(mongo_client.lock, rate=2, burst=3)
+    mongo_client.close()
+
+
+@pytest.fixture
+def sqllimiter():
+    engine = create_engine("postgresql://postgres:postgres@db/postgres")
+    session = Session(engine)
+    _create_all(engine)
+    yield SQLRateLimitFactory(session, rate=2, burst=3)
+    _drop_all(engine)
+    session.close()
+
+
+@pytest.fixture(params=["redislimiter", "mongolimiter", "sqllimiter"])
+def limiter(request):
+    return request.getfixturevalue(request.param)
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(10, timedelta(seconds=10), burst=15)
+    assert bucket.capacity == 15
+    assert bucket.refill(0, 5) == 5
+    assert bucket.refill(14, 5) == 15
+
+
+def test_burst_then_refill(limiter):
+    lock = limiter(LockResource("test"), timedelta(seconds=1))
+    for _ in range(3):
+        lock.acquire()
+    assert lock.status
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+    sleep(0.5)
+    assert not lock.status
+    lock.acquire()
+
+
+def test_ratelimit_scheduled_task(app, limiter):
+    @scheduled_task(ttl=timedelta(seconds=1), capp=app, locker=limiter)
+    def test_ratelimited_task():
+        return 1 + 1
+
+    for _ in range(3):
+        test_ratelimited_task()
+    with pytest.raises(FailedToAcquireLock):
+        test_ratelimited_task()
+    sleep(0.5)
+    test_ratelimited_task()
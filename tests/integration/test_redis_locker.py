@@ -6,10 +6,19 @@ print(sys.path)
 import redis, pytest
 
 from celery import Celery
-from libs.lockers.redis import RedisLock, RedisLockFactory
+from libs.lockers.redis import RedisLock, RedisLockFactory, hash_tag_key
 from libs.scheduler import scheduled_task, shared_scheduled_task
-from libs.lockers import FailedToAcquireLock, FailedToReleaseLock, Lock, LockResource
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+)
 from time import sleep
+from unittest import mock
+
+from redis.crc import key_slot
 
 
 @pytest.fixture
@@ -88,3 +97,124 @@ def test_lock_context_manager(rlock: RedisLock):
 def test_raises_failed_to_release(rlock: RedisLock):
     with pytest.raises(FailedToReleaseLock):
         rlock.release()
+
+
+def test_stale_lock_can_not_release(redislocker):
+    ttl = timedelta(seconds=1)
+    stale = redislocker(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = redislocker(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_lock_holder(rlock: RedisLock):
+    assert rlock.holder.token is None
+    rlock.acquire()
+    holder = rlock.holder
+    assert holder.token == rlock.token
+    assert timedelta(0) < holder.ttl <= timedelta(seconds=1)
+    rlock.release()
+
+
+def test_status_many(redislocker):
+    ttl = timedelta(seconds=1)
+    lock = redislocker(LockResource("a"), ttl)
+    lock.acquire()
+    resources = [LockResource("a"), LockResource("b")]
+    assert redislocker.status_many(resources) == {"a": True, "b": False}
+    assert redislocker.holders(resources)["a"].token == lock.token
+    assert redislocker.status_many([]) == {}
+
+
+def test_scripts_reloaded_after_flush(redislocker, rlock: RedisLock):
+    assert redislocker.scripts is rlock.scripts
+    rlock.acquire()
+    redislocker.r.script_flush()
+    assert rlock.status
+    rlock.release()
+    assert not rlock.status
+
+
+def test_hash_tag_key():
+    assert hash_tag_key("tenant/job/1", 0) == "tenant/job/1"
+    assert hash_tag_key("tenant/job/1", 1) == "{tenant}/job/1"
+    assert hash_tag_key("tenant/job/1", 2) == "{tenant/job}/1"
+    assert hash_tag_key("tenant", 1) == "{tenant}"
+    assert hash_tag_key("{tenant}/job", 1) == "{tenant}/job"
+
+
+@pytest.mark.parametrize("depth", [0, 1, 2])
+def test_cluster_keys_in_one_slot(redislocker, depth):
+    with mock.patch("redis.RedisCluster", type(redislocker.r)):
+        locker = RedisLockFactory(redislocker.r, hash_tag_depth=depth)
+    for name in ["report/7", "tenant/job/1"]:
+        lock = locker(LockResource(name), timedelta(seconds=1))
+        assert len({key_slot(key.encode()) for key in lock.keys}) == 1
+    if depth == 0:
+        assert lock.keys == [lock.key]
+        with pytest.raises(ValueError):
+            locker.held("tenant")
+    else:
+        assert locker.index_key("tenant/job") in lock.keys
+
+
+def test_wait_for_replicas(redislocker):
+    # the test server has no replicas so the write is never acknowledged
+    locker = RedisLockFactory(
+        redislocker.r, replicas=1, replica_timeout=timedelta(milliseconds=10)
+    )
+    lock = locker(LockResource("test"), timedelta(seconds=1))
+    with pytest.raises(FailedToAcquireLock):
+        lock.acquire()
+    assert not lock.status
+
+
+def test_contended_acquire_is_one_call(redislocker, rlock: RedisLock):
+    rlock.acquire()
+    lock = redislocker(LockResource("test"), timedelta(seconds=1))
+    with mock.patch.object(
+        redislocker.r, "evalsha", wraps=redislocker.r.evalsha
+    ) as evalsha:
+        with pytest.raises(FailedToAcquireLock):
+            lock.acquire()
+    assert evalsha.call_count == 1
+
+
+def test_held_under_prefix(redislocker):
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        redislocker(LockResource(name), ttl).acquire()
+    assert redislocker.held("tenant/job") == ["tenant/job/1", "tenant/job/2"]
+    assert redislocker.held("tenant") == ["tenant", "tenant/job/1", "tenant/job/2"]
+    assert redislocker.release_all("tenant/") == 3
+    assert redislocker.held("tenant") == []
+    assert redislocker.held("tenant-2") == ["tenant-2/job"]
+    redislocker(LockResource("tenant/job/1"), ttl).acquire()
+
+
+def test_export_restore(redislocker):
+    ttl = timedelta(seconds=30)
+    lock = redislocker(LockResource("export/a"), ttl)
+    lock.acquire()
+    redislocker(LockResource("export/b/c"), ttl).acquire()
+    states = sorted(redislocker.export("export"), key=lambda state: state.name)
+    assert [state.name for state in states] == ["export/a", "export/b/c"]
+    assert states[0].token == lock.token
+    assert timedelta(seconds=25) < states[0].ttl <= ttl
+    assert redislocker.release_all("export") == 2
+    expired = LockState("export/d", "token", timedelta(0))
+    assert redislocker.restore(states + [expired]) == 2
+    assert redislocker.restore(states) == 0
+    assert sorted(redislocker.held("export")) == ["export/a", "export/b/c"]
+    lock.release()
+    assert redislocker.held("export") == ["export/b/c"]
+    redislocker.release_all("export")
@@ -0,0 +1,104 @@
+import subprocess
+import sys
+from datetime import timedelta
+
+import pytest
+
+from libs.lockers import LockResource, registry
+from libs.lockers.memory import InMemoryLockFactory, SharedMemoryLockFactory
+from libs.lockers.sqlite import SQLiteLockFactory
+
+
+def test_resolve_name():
+    assert registry.resolve("memory") is InMemoryLockFactory
+    assert registry.resolve("shared-memory") is SharedMemoryLockFactory
+
+
+def test_resolve_url():
+    assert registry.resolve("sqlite:///tmp/locks.db") is SQLiteLockFactory
+    assert registry.name_of("redis://redis:6379/1") == "redis"
+    assert registry.name_of("mongodb+srv://mongodb/lock") == "mongodb"
+    assert registry.name_of("postgresql+psycopg2://db/postgres") == "sqlalchemy"
+    assert registry.name_of("zk://zookeeper:2181") == "zookeeper"
+
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        registry.resolve("etcd://etcd:2379")
+    with pytest.raises(ValueError):
+        registry.resolve("etcd")
+
+
+def test_register():
+    registry.register("test", "libs.lockers.memory:InMemoryLockFactory", ["test"])
+    try:
+        assert registry.resolve("test://") is InMemoryLockFactory
+    finally:
+        del registry.FACTORIES["test"], registry.SCHEMES["test"]
+    with pytest.raises(ValueError):
+        registry.register("test", "libs.lockers.memory.InMemoryLockFactory")
+
+
+def test_package_attribute():
+    from libs.lockers import InMemoryLockFactory as factory
+
+    assert factory is InMemoryLockFactory
+    with pytest.raises(ImportError):
+        from libs.lockers import MissingLockFactory  # noqa: F401
+
+
+def test_no_driver_imported():
+    drivers = ("celery", "kazoo", "pymongo", "redis", "sqlalchemy")
+    code = (
+        "import sys, libs.scheduler, libs.lockers.registry;"
+        f"print(','.join(m for m in {drivers!r} if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert out.stdout.strip() == ""
+
+
+@pytest.fixture
+def cache():
+    yield registry
+    registry.close_all()
+
+
+def test_get_locker_is_cached(cache, tmp_path):
+    url = f"sqlite:///{tmp_path}/locks.db"
+    locker = registry.get_locker(url)
+    assert isinstance(locker, SQLiteLockFactory)
+    assert locker.path == f"{tmp_path}/locks.db"
+    assert registry.get_locker(url) is locker
+    assert registry.get_locker("memory://") is not locker
+
+
+def test_get_locker_quorom(cache):
+    from libs.lockers.quorom import QuoromLockFactory
+
+    locker = registry.get_locker("memory://a", "memory://b", "memory://c")
+    assert isinstance(locker, QuoromLockFactory)
+    assert locker.lockers[0] is registry.get_locker("memory://a")
+    same = registry.get_locker("quorum+memory://a,memory://b,memory://c")
+    assert same is locker
+
+    lock = locker(LockResource("test"), timedelta(seconds=30))
+    assert lock.acquire()
+    assert lock.status
+    lock.release()
+
+
+def test_get_locker_errors(cache):
+    with pytest.raises(ValueError):
+        registry.get_locker()
+    with pytest.raises(ValueError):
+        registry.get_locker("sharded://")
+
+
+def test_get_locker_after_fork(cache):
+    memory = registry.get_locker("memory://")
+    shared = registry.get_locker("shm://")
+    registry._after_fork()
+    assert registry.get_locker("memory://") is not memory
+    assert registry.get_locker("shm://") is shared
@@ -0,0 +1,157 @@
+import random
+import threading
+from datetime import timedelta
+from time import sleep
+
+import pytest
+import redis
+from celery import Celery
+
+from libs.lockers import FailedToAcquireLock, LockResource
+from libs.lockers.memory import InMemoryLockFactory
+from libs.lockers.quorom import QuoromLockFactory
+from libs.runtimes import AdaptiveTTL, QuantileSketch, RedisRuntimes
+from libs.scheduler import scheduled_task
+
+
+@pytest.fixture
+def app():
+    app = Celery()
+    app.config_from_object("celeryconfig")
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def memlocker():
+    return InMemoryLockFactory()
+
+
+def test_sketch_quantiles_within_accuracy():
+    values = [random.Random(i).lognormvariate(0, 1) for i in range(10_000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    values.sort()
+    for q in (0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.02)
+    assert sketch.count == 10_000
+    assert len(sketch.buckets) < 1000
+
+
+def test_sketch_keeps_max_buckets():
+    sketch = QuantileSketch(max_buckets=10)
+    for i in range(1, 100):
+        sketch.add(i)
+    assert len(sketch.buckets) == 10
+    assert sketch.quantile(1) == pytest.approx(99, rel=0.01)
+
+
+def test_suggests_after_min_samples():
+    adaptive = AdaptiveTTL(min_samples=3, factor=2, min_ttl=timedelta(0), refresh=0)
+    for _ in range(2):
+        adaptive.record("report", 5.0)
+    assert adaptive.suggest("report") is None
+    assert adaptive.ttl("report", timedelta(minutes=10)) == timedelta(minutes=10)
+    adaptive.record("report", 5.0)
+    assert adaptive.suggest("report").total_seconds() == pytest.approx(10, rel=0.01)
+    adaptive.apply = False
+    assert adaptive.ttl("report", timedelta(minutes=10)) == timedelta(minutes=10)
+
+
+def test_suggestion_within_bounds():
+    adaptive = AdaptiveTTL(min_samples=1, max_ttl=timedelta(minutes=1), refresh=0)
+    adaptive.record("fast", 0.001)
+    adaptive.record("slow", 3600)
+    assert adaptive.suggest("fast") == timedelta(seconds=1)
+    assert adaptive.suggest("slow") == timedelta(minutes=1)
+
+
+def test_concurrent_records_and_suggestions():
+    adaptive = AdaptiveTTL(min_samples=1, refresh=3600)
+    adaptive.record("report", 1.0)
+    assert adaptive.suggest("report") is not None
+
+    def work(seed):
+        rng = random.Random(seed)
+        for _ in range(2000):
+            adaptive.record("report", rng.lognormvariate(0, 1))
+            adaptive.ttl("report", timedelta(minutes=10))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert adaptive._sketches["report"][1].count == 16001
+    assert adaptive.store.sketch("report").count == 16001
+
+
+def test_scheduled_task_uses_adaptive_ttl(app, memlocker):
+    adaptive = AdaptiveTTL(min_samples=1, min_ttl=timedelta(milliseconds=100))
+    adaptive.record("test_adaptive_task", 0.001)
+
+    @scheduled_task(
+        ttl=timedelta(minutes=10), capp=app, locker=memlocker, adaptive=adaptive
+    )
+    def test_adaptive_task():
+        return 1 + 1
+
+    assert test_adaptive_task() == 2
+    assert adaptive.store.sketch("test_adaptive_task").count == 2
+    # the next runs are locked for min_ttl instead of ten minutes
+    with pytest.raises(FailedToAcquireLock):
+        test_adaptive_task()
+    sleep(0.1)
+    assert test_adaptive_task() == 2
+
+
+def test_lock_renewed_while_running(app, memlocker):
+    adaptive = AdaptiveTTL(min_samples=1, min_ttl=timedelta(milliseconds=60))
+    adaptive.record("test_slow_task", 0.001)
+
+    @scheduled_task(
+        ttl=timedelta(minutes=10), capp=app, locker=memlocker, adaptive=adaptive
+    )
+    def test_slow_task():
+        sleep(0.2)
+        return memlocker(LockResource("test_slow_task"), timedelta(1)).status
+
+    assert test_slow_task()
+
+
+def test_adaptive_ttl_reaches_quorom_members(app):
+    members = [InMemoryLockFactory() for _ in range(3)]
+    adaptive = AdaptiveTTL(
+        min_samples=1, min_ttl=timedelta(milliseconds=60), renew=False
+    )
+    adaptive.record("test_quorom_task", 0.001)
+
+    @scheduled_task(
+        ttl=timedelta(minutes=10),
+        capp=app,
+        locker=QuoromLockFactory(members),
+        adaptive=adaptive,
+    )
+    def test_quorom_task():
+        return [next(member.export("test_quorom_task")).ttl for member in members]
+
+    # the members are locked for min_ttl instead of ten minutes
+    for ttl in test_quorom_task():
+        assert timedelta(0) < ttl <= timedelta(milliseconds=60)
+
+
+def test_redis_runtimes_shared():
+    r = redis.from_url("redis://redis:6379/1")
+    r.flushall()
+    runtimes = RedisRuntimes(r)
+    for seconds in (1.0, 2.0, 0.0):
+        runtimes.record("report", seconds)
+    sketch = RedisRuntimes(r).sketch("report")
+    assert sketch.count == 3
+    assert sketch.zeros == 1
+    assert sketch.quantile(1) == pytest.approx(2.0, rel=0.01)
+    runtimes.reset("report")
+    assert runtimes.sketch("report").count == 0
+    r.close()
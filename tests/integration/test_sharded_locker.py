@@ -0,0 +1,76 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+
+from libs.lockers import CreateLock, LockResource, LockState
+from libs.lockers.sharded import HashRing, ShardedLockFactory
+
+
+@pytest.fixture
+def lockers():
+    return {f"node-{i}": mock.MagicMock(spec=CreateLock) for i in range(3)}
+
+
+@pytest.fixture
+def slocker(lockers):
+    return ShardedLockFactory(lockers)
+
+
+def test_routes_to_same_locker(slocker, lockers):
+    ttl = timedelta(seconds=1)
+    resource = LockResource("test")
+    locker = slocker.locker_for(resource)
+    assert slocker.locker_for(resource) is locker
+    lock = slocker(resource, ttl)
+    locker.assert_called_with(resource, ttl)
+    assert lock is locker.return_value
+
+
+def test_spreads_resources(slocker, lockers):
+    counts = {name: 0 for name in lockers}
+    for i in range(3000):
+        counts[slocker.ring.node_name(f"tenant-{i}")] += 1
+    assert all(count > 600 for count in counts.values())
+
+
+def test_minimal_movement_on_add(slocker):
+    keys = [f"tenant-{i}" for i in range(3000)]
+    before = {key: slocker.ring.node_name(key) for key in keys}
+    slocker.add_locker("node-3", mock.MagicMock(spec=CreateLock))
+    after = {key: slocker.ring.node_name(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "node-3" for key in moved)
+    assert len(moved) < len(keys) / 2
+
+
+def test_remove_locker(slocker):
+    slocker.remove_locker("node-0")
+    assert all(slocker.ring.node_name(f"tenant-{i}") != "node-0" for i in range(100))
+
+
+def test_empty_ring():
+    with pytest.raises(LookupError):
+        HashRing().get("test")
+
+
+def test_held_under_prefix(slocker, lockers):
+    for i, locker in enumerate(lockers.values()):
+        locker.held.return_value = [f"tenant/{i}"]
+        locker.release_all.return_value = 1
+    assert slocker.held("tenant") == ["tenant/0", "tenant/1", "tenant/2"]
+    assert slocker.release_all("tenant") == 3
+
+
+def test_export_restore_per_locker(slocker, lockers):
+    ttl = timedelta(seconds=30)
+    for i, locker in enumerate(lockers.values()):
+        locker.export.return_value = iter([LockState(f"tenant/{i}", "t", ttl)])
+        locker.restore.side_effect = len
+    states = list(slocker.export("tenant"))
+    assert [state.name for state in states] == ["tenant/0", "tenant/1", "tenant/2"]
+    states = [LockState(f"tenant-{i}", "t", ttl) for i in range(30)]
+    assert slocker.restore(states) == 30
+    for locker in lockers.values():
+        (restored,), _ = locker.restore.call_args
+        assert all(slocker.locker_for(LockResource(s.name)) is locker for s in restored)
@@ -0,0 +1,105 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from celery import Celery
+
+from libs.lockers.memory import InMemoryLockFactory
+from libs.scheduler import args_digest, singleflight_task
+
+
+@pytest.fixture
+def app():
+    app = Celery(broker="memory://", backend="cache+memory://")
+    app.conf.task_store_eager_result = True
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def memlocker():
+    return InMemoryLockFactory()
+
+
+@pytest.fixture
+def report(app, memlocker):
+    @singleflight_task(
+        ttl=timedelta(seconds=30),
+        locker=memlocker,
+        capp=app,
+        wait=timedelta(milliseconds=100),
+    )
+    def report(customer_id, currency="EUR"):
+        return f"{customer_id}-{currency}"
+
+    with mock.patch.object(
+        report.task, "apply_async", wraps=report.task.apply_async
+    ) as apply_async:
+        report.sent = apply_async
+        yield report
+
+
+def _work(report):
+    """Run the last sent task the way a worker does"""
+    (args, kwargs), options = report.sent.call_args
+    return report.task.apply(
+        args, kwargs, task_id=options["task_id"], headers=options["headers"]
+    )
+
+
+def test_identical_calls_share_one_run(report):
+    first = report(7)
+    assert report(7).id == first.id
+    assert report.sent.call_count == 1
+
+
+def test_different_arguments_run_apart(report):
+    assert report(7).id != report(8).id
+    assert report(7, currency="USD").id != report(7).id
+    assert report.sent.call_count == 3
+
+
+def test_joined_calls_get_the_result(report):
+    report(7)
+    joined = report(7)
+    _work(report)
+    assert joined.get(timeout=1) == "7-EUR"
+
+
+def test_finished_run_releases_the_key(report, memlocker):
+    first = report(7)
+    assert memlocker.held("report") != []
+    _work(report)
+    assert memlocker.held("report") == []
+    # each run has its own id, the finished result is never reset
+    second = report(7)
+    assert second.id != first.id
+    assert first.get(timeout=1) == "7-EUR"
+    assert report(7).id == second.id
+    assert report.sent.call_count == 2
+
+
+def test_finished_run_keeps_the_key_of_a_later_run(report, memlocker):
+    report(7)
+    run = report.sent.call_args
+    # the lock of the first run was lost, a second run took the key
+    memlocker.release_all("report")
+    second = report(7)
+    report.sent.call_args = run
+    _work(report)
+    assert memlocker.held("report") != []
+    assert report(7).id == second.id
+
+
+def test_key_of_a_finished_run_not_joined(report, memlocker):
+    first = report(7)
+    # a worker unable to release the key
+    report.task.apply((7,), task_id=first.id)
+    assert memlocker.held("report") != []
+    assert report(7).id != first.id
+    assert report.sent.call_count == 2
+
+
+def test_args_digest_ignores_kwargs_order():
+    assert args_digest((1,), {"a": 1, "b": 2}) == args_digest([1], {"b": 2, "a": 1})
+    assert args_digest((1,), {}) != args_digest((2,), {})
@@ -0,0 +1,71 @@
+import io
+import json
+from datetime import timedelta
+
+import pytest
+
+from libs.lockers import LockResource, LockState, registry, snapshot
+from libs.lockers.memory import InMemoryLockFactory
+from libs.lockers.sqlite import SQLiteLockFactory
+
+
+@pytest.fixture
+def memlocker():
+    memlocker = InMemoryLockFactory()
+    for name in ["tenant/a", "tenant/b", "other"]:
+        memlocker(LockResource(name), timedelta(seconds=30)).acquire()
+    return memlocker
+
+
+def test_dump_load_takes_elapsed_time_off():
+    state = LockState("tenant/a", "token", timedelta(seconds=30))
+    line = snapshot.dumps(state, at=1000.0)
+    assert json.loads(line) == {
+        "name": "tenant/a",
+        "token": "token",
+        "ttl_ms": 30000,
+        "at": 1000.0,
+    }
+    assert snapshot.loads(line, now=1010.0).ttl == timedelta(seconds=20)
+
+
+def test_load_skips_expired_locks():
+    out = io.StringIO()
+    states = [
+        LockState("a", "token", timedelta(seconds=30)),
+        LockState("b", "token", timedelta(0)),
+    ]
+    assert snapshot.dump(states, out) == 2
+    assert [state.name for state in snapshot.load(io.StringIO(out.getvalue()))] == ["a"]
+
+
+def test_migrate_keeps_held_locks(memlocker, tmp_path):
+    target = SQLiteLockFactory(str(tmp_path / "locks.db"))
+    held = target(LockResource("tenant/b"), timedelta(seconds=30))
+    held.acquire()
+    assert snapshot.migrate(memlocker, target, prefix="tenant", batch=1) == 1
+    assert target.held("tenant") == ["tenant/a", "tenant/b"]
+    assert target.held("other") == []
+    held.release()
+
+
+def test_migrate_lock_without_owner(tmp_path):
+    source = InMemoryLockFactory()
+    source.restore([LockState("tenant/a", None, timedelta(seconds=30))])
+    target = SQLiteLockFactory(str(tmp_path / "locks.db"))
+    assert snapshot.migrate(source, target) == 1
+    (state,) = target.export("tenant")
+    assert state.token is not None
+    line = snapshot.dumps(LockState("tenant/b", None, timedelta(seconds=30)))
+    assert snapshot.loads(line).token is not None
+
+
+def test_cli_export_restore(memlocker, tmp_path, capsys, monkeypatch):
+    monkeypatch.setitem(registry._lockers, ("memory://",), memlocker)
+    assert snapshot.main(["export", "memory://", "--prefix", "tenant"]) == 0
+    path = tmp_path / "locks.jsonl"
+    path.write_text(capsys.readouterr().out)
+    url = f"sqlite:///{tmp_path / 'locks.db'}"
+    assert snapshot.main(["restore", url, str(path)]) == 0
+    assert "restored 2 locks" in capsys.readouterr().err
+    assert registry.get_locker(url).held("tenant") == ["tenant/a", "tenant/b"]
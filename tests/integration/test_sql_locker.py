@@ -8,7 +8,12 @@ from celery import Celery
 from sqlalchemy.sql.expression import select
 from libs.lockers.sqlalchemy import SQLLockFacotory, _create_all, _drop_all
 from libs.scheduler import scheduled_task, shared_scheduled_task
-from libs.lockers import FailedToAcquireLock, FailedToReleaseLock, LockResource
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    LockResource,
+    LockState,
+)
 from time import sleep
 
 
@@ -73,3 +78,58 @@ def test_lock_status(app, sqllock: SQLLockFacotory):
     lock.acquire()
     sleep(1)
     assert not lock.status
+
+
+def test_stale_lock_can_not_release(sqllock):
+    ttl = timedelta(seconds=1)
+    stale = sqllock(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = sqllock(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_held_under_prefix(sqllock):
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        sqllock(LockResource(name), ttl).acquire()
+    assert sqllock.held("tenant/job") == ["tenant/job/1", "tenant/job/2"]
+    assert sqllock.held("tenant") == ["tenant", "tenant/job/1", "tenant/job/2"]
+    assert sqllock.release_all("tenant/") == 3
+    assert sqllock.held("tenant") == []
+    assert sqllock.held("tenant-2") == ["tenant-2/job"]
+    sqllock(LockResource("tenant/job/1"), ttl).acquire()
+
+
+def test_status_many(sqllock):
+    sqllock(LockResource("status/a"), timedelta(seconds=30)).acquire()
+    resources = [LockResource(name) for name in ["status/a", "status/b"]]
+    assert sqllock.status_many(resources) == {"status/a": True, "status/b": False}
+    assert sqllock.status_many([]) == {}
+
+
+def test_export_restore(sqllock):
+    ttl = timedelta(seconds=30)
+    lock = sqllock(LockResource("export/a"), ttl)
+    lock.acquire()
+    sqllock(LockResource("export/b/c"), ttl).acquire()
+    states = sorted(sqllock.export("export"), key=lambda state: state.name)
+    assert [state.name for state in states] == ["export/a", "export/b/c"]
+    assert states[0].token == lock.token
+    assert timedelta(seconds=25) < states[0].ttl <= ttl
+    assert sqllock.release_all("export") == 2
+    expired = LockState("export/d", "token", timedelta(0))
+    assert sqllock.restore(states + [expired]) == 2
+    assert sqllock.restore(states) == 0
+    assert sorted(sqllock.held("export")) == ["export/a", "export/b/c"]
+    lock.release()
+    assert sqllock.held("export") == ["export/b/c"]
+    sqllock.release_all("export")
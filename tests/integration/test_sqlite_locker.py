@@ -0,0 +1,146 @@
+import multiprocessing
+from datetime import timedelta
+from time import sleep
+
+import pytest
+from celery import Celery
+
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    LockResource,
+    LockState,
+)
+from libs.lockers.sqlite import SQLiteLockFactory
+from libs.scheduler import scheduled_task
+
+
+@pytest.fixture
+def app():
+    app = Celery()
+    app.config_from_object("celeryconfig")
+    yield app
+    app.close()
+
+
+@pytest.fixture
+def litelocker(tmp_path):
+    return SQLiteLockFactory(str(tmp_path / "locks.db"))
+
+
+@pytest.fixture
+def litelock(litelocker):
+    return litelocker(resource=LockResource("test"), timeout=timedelta(seconds=1))
+
+
+def test_sqlite_scheduled_task_locker(app, litelocker):
+    ttl = timedelta(seconds=1)
+
+    @scheduled_task(ttl=ttl, capp=app, locker=litelocker)
+    def test_sqlite_scheduled_task():
+        return 1 + 1
+
+    test_sqlite_scheduled_task()
+    with pytest.raises(FailedToAcquireLock):
+        test_sqlite_scheduled_task()
+    sleep(1)
+    test_sqlite_scheduled_task()
+
+
+def test_lock_status(litelock):
+    litelock.acquire()
+    assert litelock.status
+    litelock.release()
+    assert not litelock.status
+    litelock.acquire()
+    sleep(1)
+    assert not litelock.status
+
+
+def test_lock_context_manager(litelock):
+    with litelock:
+        assert litelock.status
+    assert not litelock.status
+
+
+def test_raises_failed_to_release(litelock):
+    with pytest.raises(FailedToReleaseLock):
+        litelock.release()
+
+
+def _acquire_in_child(path, queue):
+    try:
+        SQLiteLockFactory(path)(LockResource("test"), timedelta(seconds=5)).acquire()
+        queue.put(True)
+    except FailedToAcquireLock:
+        queue.put(False)
+
+
+def test_shared_between_processes(tmp_path):
+    path = str(tmp_path / "locks.db")
+    SQLiteLockFactory(path)
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    children = [
+        ctx.Process(target=_acquire_in_child, args=(path, queue)) for _ in range(4)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+    assert sorted(queue.get() for _ in children) == [False, False, False, True]
+
+
+def test_stale_lock_can_not_release(litelocker):
+    ttl = timedelta(seconds=1)
+    stale = litelocker(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = litelocker(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_held_under_prefix(litelocker):
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        litelocker(LockResource(name), ttl).acquire()
+    assert litelocker.held("tenant/job") == ["tenant/job/1", "tenant/job/2"]
+    assert litelocker.held("tenant") == ["tenant", "tenant/job/1", "tenant/job/2"]
+    assert litelocker.release_all("tenant/") == 3
+    assert litelocker.held("tenant") == []
+    assert litelocker.held("tenant-2") == ["tenant-2/job"]
+    litelocker(LockResource("tenant/job/1"), ttl).acquire()
+
+
+def test_status_many(litelocker):
+    litelocker(LockResource("a"), timedelta(seconds=30)).acquire()
+    resources = [LockResource(name) for name in ["a", "b"]]
+    assert litelocker.status_many(resources) == {"a": True, "b": False}
+    assert litelocker.status_many([]) == {}
+
+
+def test_export_restore(litelocker):
+    ttl = timedelta(seconds=30)
+    lock = litelocker(LockResource("export/a"), ttl)
+    lock.acquire()
+    litelocker(LockResource("export/b/c"), ttl).acquire()
+    states = sorted(litelocker.export("export"), key=lambda state: state.name)
+    assert [state.name for state in states] == ["export/a", "export/b/c"]
+    assert states[0].token == lock.token
+    assert timedelta(seconds=25) < states[0].ttl <= ttl
+    assert litelocker.release_all("export") == 2
+    expired = LockState("export/d", "token", timedelta(0))
+    assert litelocker.restore(states + [expired]) == 2
+    assert litelocker.restore(states) == 0
+    assert sorted(litelocker.held("export")) == ["export/a", "export/b/c"]
+    lock.release()
+    assert litelocker.held("export") == ["export/b/c"]
+    litelocker.release_all("export")
@@ -0,0 +1,198 @@
+from datetime import timedelta
+from time import sleep
+from unittest import mock
+
+import pytest
+
+from libs.lockers import FailedToAcquireLock, LockResource
+from libs.lockers.memory import InMemoryLock, InMemoryLockFactory
+from libs.lockers.tiered import TieredLockFactory
+
+
+@pytest.fixture
+def fast():
+    return InMemoryLockFactory()
+
+
+@pytest.fixture
+def durable():
+    return InMemoryLockFactory()
+
+
+@pytest.fixture
+def tlocker(fast, durable):
+    tlocker = TieredLockFactory(
+        fast, durable, durable_after=timedelta(0), interval=timedelta(minutes=1)
+    )
+    yield tlocker
+    tlocker.close()
+
+
+def _down(fast):
+    """Make the fast tier raise backend errors"""
+    return mock.patch.object(fast.table, "acquire", side_effect=ConnectionError)
+
+
+def test_short_locks_stay_on_fast_tier(tlocker, fast, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    assert lock.acquire()
+    assert fast.held("report") == ["report"]
+    lock.release()
+    assert tlocker.reconciler.run_once() == 0
+    assert durable.held("report") == []
+
+
+def test_held_locks_copied_in_bulk(tlocker, fast, durable):
+    locks = [
+        tlocker(LockResource(f"report/{i}"), timedelta(seconds=30)) for i in range(3)
+    ]
+    for lock in locks:
+        lock.acquire()
+    with mock.patch.object(durable, "restore", wraps=durable.restore) as restore:
+        assert tlocker.reconciler.run_once() == 3
+    assert restore.call_count == 1
+    assert durable.held("report") == ["report/0", "report/1", "report/2"]
+    durable_lock = durable(LockResource("report/0"), timedelta(seconds=30))
+    with pytest.raises(FailedToAcquireLock):
+        durable_lock.acquire()
+    for lock in locks:
+        lock.release()
+    assert durable.held("report") == ["report/0", "report/1", "report/2"]
+    tlocker.reconciler.run_once()
+    assert durable.held("report") == []
+
+
+def test_release_while_copy_pending(tlocker, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    lock.release()
+    with mock.patch.object(durable, "restore") as restore:
+        tlocker.reconciler.run_once()
+    restore.assert_not_called()
+
+
+def test_fails_over_to_durable_tier(tlocker, fast, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    with _down(fast):
+        assert lock.acquire()
+        assert tlocker.failing_over
+        assert durable.held("report") == ["report"]
+        assert lock.status
+        other = tlocker(LockResource("report"), timedelta(seconds=30))
+        with pytest.raises(FailedToAcquireLock):
+            other.acquire()
+    lock.release()
+    assert durable.held("report") == []
+
+
+def test_failover_respects_copied_locks(tlocker, fast):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    tlocker.reconciler.run_once()
+    # the fast tier loses its locks
+    fast.release_all("report")
+    tlocker.fail_over()
+    other = tlocker(LockResource("report"), timedelta(seconds=30))
+    with pytest.raises(FailedToAcquireLock):
+        other.acquire()
+    assert fast.held("report") == []
+
+
+def test_failover_window(fast, durable):
+    tlocker = TieredLockFactory(fast, durable, failover_window=timedelta(0))
+    with _down(fast):
+        assert tlocker(LockResource("report"), timedelta(seconds=30)).acquire()
+    assert not tlocker.failing_over
+    lock = tlocker(LockResource("other"), timedelta(seconds=30))
+    lock.acquire()
+    assert not lock.synced
+    tlocker.close()
+
+
+def test_extend_follows_on_durable_tier(tlocker, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    tlocker.reconciler.run_once()
+    with mock.patch.object(InMemoryLock, "extend") as extend:
+        lock.extend(timedelta(minutes=5))
+        assert extend.call_count == 1
+        tlocker.reconciler.run_once()
+        assert extend.call_count == 2
+    lock.release()
+
+
+def test_status_many_reads_durable_tier_while_failing_over(tlocker, durable):
+    durable(LockResource("report"), timedelta(seconds=30)).acquire()
+    resources = [LockResource("report"), LockResource("other")]
+    assert tlocker.status_many(resources) == {"report": False, "other": False}
+    tlocker.fail_over()
+    assert tlocker.status_many(resources) == {"report": True, "other": False}
+
+
+def test_failover_shared_between_processes(tlocker, fast, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    tlocker.reconciler.run_once()
+    fast.release_all("report")
+    tlocker.fail_over()
+    # a process that never saw the fast tier fail
+    other = TieredLockFactory(fast, durable, durable_after=timedelta(0))
+    with pytest.raises(FailedToAcquireLock):
+        other(LockResource("report"), timedelta(seconds=30)).acquire()
+    assert other.failing_over
+    other.close()
+
+
+def test_fast_tier_lost_its_locks(tlocker, fast, durable):
+    other = TieredLockFactory(
+        fast, durable, durable_after=timedelta(0), interval=timedelta(milliseconds=10)
+    )
+    other.check()
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    tlocker.reconciler.run_once()
+    # the fast tier restarts empty without raising any error
+    fast.release_all("report")
+    fast.release_all("_tiered")
+    sleep(0.02)
+    with pytest.raises(FailedToAcquireLock):
+        other(LockResource("report"), timedelta(seconds=30)).acquire()
+    assert other.failing_over
+    other.close()
+
+
+def test_copy_marks_restored_locks_only(tlocker, durable):
+    stale = durable(LockResource("report/1"), timedelta(seconds=30))
+    stale.acquire()
+    locks = [
+        tlocker(LockResource(f"report/{i}"), timedelta(seconds=30)) for i in range(2)
+    ]
+    for lock in locks:
+        lock.acquire()
+    assert tlocker.reconciler.run_once() == 1
+    assert locks[0].durable is not None
+    assert locks[1].durable is None
+    stale.release()
+    assert tlocker.reconciler.run_once() == 1
+    assert locks[1].durable.token == locks[1].token
+    for lock in locks:
+        lock.release()
+    tlocker.reconciler.run_once()
+    assert durable.held("report") == []
+
+
+def test_extend_during_copy(tlocker, durable):
+    lock = tlocker(LockResource("report"), timedelta(seconds=30))
+    lock.acquire()
+    restore = durable.restore
+
+    def extend_then_restore(states):
+        copied = restore(states)
+        lock.extend(timedelta(minutes=5))
+        return copied
+
+    with mock.patch.object(durable, "restore", side_effect=extend_then_restore):
+        tlocker.reconciler.run_once()
+    (state,) = durable.export("report")
+    assert state.ttl > timedelta(minutes=4)
+    lock.release()
@@ -5,8 +5,16 @@ import pytest
 from celery import Celery
 from libs.lockers.zookeeper import KazooLease, KazooLockFactory
 from libs.scheduler import scheduled_task, shared_scheduled_task
-from libs.lockers import FailedToAcquireLock, FailedToReleaseLock, Lock, LockResource
+from libs.lockers import (
+    FailedToAcquireLock,
+    FailedToReleaseLock,
+    Lock,
+    LockResource,
+    LockState,
+)
+import time
 from time import sleep
+from unittest import mock
 
 
 @pytest.fixture
@@ -91,3 +99,126 @@ def test_lock_context_manager(zklock: KazooLease):
 def test_raises_failed_to_release(zklock: KazooLease):
     with pytest.raises(FailedToReleaseLock):
         zklock.release()
+
+
+def test_stale_lock_can_not_release(zkfactory):
+    ttl = timedelta(seconds=1)
+    stale = zkfactory(LockResource("test"), ttl)
+    stale.acquire()
+    sleep(1)
+    fresh = zkfactory(LockResource("test"), ttl)
+    fresh.acquire()
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    with pytest.raises(FailedToAcquireLock):
+        stale.extend()
+    assert fresh.status
+    fresh.extend(timedelta(seconds=2))
+    fresh.release()
+    assert not fresh.status
+
+
+def test_acquire_many(zkfactory):
+    ttl = timedelta(seconds=1)
+    resources = [LockResource("a"), LockResource("b")]
+    leases = zkfactory.acquire_many(resources, ttl)
+    assert all(lease.status for lease in leases)
+    assert zkfactory.status_many(resources + [LockResource("c")]) == {
+        "a": True,
+        "b": True,
+        "c": False,
+    }
+    with pytest.raises(FailedToAcquireLock):
+        zkfactory.acquire_many([LockResource("c"), LockResource("b")], ttl)
+    assert zkfactory.status_many([LockResource("c")]) == {"c": False}
+    zkfactory.release_many(leases)
+    with pytest.raises(FailedToReleaseLock):
+        zkfactory.release_many(leases)
+    assert zkfactory.status_many(resources) == {"a": False, "b": False}
+
+
+def test_acquire_many_replaces_expired(zkfactory):
+    ttl = timedelta(seconds=1)
+    stale = zkfactory(LockResource("a"), ttl)
+    stale.acquire()
+    sleep(1)
+    leases = zkfactory.acquire_many([LockResource("a"), LockResource("b")], ttl)
+    with pytest.raises(FailedToReleaseLock):
+        stale.release()
+    zkfactory.release_many(leases)
+
+
+def test_acquire_many_after_release_all(zkfactory):
+    ttl = timedelta(seconds=30)
+    resources = [LockResource("tenant/a"), LockResource("tenant/b")]
+    zkfactory.acquire_many(resources, ttl)
+    assert zkfactory.release_all("tenant") == 2
+    leases = zkfactory.acquire_many(resources, ttl)
+    assert zkfactory.held("tenant") == ["tenant/a", "tenant/b"]
+    zkfactory.release_many(leases)
+    # parents deleted behind the back of the factory
+    zkfactory.kz.delete("/tasks", recursive=True)
+    leases = zkfactory.acquire_many(resources, ttl)
+    assert all(lease.status for lease in leases)
+    zkfactory.release_many(leases)
+
+
+def test_missing_parent_is_created_again(zkfactory, zklock: KazooLease):
+    zkfactory.kz.delete("/tasks", recursive=True)
+    zklock.acquire()
+    assert zklock.status
+
+
+def test_held_under_prefix(zkfactory):
+    ttl = timedelta(seconds=30)
+    for name in ["tenant", "tenant/job/1", "tenant/job/2", "tenant-2/job", "other"]:
+        zkfactory(LockResource(name), ttl).acquire()
+    assert zkfactory.held("tenant/job") == ["tenant/job/1", "tenant/job/2"]
+    assert zkfactory.held("tenant") == ["tenant", "tenant/job/1", "tenant/job/2"]
+    assert zkfactory.release_all("tenant/") == 3
+    assert zkfactory.held("tenant") == []
+    assert zkfactory.held("tenant-2") == ["tenant-2/job"]
+    zkfactory(LockResource("tenant/job/1"), ttl).acquire()
+
+
+def test_export_restore(zkfactory):
+    ttl = timedelta(seconds=30)
+    lock = zkfactory(LockResource("export/a"), ttl)
+    lock.acquire()
+    zkfactory(LockResource("export/b/c"), ttl).acquire()
+    states = sorted(zkfactory.export("export"), key=lambda state: state.name)
+    assert [state.name for state in states] == ["export/a", "export/b/c"]
+    assert states[0].token == lock.token
+    assert timedelta(seconds=25) < states[0].ttl <= ttl
+    assert zkfactory.release_all("export") == 2
+    expired = LockState("export/d", "token", timedelta(0))
+    assert zkfactory.restore(states + [expired]) == 2
+    assert zkfactory.restore(states) == 0
+    assert sorted(zkfactory.held("export")) == ["export/a", "export/b/c"]
+    lock.release()
+    assert zkfactory.held("export") == ["export/b/c"]
+    zkfactory.release_all("export")
+
+
+def test_release_with_token_only(zkfactory, zklock):
+    zklock.acquire()
+    other = zkfactory(LockResource("test"), timedelta(seconds=1))
+    other.token = "not-the-owner"
+    with pytest.raises(FailedToReleaseLock):
+        other.release()
+    owner = zkfactory(LockResource("test"), timedelta(seconds=1))
+    owner.token = zklock.token
+    assert owner.release()
+    assert not zklock.status
+
+
+def test_expiry_on_server_clock(zkfactory, zklock):
+    zklock.acquire()
+    assert zklock.status
+    # a worker whose clock runs an hour ahead still sees the lock held
+    skewed = time.time() + 3600
+    with mock.patch("time.time", return_value=skewed):
+        assert zklock.status
+        assert zkfactory.held("test") == ["test"]
+        with pytest.raises(FailedToAcquireLock):
+            zkfactory(LockResource("test"), timedelta(seconds=1)).acquire()